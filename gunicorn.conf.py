@@ -0,0 +1,44 @@
+"""
+gunicorn settings for long-running servers: ``gunicorn -c gunicorn.conf.py``.
+
+The app is loaded once in the master with ``LAZY_STARTUP`` off and warmed
+up before forking, workers share its modules copy-on-write and start
+serving without importing anything. See kajbondhu/startup.py.
+"""
+import gc
+import os
+
+# before the app is loaded, kajbondhu/wsgi.py only sets a default
+os.environ['LAZY_STARTUP'] = 'false'
+
+wsgi_app = 'kajbondhu.wsgi:application'
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# threads keep cheap requests going while others wait on the database or on
+# password hashing, see CONCURRENCY_LIMITS
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+preload_app = True
+
+
+# the app is loaded before the hooks run (preload_app), this one runs once in
+# the master before the first worker is forked
+def when_ready(server):
+    from kajbondhu.startup import warm_up
+
+    warm_up()
+    # objects allocated so far live as long as the process; keeping them out of
+    # the collector's generations stops gc passes from touching (and copying)
+    # the pages shared with the workers
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    from django.db import connections
+
+    # sockets must not be shared across processes, each worker opens its own
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+        if hasattr(connection, 'close_pool'):
+            connection.close_pool()
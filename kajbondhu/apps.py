@@ -0,0 +1,62 @@
+"""
+Admin app configs checking the admin's middleware where it actually runs.
+
+Django's admin checks (admin.E408-E410) look for the session, auth and
+messages middleware in ``MIDDLEWARE``, but here they run from
+``FULL_MIDDLEWARE`` inside ``PathScopedMiddleware`` (see middleware.py).
+These configs register the admin's checks with those three replaced by ones
+that look at the chain a request to the admin is served with, so a
+``PATH_MIDDLEWARE`` entry that takes the admin out of the full stack is
+still reported.
+"""
+from django.contrib.admin import apps
+from django.contrib.admin.checks import check_admin_app, check_dependencies
+from django.core import checks
+from django.urls import URLResolver, get_resolver
+from django.utils.module_loading import import_string
+
+from .middleware import middleware_for
+
+# check id -> middleware the admin needs
+ADMIN_MIDDLEWARE = {
+    'admin.E408': 'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'admin.E409': 'django.contrib.messages.middleware.MessageMiddleware',
+    'admin.E410': 'django.contrib.sessions.middleware.SessionMiddleware',
+}
+
+
+def admin_prefix():
+    """The path the admin site is mounted at, None if it isn't."""
+    # the patterns of the admin itself stay unread, they may be lazy (startup.py)
+    for pattern in get_resolver().url_patterns:
+        if isinstance(pattern, URLResolver) and pattern.namespace == 'admin':
+            return f'/{pattern.pattern}'
+    return None
+
+
+def check_admin_dependencies(**kwargs):
+    errors = [error for error in check_dependencies(**kwargs) if error.id not in ADMIN_MIDDLEWARE]
+    prefix = admin_prefix()
+    if prefix is None:
+        return errors
+    middleware = [import_string(path) for path in middleware_for(prefix)]
+    for check_id, path in ADMIN_MIDDLEWARE.items():
+        if not any(issubclass(cls, import_string(path)) for cls in middleware if isinstance(cls, type)):
+            errors.append(checks.Error(
+                f"'{path}' must run for requests to {prefix} (MIDDLEWARE, or the "
+                f"chain PATH_MIDDLEWARE picks for it) in order to use the admin application.",
+                id=check_id,
+            ))
+    return errors
+
+
+class SimpleAdminConfig(apps.SimpleAdminConfig):
+    def ready(self):
+        checks.register(check_admin_dependencies, checks.Tags.admin)
+        checks.register(check_admin_app, checks.Tags.admin)
+
+
+class AdminConfig(SimpleAdminConfig):
+    def ready(self):
+        super().ready()
+        self.module.autodiscover()
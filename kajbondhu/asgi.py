@@ -3,6 +3,9 @@ ASGI config for kajbondhu project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP requests are served by Django, WebSocket connections to the order
+status endpoint are served by ``usermanagement.realtime``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +16,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kajbondhu.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after Django is set up, the module touches settings and models
+from usermanagement.realtime import WEBSOCKET_PATH, order_status_websocket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == WEBSOCKET_PATH:
+            return await order_status_websocket(scope, receive, send)
+        await receive()
+        await send({'type': 'websocket.close'})
+        return
+    return await django_application(scope, receive, send)
@@ -0,0 +1,99 @@
+"""
+Path-scoped middleware.
+
+The token API does not use sessions, CSRF cookies, messages or clickjacking
+headers, yet with a single ``MIDDLEWARE`` list every API request walks through
+all of them. ``PathScopedMiddleware`` sits last in ``MIDDLEWARE`` and runs one
+of several inner chains depending on the request path: the longest matching
+prefix in ``settings.PATH_MIDDLEWARE`` picks the chain, anything else (admin,
+API docs, static and media files) runs ``settings.FULL_MIDDLEWARE``.
+
+Inner middleware is built the way Django's handler builds ``MIDDLEWARE``, and
+their ``process_view``, ``process_template_response`` and ``process_exception``
+hooks are called for the chain that handled the request, in Django's order.
+"""
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+
+class MiddlewareChain:
+    def __init__(self, paths, get_response):
+        self.view_middleware = []
+        self.template_response_middleware = []
+        self.exception_middleware = []
+        handler = convert_exception_to_response(get_response)
+        for path in reversed(paths):
+            try:
+                instance = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(instance, 'process_view'):
+                self.view_middleware.insert(0, instance.process_view)
+            if hasattr(instance, 'process_template_response'):
+                self.template_response_middleware.append(instance.process_template_response)
+            if hasattr(instance, 'process_exception'):
+                self.exception_middleware.append(instance.process_exception)
+            handler = convert_exception_to_response(instance)
+        self.handler = handler
+
+
+def scoped_middleware(path):
+    """Dotted paths of the inner chain ``PathScopedMiddleware`` runs for `path`."""
+    for prefix, paths in sorted(settings.PATH_MIDDLEWARE.items(), key=lambda item: -len(item[0])):
+        if path.startswith(prefix):
+            return settings.FULL_MIDDLEWARE if paths is None else paths
+    return settings.FULL_MIDDLEWARE
+
+
+def middleware_for(path):
+    """Dotted paths of all the middleware a request to `path` runs, outermost first."""
+    middleware = list(settings.MIDDLEWARE)
+    scoped = f'{__name__}.PathScopedMiddleware'
+    if scoped in middleware:
+        index = middleware.index(scoped)
+        middleware[index:index + 1] = scoped_middleware(path)
+    return middleware
+
+
+class PathScopedMiddleware:
+    def __init__(self, get_response):
+        self.full_chain = MiddlewareChain(settings.FULL_MIDDLEWARE, get_response)
+        # longest prefix first so more specific paths win
+        self.chains = [
+            (prefix, MiddlewareChain(paths, get_response) if paths is not None else self.full_chain)
+            for prefix, paths in sorted(settings.PATH_MIDDLEWARE.items(), key=lambda item: -len(item[0]))
+        ]
+
+    def chain_for(self, path):
+        for prefix, chain in self.chains:
+            if path.startswith(prefix):
+                return chain
+        return self.full_chain
+
+    def __call__(self, request):
+        request._middleware_chain = chain = self.chain_for(request.path_info)
+        return chain.handler(request)
+
+    def _chain(self, request):
+        return getattr(request, '_middleware_chain', None) or self.chain_for(request.path_info)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for process_view in self._chain(request).view_middleware:
+            response = process_view(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        for process_template_response in self._chain(request).template_response_middleware:
+            response = process_template_response(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        for process_exception in self._chain(request).exception_middleware:
+            response = process_exception(request, exception)
+            if response is not None:
+                return response
+        return None
@@ -0,0 +1,41 @@
+"""
+Database connection pool metrics.
+
+With ``OPTIONS['pool']`` set (see ``DB_POOL`` in settings) Django keeps one
+psycopg ``ConnectionPool`` per database alias and worker process.
+``pool_stats`` reports, for every pooled alias, psycopg's counters plus the
+figures used to size the pool: how many connections are busy and how long
+requests waited for one.
+"""
+from django.db import connections
+
+
+def _summary(raw):
+    in_use = raw.get('pool_size', 0) - raw.get('pool_available', 0)
+    requests = raw.get('requests_num', 0)
+    return {
+        'in_use': in_use,
+        'utilization': round(in_use / raw['pool_max'], 3) if raw.get('pool_max') else 0.0,
+        'waiting': raw.get('requests_waiting', 0),
+        # requests_wait_ms only grows for requests that had to queue
+        'avg_wait_ms': round(raw.get('requests_wait_ms', 0) / requests, 3) if requests else 0.0,
+        'queued_ratio': round(raw.get('requests_queued', 0) / requests, 3) if requests else 0.0,
+        'avg_connect_ms': (
+            round(raw.get('connections_ms', 0) / raw['connections_num'], 3)
+            if raw.get('connections_num') else 0.0
+        ),
+    }
+
+
+def pool_stats():
+    """Counters of this process's connection pools keyed by database alias."""
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        # pools open on their first connection; an unopened one counts
+        # min_size connections that do not exist yet
+        if pool is None or pool.closed:
+            continue
+        raw = pool.get_stats()
+        stats[alias] = {**raw, **_summary(raw)}
+    return stats
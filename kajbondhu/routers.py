@@ -0,0 +1,106 @@
+"""
+Database routing between the primary and its read replicas.
+
+Reads made while serving a safe (GET/HEAD/OPTIONS) request go to a replica;
+writes, reads inside transactions, reads of tables that must never lag
+(tokens, sessions, idempotency keys) and everything outside a request
+(management commands, workers, the WebSocket server) use the primary.
+``ReadYourWritesMiddleware`` pins a client to the primary for
+``READ_YOUR_WRITES_SECONDS`` after it wrote, so it never reads a replica that
+has not caught up with its own change yet. The pins are kept in the default
+cache, which has to be shared by every worker process: settings.py refuses
+replicas without ``REDIS_URL``, the local memory cache only pins a client in
+the process that served its write.
+"""
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+# where reads of the current request go; None outside requests
+_read_target = ContextVar('db_read_target', default=None)
+
+
+@contextmanager
+def read_target(target):
+    """Send reads in the block to the primary or to a replica."""
+    token = _read_target.set(target)
+    try:
+        yield
+    finally:
+        _read_target.reset(token)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_target.get() != REPLICA:
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower in settings.PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = replica_aliases()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _client_keys(request):
+    """Cache keys identifying the client across requests."""
+    keys = []
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        keys.append('auth:' + hashlib.sha256(authorization.encode()).hexdigest()[:32])
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session:
+        keys.append('session:' + hashlib.sha256(session.encode()).hexdigest()[:32])
+    if not keys:
+        # anonymous writes (signup, login) have neither yet. Behind a proxy or
+        # NAT many clients share one address, so it only tells apart clients
+        # that have no token or session
+        keys.append('ip:' + request.META.get('REMOTE_ADDR', ''))
+    return ['db-pin:' + key for key in keys]
+
+
+class ReadYourWritesMiddleware:
+    """
+    Route the reads of safe requests to replicas unless the client wrote
+    within the last READ_YOUR_WRITES_SECONDS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_aliases():
+            return self.get_response(request)
+        keys = _client_keys(request)
+        safe = request.method in SAFE_METHODS
+        target = REPLICA if safe and not cache.get_many(keys) else PRIMARY
+        with read_target(target):
+            response = self.get_response(request)
+        if not safe and response.status_code < 400:
+            cache.set_many(dict.fromkeys(keys, 1), settings.READ_YOUR_WRITES_SECONDS)
+        return response
@@ -11,15 +11,26 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import copy
 import os
+from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
-load_dotenv()
+from django.core.exceptions import ImproperlyConfigured
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# read .env next to manage.py without searching the directory tree; a missing
+# file is fine, deploys set the environment directly
+load_dotenv(BASE_DIR / '.env')
+
+# Startup-optimized mode (see kajbondhu/startup.py): admin autodiscovery is
+# deferred to the first /admin/ request. On by default when serving through
+# kajbondhu/wsgi.py, off for manage.py so checks see every ModelAdmin.
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'false').lower() in ('1', 'true', 'yes')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -37,7 +48,8 @@ ALLOWED_HOSTS = ['.vercel.app', '.now.sh', '*']
 INSTALLED_APPS = [
     'unfold',
     'whitenoise.runserver_nostatic', # WhiteNoise for serving static files
-    'django.contrib.admin',
+    # the admin with its middleware checks scoped to /admin/, see kajbondhu/apps.py
+    'kajbondhu.apps.SimpleAdminConfig' if LAZY_STARTUP else 'kajbondhu.apps.AdminConfig',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -66,13 +78,65 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',  # Require authentication by default
     ),
+    # Sliding window limits for login, signup and password reset, per client
+    # IP and per submitted email (see usermanagement/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': os.getenv('THROTTLE_LOGIN_IP', '30/m'),
+        'login_email': os.getenv('THROTTLE_LOGIN_EMAIL', '5/m'),
+        'signup_ip': os.getenv('THROTTLE_SIGNUP_IP', '10/h'),
+        'signup_email': os.getenv('THROTTLE_SIGNUP_EMAIL', '5/h'),
+        'password_reset_ip': os.getenv('THROTTLE_PASSWORD_RESET_IP', '10/h'),
+        'password_reset_email': os.getenv('THROTTLE_PASSWORD_RESET_EMAIL', '3/h'),
+    },
+    # Trusted proxies in front of the app; the client IP is read from
+    # X-Forwarded-For this many hops back. 0 uses REMOTE_ADDR and ignores the
+    # header, which clients can set to anything.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
 }
 
 # Knox settings (optional, customize token expiry)
+# KNOX_TOKEN_TTL_HOURS=0 keeps tokens forever; expired tokens are removed by
+# `manage.py sweep_expired_tokens`
+KNOX_TOKEN_TTL_HOURS = int(os.getenv('KNOX_TOKEN_TTL_HOURS', '720'))
 REST_KNOX = {
-    'TOKEN_TTL': None,  # Tokens never expire (set to timedelta for expiry, e.g., timedelta(hours=24))
+    'TOKEN_TTL': timedelta(hours=KNOX_TOKEN_TTL_HOURS) if KNOX_TOKEN_TTL_HOURS else None,
 }
 
+# Real-time order events (see usermanagement/realtime.py)
+# The in-process broker only reaches WebSocket clients connected to the same
+# process; point this at a shared broker when running several ASGI processes.
+REALTIME_BROKER = os.getenv('REALTIME_BROKER', 'usermanagement.realtime.InProcessBroker')
+
+# Completed/cancelled orders older than this are moved to the archive by
+# `manage.py archive_orders` (see usermanagement/archive.py)
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', '180'))
+
+# Stored responses for requests sent with an Idempotency-Key header are kept
+# this long (see usermanagement/idempotency.py)
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# A key whose request is still running is held this long; after that a retry
+# takes it over (the worker died). Keep it above the longest request, e.g.
+# gunicorn's timeout.
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '60'))
+
+# Provider calendars (see usermanagement/availability.py): an order takes
+# ORDER_DURATION_MINUTES from its order_for_date, days a provider has not set
+# up are open during AVAILABILITY_DEFAULT_OPEN (comma separated HH:MM-HH:MM)
+ORDER_DURATION_MINUTES = int(os.getenv('ORDER_DURATION_MINUTES', '60'))
+AVAILABILITY_DEFAULT_OPEN = os.getenv('AVAILABILITY_DEFAULT_OPEN', '00:00-24:00')
+
+# Automatic provider dispatch (see usermanagement/dispatch.py)
+# Candidates farther away than DISPATCH_MAX_DISTANCE_KM (0 = no limit) are
+# skipped, the rest are scored with DISPATCH_WEIGHTS. The in-memory provider
+# index of a service is reloaded after DISPATCH_INDEX_TTL seconds to pick up
+# other workers' changes.
+DISPATCH_MAX_DISTANCE_KM = float(os.getenv('DISPATCH_MAX_DISTANCE_KM', '50'))
+DISPATCH_DISTANCE_SCALE_KM = float(os.getenv('DISPATCH_DISTANCE_SCALE_KM', '5'))
+DISPATCH_WEIGHTS = {'distance': 0.5, 'rating': 0.3, 'load': 0.2}
+DISPATCH_INDEX_TTL = int(os.getenv('DISPATCH_INDEX_TTL', '30'))
+# best candidates tried before giving up on an order
+DISPATCH_ATTEMPTS = int(os.getenv('DISPATCH_ATTEMPTS', '5'))
+
 # Swagger security definitions
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -87,9 +151,19 @@ SWAGGER_SETTINGS = {
 
 
 MIDDLEWARE = [
+    'kajbondhu.tracing.TracingMiddleware',  # Trace id on every response, spans for sampled requests
     'corsheaders.middleware.CorsMiddleware',  # Add CORS middleware
+    'kajbondhu.shedding.LoadSheddingMiddleware',  # 503 for requests queued too long or over their concurrency limit
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'kajbondhu.routers.ReadYourWritesMiddleware',  # Route safe requests to read replicas
+    'kajbondhu.middleware.PathScopedMiddleware',  # Runs FULL_MIDDLEWARE or a PATH_MIDDLEWARE chain
+]
+
+# Middleware run after the list above, chosen by path (see kajbondhu/middleware.py).
+# The token API needs no sessions, CSRF, messages or frame options; its docs
+# pages and everything else, admin included, keep the full stack.
+FULL_MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -97,6 +171,30 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+PATH_MIDDLEWARE = {
+    '/usermanagment/api/': [
+        'django.middleware.common.CommonMiddleware',
+    ],
+    # None runs FULL_MIDDLEWARE
+    '/usermanagment/api/swagger/': None,
+    '/usermanagment/api/redoc/': None,
+}
+
+# Load shedding (see kajbondhu/shedding.py). Requests the proxy stamped with
+# an X-Request-Start more than LOAD_SHED_MAX_QUEUE_MS ago get a 503 without
+# doing any work (0 disables). The header is only trusted with NUM_PROXIES set. Each worker process runs at most
+# CONCURRENCY_LIMITS requests of a path prefix at once; more wait up to
+# CONCURRENCY_WAIT_MS for a slot, then get a 503 too. Counters are served at
+# /usermanagment/api/metrics/.
+LOAD_SHED_MAX_QUEUE_MS = int(os.getenv('LOAD_SHED_MAX_QUEUE_MS', '5000'))
+LOAD_SHED_RETRY_AFTER = int(os.getenv('LOAD_SHED_RETRY_AFTER', '1'))  # seconds
+CONCURRENCY_WAIT_MS = int(os.getenv('CONCURRENCY_WAIT_MS', '1000'))
+# password hashing endpoints, so they leave threads for everything else
+CONCURRENCY_LIMITS = {
+    '/usermanagment/api/login/': int(os.getenv('CONCURRENCY_LIMIT_LOGIN', '2')),
+    '/usermanagment/api/signup/': int(os.getenv('CONCURRENCY_LIMIT_SIGNUP', '2')),
+    '/usermanagment/api/forgot-password/': int(os.getenv('CONCURRENCY_LIMIT_PASSWORD_RESET', '1')),
+}
 
 ### cors set-up
 
@@ -126,8 +224,12 @@ CORS_ALLOW_HEADERS = [
     'content-type',
     'origin',
     'x-csrftoken',
+    'traceparent',
 ]
 
+# Let browser clients read the trace id of a response
+CORS_EXPOSE_HEADERS = ['x-trace-id']
+
 # Allow credentials (e.g., cookies, authentication headers) if needed
 CORS_ALLOW_CREDENTIALS = True
 
@@ -177,11 +279,74 @@ DATABASES = {
         },
     }
 }
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+# Connection reuse. By default each worker process keeps a psycopg pool so
+# requests skip the TCP + SSL handshake; connections are checked before being
+# handed out. DB_POOL=false falls back to persistent per-thread connections
+# kept for DB_CONN_MAX_AGE seconds. Pool metrics are served at
+# /usermanagment/api/metrics/, `manage.py bench_db_pool` helps size the pool.
+DB_POOL = os.getenv('DB_POOL', 'true').lower() in ('1', 'true', 'yes')
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        # seconds a request waits for a free connection before failing
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        # idle connections above min_size are closed after this many seconds
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica-1.example.com,replica-2.example.com
+# Each becomes a `replica_<n>` alias sharing the primary's credentials; safe
+# API/admin requests read from them (see kajbondhu/routers.py). Needs REDIS_URL.
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+for index, host in enumerate(DB_REPLICA_HOSTS, start=1):
+    # a deep copy: each alias gets its own OPTIONS and pool settings, which
+    # Django and psycopg may change per connection
+    DATABASES[f'replica_{index}'] = {
+        **copy.deepcopy(DATABASES['default']),
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['kajbondhu.routers.ReplicaRouter']
+
+# Clients stay on the primary this long after a write so they read their own changes
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+
+# Models that are always read from the primary because a stale read breaks auth or retries
+PRIMARY_ONLY_MODELS = {
+    'knox.authtoken',
+    'sessions.session',
+    'usermanagement.userdevice',
+    'usermanagement.idempotencykey',
+}
+
+# Cache shared by all workers when REDIS_URL is set (replica pinning and
+# other per-client state must be visible to every worker)
+if DB_REPLICA_HOSTS and not os.getenv('REDIS_URL'):
+    # the per-process cache would pin a client in the worker that served its
+    # write only, the next request could read a lagging replica elsewhere
+    raise ImproperlyConfigured("DB_REPLICA_HOSTS needs REDIS_URL: read-your-writes pinning is kept in the cache.")
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'kajbondhu.tracing.TracedRedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'kajbondhu.tracing.TracedLocMemCache',
+        }
+    }
 
 # Email settings for password reset
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'kajbondhu.tracing.TracedEmailBackend'  # SMTP, traced
 EMAIL_HOST = 'smtp.gmail.com'  # Example: Gmail SMTP
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -191,6 +356,32 @@ DEFAULT_FROM_EMAIL = 'your-email@gmail.com'
 
 
 
+# Request tracing (see kajbondhu/tracing.py). Every response carries an
+# X-Trace-Id header; TRACE_SAMPLE_RATE of the requests also record spans for
+# DB queries, cache calls, password hashing, serializer validation, token
+# creation and email. The sampled flag of an incoming traceparent header is
+# only followed with TRACE_TRUST_PARENT=true, i.e. when the app is reached
+# through trusted upstream services only.
+# Traces are appended to TRACE_FILE as JSON lines, or with TRACE_EXPORTER=otlp
+# posted to an OTLP/HTTP collector (`manage.py trace_collector` runs one locally).
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_TRUST_PARENT = os.getenv('TRACE_TRUST_PARENT', 'false').lower() in ('1', 'true', 'yes')
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'jsonl')
+TRACE_FILE = os.getenv('TRACE_FILE', str(BASE_DIR / 'traces.jsonl'))
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'kajbondhu')
+TRACE_QUEUE_SIZE = 1000  # traces waiting for export per process, more are dropped
+TRACE_MAX_SPANS = 1000  # spans kept per trace, the root span included
+
+# Django's default hashers, PBKDF2 traced
+PASSWORD_HASHERS = [
+    'kajbondhu.tracing.TracedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -228,6 +419,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'  # URL prefix for media files
 MEDIA_ROOT = BASE_DIR / "media"  # Directory where uploaded files are stored
 
+# Uploads are streamed to disk and hashed chunk by chunk, images are stored
+# content-addressed so duplicates share one file (see usermanagement/uploads.py)
+FILE_UPLOAD_HANDLERS = ['usermanagement.uploads.ContentHashUploadHandler']
+UPLOAD_MAX_FILE_SIZE = 5 * 1024 * 1024  # bytes
+UPLOAD_MAX_IMAGE_DIMENSIONS = (4096, 4096)  # width, height in pixels
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
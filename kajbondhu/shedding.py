@@ -0,0 +1,200 @@
+"""
+Load shedding and per-endpoint concurrency limits.
+
+Under a spike gunicorn's backlog grows until clients give up, and workers
+then spend their time on requests nobody waits for anymore. The proxy in
+front of gunicorn stamps each request with the time it arrived, e.g. with
+nginx ``proxy_set_header X-Request-Start "t=${msec}";``, and
+``LoadSheddingMiddleware`` answers requests that already waited longer than
+``LOAD_SHED_MAX_QUEUE_MS`` with a 503 and ``Retry-After`` before doing any
+work. Clients can send these headers too, so they are only read when
+``REST_FRAMEWORK['NUM_PROXIES']`` says the app runs behind a proxy, which
+must then overwrite them on every request.
+
+``CONCURRENCY_LIMITS`` caps the requests a worker process runs at once per
+path prefix (the longest matching prefix wins), so slow password hashing on
+login cannot take every thread of a gthread worker away from cheap reads.
+A request over the limit waits up to ``CONCURRENCY_WAIT_MS``, never past
+its queue deadline, then gets a 503 as well. With sync workers each process
+runs one request at a time and only the queue deadline applies.
+
+The counters, per worker process, are served by the metrics endpoint.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.settings import api_settings
+
+from .tracing import current_span
+
+# upper bounds of the queue time histogram buckets, in milliseconds
+QUEUE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUEUE_HEADERS = ('HTTP_X_REQUEST_START', 'HTTP_X_QUEUE_START')
+
+
+def request_start(value):
+    """Unix time in seconds from an ``X-Request-Start`` value, None if unusable."""
+    value = value.strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        start = float(value)
+    except ValueError:
+        return None
+    # proxies send seconds (nginx ${msec}), milliseconds or microseconds
+    while start > 1e11:
+        start /= 1000
+    return start if start > 0 else None
+
+
+def queue_time_ms(request):
+    """Milliseconds `request` waited since the proxy stamped it, None if unknown."""
+    if not api_settings.NUM_PROXIES:
+        # no trusted proxy, the headers came from the client
+        return None
+    for header in QUEUE_HEADERS:
+        if header in request.META:
+            start = request_start(request.META[header])
+            if start is not None:
+                # clocks of the proxy and this host may be slightly apart
+                return max((time.time() - start) * 1000, 0.0)
+    return None
+
+
+class EndpointLimit:
+    def __init__(self, prefix, limit):
+        self.prefix = prefix
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.waited = 0
+        self.shed = 0
+
+    def acquire(self, timeout):
+        """Take a slot, waiting up to `timeout` seconds. False if none freed up."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waited += 1
+            if timeout <= 0 or not self._slots.acquire(timeout=timeout):
+                with self._lock:
+                    self.shed += 1
+                return False
+        with self._lock:
+            self.admitted += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'peak': self.peak,
+            'admitted': self.admitted,
+            'waited': self.waited,
+            'shed': self.shed,
+        }
+
+
+class LoadStats:
+    """Counters of this worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.shed_late = 0
+        self.queue_ms = [0] * (len(QUEUE_BUCKETS_MS) + 1)
+        # prefix -> EndpointLimit, shared by every handler of the process
+        self.endpoints = {}
+
+    def endpoint(self, prefix, limit):
+        with self._lock:
+            endpoint = self.endpoints.get(prefix)
+            if endpoint is None or endpoint.limit != limit:
+                endpoint = self.endpoints[prefix] = EndpointLimit(prefix, limit)
+            return endpoint
+
+    def started(self, waited_ms):
+        with self._lock:
+            self.in_flight += 1
+            if waited_ms is not None:
+                bucket = next((i for i, bound in enumerate(QUEUE_BUCKETS_MS) if waited_ms <= bound), len(QUEUE_BUCKETS_MS))
+                self.queue_ms[bucket] += 1
+
+    def finished(self, shed_late=False):
+        with self._lock:
+            self.in_flight -= 1
+            self.shed_late += shed_late
+
+    def snapshot(self):
+        labels = [f'<={bound}' for bound in QUEUE_BUCKETS_MS] + [f'>{QUEUE_BUCKETS_MS[-1]}']
+        return {
+            'in_flight': self.in_flight,
+            'shed_late': self.shed_late,
+            'shed_concurrency': sum(endpoint.shed for endpoint in self.endpoints.values()),
+            'queue_ms': dict(zip(labels, self.queue_ms)),
+            'endpoints': {prefix: endpoint.stats() for prefix, endpoint in self.endpoints.items()},
+        }
+
+
+load_stats = LoadStats()
+
+
+def busy_response():
+    response = JsonResponse({'error': 'Server busy, please retry shortly.'}, status=503)
+    response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+    return response
+
+
+class LoadSheddingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # longest prefix first so more specific paths win
+        self.limits = [
+            load_stats.endpoint(prefix, limit)
+            for prefix, limit in sorted(settings.CONCURRENCY_LIMITS.items(), key=lambda item: -len(item[0]))
+        ]
+
+    def limit_for(self, path):
+        for limit in self.limits:
+            if path.startswith(limit.prefix):
+                return limit
+        return None
+
+    def __call__(self, request):
+        waited_ms = queue_time_ms(request)
+        load_stats.started(waited_ms)
+        shed_late = False
+        try:
+            if waited_ms is not None:
+                root = current_span()
+                if root is not None:
+                    root.set(**{'http.queue_ms': round(waited_ms, 1)})
+            deadline = settings.LOAD_SHED_MAX_QUEUE_MS
+            if deadline and waited_ms is not None and waited_ms > deadline:
+                shed_late = True
+                return busy_response()
+            limit = self.limit_for(request.path_info)
+            if limit is None:
+                return self.get_response(request)
+            wait_ms = settings.CONCURRENCY_WAIT_MS
+            if deadline and waited_ms is not None:
+                wait_ms = min(wait_ms, deadline - waited_ms)
+            if not limit.acquire(wait_ms / 1000):
+                return busy_response()
+            try:
+                return self.get_response(request)
+            finally:
+                limit.release()
+        finally:
+            load_stats.finished(shed_late)
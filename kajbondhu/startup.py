@@ -0,0 +1,73 @@
+"""
+Startup modes.
+
+A serverless cold start pays for every import before its first response,
+and most requests never touch the admin or the API docs. With
+``LAZY_STARTUP`` on (the default when serving through kajbondhu/wsgi.py):
+
+- the admin is installed with ``SimpleAdminConfig`` (apps.py).
+  ``admin.autodiscover()``, which imports every ``admin.py`` and the Unfold
+  admin classes, runs when ``LazyAdminURLConf`` is first resolved, i.e. on
+  the first request under /admin/
+- the Swagger/ReDoc schema view and drf_yasg's generators are built by
+  ``lazy_view`` on the first request to the docs
+
+Long-running servers want the opposite. gunicorn.conf.py preloads the app
+in the master process with ``LAZY_STARTUP`` off and calls ``warm_up()``
+before forking, so every worker shares the imported modules copy-on-write
+instead of importing them again.
+"""
+import threading
+
+from django.utils.functional import cached_property
+from django.views.decorators.csrf import csrf_exempt
+
+
+class LazyAdminURLConf:
+    """URLconf of the admin site, discovered on first use."""
+    app_name = 'admin'
+
+    @cached_property
+    def urlpatterns(self):
+        from django.contrib import admin
+
+        # imports are idempotent, running it again after an eager start is a no-op
+        admin.autodiscover()
+        return admin.site.get_urls()
+
+
+def lazy_view(factory):
+    """A view that calls `factory` to build the real view on its first request."""
+    lock = threading.Lock()
+    view = None
+
+    def load():
+        nonlocal view
+        if view is None:
+            with lock:
+                if view is None:
+                    view = factory()
+        return view
+
+    @csrf_exempt
+    def wrapper(request, *args, **kwargs):
+        return load()(request, *args, **kwargs)
+
+    wrapper.load = load
+    return wrapper
+
+
+def warm_up():
+    """Import and build everything requests need, lazy parts included."""
+    from django.contrib import admin
+    from django.urls import URLResolver, get_resolver
+
+    admin.autodiscover()
+    pending = [get_resolver()]
+    while pending:
+        resolver = pending.pop()
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLResolver):
+                pending.append(pattern)
+            elif hasattr(pattern.callback, 'load'):
+                pattern.callback.load()
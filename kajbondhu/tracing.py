@@ -0,0 +1,436 @@
+"""
+Request tracing.
+
+A trace is the tree of timed spans recorded while one request is handled.
+``TracingMiddleware`` opens the root span and decides whether to keep the
+trace: ``TRACE_SAMPLE_RATE`` of the requests are kept. An incoming W3C
+``traceparent`` header keeps the caller's trace id, but its sampled flag is
+only followed with ``TRACE_TRUST_PARENT`` set, when every caller is an
+upstream service; otherwise any client could switch on tracing for its
+requests. Fresh trace ids are sampled on the id, so services sharing a trace
+agree. Every
+response carries the trace id in ``X-Trace-Id``, sampled or not, so a slow
+request reported by a client can be matched with its trace.
+
+``span(name, **attributes)`` opens a child of the current span. Outside a
+sampled trace it only costs a context variable lookup. Spans are recorded for:
+
+- database queries, through an execute wrapper installed for sampled requests
+- cache calls, through the ``Traced*Cache`` backends
+- password hashing, through ``TracedPBKDF2PasswordHasher``
+- SMTP connections and sending, through ``TracedEmailBackend``
+- serializer validation and token creation, with explicit spans in the views
+
+Finished traces are queued for a background thread that writes them with the
+exporter picked by ``TRACE_EXPORTER``: JSON lines appended to ``TRACE_FILE``,
+or OTLP/HTTP JSON posted to ``TRACE_OTLP_ENDPOINT`` (``manage.py
+trace_collector`` is a local stand-in for a collector). Requests never wait
+on the exporter; traces that find the queue full are dropped and counted.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+# longest SQL statement or cache key kept as a span attribute
+MAX_ATTRIBUTE_LENGTH = 500
+
+_current_span = contextvars.ContextVar('tracing_current_span', default=None)
+
+
+class Trace:
+    __slots__ = ('trace_id', 'sampled', 'spans', 'dropped_spans')
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.dropped_spans = 0
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes', 'start_ns', 'end_ns', 'error', '_started')
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._started = time.perf_counter_ns()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, root=False):
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._started
+        # the root span finishes last, one slot is kept for it
+        if root or len(self.trace.spans) < settings.TRACE_MAX_SPANS - 1:
+            self.trace.spans.append(self)
+        else:
+            self.trace.dropped_spans += 1
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span outside a sampled trace."""
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def should_sample(trace_id):
+    # the low 32 bits of a random trace id are uniform
+    return int(trace_id[-8:], 16) < settings.TRACE_SAMPLE_RATE * 0x100000000
+
+
+def _error(exc):
+    return f'{type(exc).__name__}: {exc}'[:MAX_ATTRIBUTE_LENGTH]
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Record the enclosed block as a child of the current span."""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.error = _error(exc)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+@contextlib.contextmanager
+def trace(name, traceparent=None):
+    """
+    Open the root span of a trace, continuing the one in `traceparent` if
+    given. Yields the root span; sampled traces are exported on exit.
+    """
+    match = TRACEPARENT_RE.match(traceparent or '')
+    if match and match[1] != '0' * 32:
+        trace_id, parent_id = match[1], match[2]
+        if settings.TRACE_TRUST_PARENT:
+            sampled = bool(int(match[3], 16) & 1)
+        else:
+            # the caller picks its trace id, so it can't decide the sampling
+            sampled = should_sample(secrets.token_hex(16))
+    else:
+        trace_id = secrets.token_hex(16)
+        parent_id, sampled = None, should_sample(trace_id)
+    root = Span(Trace(trace_id, sampled), name, parent_id)
+    if not sampled:
+        yield root
+        return
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as exc:
+        root.error = _error(exc)
+        raise
+    finally:
+        _current_span.reset(token)
+        if root.trace.dropped_spans:
+            root.set(**{'trace.dropped_spans': root.trace.dropped_spans})
+        root.finish(root=True)
+        export_queue.put(root.trace.spans)
+
+
+def trace_query(execute, sql, params, many, context):
+    """Execute wrapper recording each query as a span."""
+    connection = context['connection']
+    with span('db.query', **{
+        'db.system': connection.vendor,
+        'db.alias': connection.alias,
+        'db.statement': sql[:MAX_ATTRIBUTE_LENGTH],
+    }) as query:
+        if many:
+            query.set(**{'db.executemany': True})
+        return execute(sql, params, many, context)
+
+
+class TracingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with trace(f'{request.method} {request.path_info}', request.headers.get('traceparent')) as root:
+            if root.trace.sampled:
+                with contextlib.ExitStack() as stack:
+                    for alias in connections:
+                        stack.enter_context(connections[alias].execute_wrapper(trace_query))
+                    response = self.get_response(request)
+                match = getattr(request, 'resolver_match', None)
+                if match is not None:
+                    # group traces by route rather than by object ids in the path
+                    root.name = f'{request.method} /{match.route}'
+                root.set(**{
+                    'http.method': request.method,
+                    'http.target': request.path_info,
+                    'http.status_code': response.status_code,
+                })
+            else:
+                response = self.get_response(request)
+        response['X-Trace-Id'] = root.trace.trace_id
+        return response
+
+
+def _cache_span(operation, key=None):
+    attributes = {'cache.key': str(key)[:MAX_ATTRIBUTE_LENGTH]} if key is not None else {}
+    return span(f'cache.{operation}', **attributes)
+
+
+class TracedCacheMixin:
+    def get(self, key, *args, **kwargs):
+        with _cache_span('get', key):
+            return super().get(key, *args, **kwargs)
+
+    def set(self, key, *args, **kwargs):
+        with _cache_span('set', key):
+            return super().set(key, *args, **kwargs)
+
+    def add(self, key, *args, **kwargs):
+        with _cache_span('add', key):
+            return super().add(key, *args, **kwargs)
+
+    def delete(self, key, *args, **kwargs):
+        with _cache_span('delete', key):
+            return super().delete(key, *args, **kwargs)
+
+    def touch(self, key, *args, **kwargs):
+        with _cache_span('touch', key):
+            return super().touch(key, *args, **kwargs)
+
+    def incr(self, key, *args, **kwargs):
+        with _cache_span('incr', key):
+            return super().incr(key, *args, **kwargs)
+
+    def decr(self, key, *args, **kwargs):
+        with _cache_span('decr', key):
+            return super().decr(key, *args, **kwargs)
+
+    def has_key(self, key, *args, **kwargs):
+        with _cache_span('has_key', key):
+            return super().has_key(key, *args, **kwargs)
+
+    def get_many(self, keys, *args, **kwargs):
+        with _cache_span('get_many') as call:
+            call.set(**{'cache.keys': len(keys)})
+            return super().get_many(keys, *args, **kwargs)
+
+    def set_many(self, data, *args, **kwargs):
+        with _cache_span('set_many') as call:
+            call.set(**{'cache.keys': len(data)})
+            return super().set_many(data, *args, **kwargs)
+
+    def delete_many(self, keys, *args, **kwargs):
+        with _cache_span('delete_many') as call:
+            call.set(**{'cache.keys': len(keys)})
+            return super().delete_many(keys, *args, **kwargs)
+
+
+class TracedLocMemCache(TracedCacheMixin, LocMemCache):
+    pass
+
+
+class TracedRedisCache(TracedCacheMixin, RedisCache):
+    pass
+
+
+class TracedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # same algorithm name, existing hashes verify unchanged
+    def encode(self, password, salt, iterations=None):
+        with span('password.hash', **{
+            'hash.algorithm': self.algorithm,
+            'hash.iterations': iterations or self.iterations,
+        }):
+            return super().encode(password, salt, iterations)
+
+
+class TracedEmailBackend(SMTPEmailBackend):
+    def open(self):
+        with span('email.connect', **{'smtp.host': self.host, 'smtp.port': self.port}):
+            return super().open()
+
+    def send_messages(self, email_messages):
+        with span('email.send', **{'email.messages': len(email_messages)}):
+            return super().send_messages(email_messages)
+
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(item.to_dict(), default=str) + '\n' for item in spans)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP JSON
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(spans, service_name):
+    """An OTLP ``ExportTraceServiceRequest`` in its JSON encoding."""
+    # the root span finishes last
+    root = spans[-1]
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{
+            'scope': {'name': __name__},
+            'spans': [
+                {
+                    'traceId': item.trace.trace_id,
+                    'spanId': item.span_id,
+                    'parentSpanId': item.parent_id or '',
+                    'name': item.name,
+                    # SPAN_KIND_SERVER for the request, SPAN_KIND_INTERNAL below it
+                    'kind': 2 if item is root else 1,
+                    'startTimeUnixNano': str(item.start_ns),
+                    'endTimeUnixNano': str(item.end_ns),
+                    'attributes': [
+                        {'key': key, 'value': _otlp_value(value)} for key, value in item.attributes.items()
+                    ],
+                    # STATUS_CODE_ERROR / STATUS_CODE_UNSET
+                    'status': {'code': 2, 'message': item.error} if item.error else {'code': 0},
+                }
+                for item in spans
+            ],
+        }],
+    }]}
+
+
+class OTLPExporter:
+    def __init__(self, endpoint, service_name, timeout=5):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(otlp_payload(spans, self.service_name), default=str).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def get_exporter():
+    if settings.TRACE_EXPORTER == 'otlp':
+        return OTLPExporter(settings.TRACE_OTLP_ENDPOINT, settings.TRACE_SERVICE_NAME)
+    return JsonLinesExporter(settings.TRACE_FILE)
+
+
+class ExportQueue:
+    """Finished traces waiting for the exporter thread of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_worker(self):
+        # the thread does not survive a fork, each worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=settings.TRACE_QUEUE_SIZE)
+                threading.Thread(target=self._run, args=(self._queue,), name='trace-exporter', daemon=True).start()
+                self._pid = os.getpid()
+
+    def put(self, spans):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self, pending):
+        exporter = get_exporter()
+        while True:
+            spans = pending.get()
+            try:
+                exporter.export(spans)
+                self.exported += 1
+            except Exception:
+                self.failed += 1
+                logger.warning("Exporting trace %s failed", spans[-1].trace.trace_id, exc_info=True)
+            finally:
+                pending.task_done()
+
+    def flush(self):
+        """Wait until every queued trace was exported."""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def stats(self):
+        return {
+            'sample_rate': settings.TRACE_SAMPLE_RATE,
+            'exporter': settings.TRACE_EXPORTER,
+            'queued': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            'exported': self.exported,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+export_queue = ExportQueue()
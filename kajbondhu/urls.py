@@ -14,13 +14,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .startup import LazyAdminURLConf
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    # the admin registers its models on the first /admin/ request, see startup.py.
+    # a (urlconf, app_name, namespace) triple like admin.site.urls, include() would
+    # read the patterns right away
+    path('admin/', (LazyAdminURLConf(), 'admin', 'admin')),
     path('usermanagment/api/', include('usermanagement.urls')),  # Include user management app URLs
 
 
@@ -12,6 +12,9 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kajbondhu.settings')
+# defer admin and API docs imports to their first request (cold starts);
+# gunicorn.conf.py turns this off and preloads everything instead
+os.environ.setdefault('LAZY_STARTUP', 'true')
 
 application = get_wsgi_application()
 
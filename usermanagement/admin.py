@@ -1,8 +1,14 @@
 from django.contrib import admin
+from django.db.models import Q
+from . import search
+from .availability import format_ranges, to_mask
+from .exports import export_response
+from .ratings import deferred_rating_updates
 from .models import (
     UserRole, Services, UserProfile, UserRating, PaymentModel,
     UserOrderDetails, OrderStatusHistory, OrderPaymentDetails,
-    UserFeed, FeedImages
+    UserFeed, FeedImages, StoredFile, ArchivedOrder, UserDevice, IdempotencyKey,
+    ProviderAvailability, BackfillCheckpoint,
 )
 
 # Inline for FeedImages to be used in UserFeed admin
@@ -46,7 +52,7 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_filter = ('role', 'is_authenticated', 'location')
     list_editable = ('is_authenticated', 'role')
     raw_id_fields = ('user',)
-    readonly_fields = ('rating',)
+    readonly_fields = ('rating', 'latitude_num', 'longitude_num', 'orders_count', 'completed_orders_count', 'cancelled_orders_count', 'review_count', 'feed_post_count')
     fieldsets = (
         ('User Information', {
             'fields': ('user', 'full_name', 'role', 'is_authenticated')
@@ -55,7 +61,10 @@ class UserProfileAdmin(admin.ModelAdmin):
             'fields': ('phone_number', 'bio', 'profile_picture', 'date_of_birth', 'location')
         }),
         ('Professional Details', {
-            'fields': ('website', 'services', 'rating', 'latitute', 'longitude')
+            'fields': ('website', 'services', 'rating', 'latitute', 'longitude', 'latitude_num', 'longitude_num')
+        }),
+        ('Activity', {
+            'fields': ('orders_count', 'completed_orders_count', 'cancelled_orders_count', 'review_count', 'feed_post_count')
         }),
     )
 
@@ -68,6 +77,11 @@ class UserRatingAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
     date_hierarchy = 'created_at'
 
+    def delete_queryset(self, request, queryset):
+        # recompute each affected profile once instead of once per rating
+        with deferred_rating_updates():
+            super().delete_queryset(request, queryset)
+
 @admin.register(PaymentModel)
 class PaymentModelAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
@@ -85,6 +99,7 @@ class UserOrderDetailsAdmin(admin.ModelAdmin):
     inlines = [OrderStatusHistoryInline, OrderPaymentDetailsInline]
     list_editable = ('status',)
     date_hierarchy = 'order_date'
+    actions = ['export_csv']
     fieldsets = (
         ('Order Information', {
             'fields': ('order_id', 'user', 'booking_user', 'service', 'selected_payment', 'status')
@@ -94,6 +109,10 @@ class UserOrderDetailsAdmin(admin.ModelAdmin):
         }),
     )
 
+    @admin.action(description='Export selected orders with payments (CSV)')
+    def export_csv(self, request, queryset):
+        return export_response(queryset.order_by('order_date'), 'csv')
+
 @admin.register(OrderStatusHistory)
 class OrderStatusHistoryAdmin(admin.ModelAdmin):
     list_display = ('order', 'status', 'changed_at', 'changed_by')
@@ -115,7 +134,8 @@ class OrderPaymentDetailsAdmin(admin.ModelAdmin):
 @admin.register(UserFeed)
 class UserFeedAdmin(admin.ModelAdmin):
     list_display = ('user', 'content_preview', 'created_at')
-    search_fields = ('user__username', 'content')
+    # content is looked up in the search index, see get_search_results
+    search_fields = ('user__username',)
     list_filter = ('created_at',)
     raw_id_fields = ('user',)
     readonly_fields = ('created_at',)
@@ -126,9 +146,74 @@ class UserFeedAdmin(admin.ModelAdmin):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        matches = Q(user__username__icontains=search_term)
+        terms = search.query_terms(search_term)
+        if terms:
+            matches |= Q(pk__in=search.matching_feeds(terms))
+        return queryset.filter(matches), False
+
 @admin.register(FeedImages)
 class FeedImagesAdmin(admin.ModelAdmin):
     list_display = ('feed', 'image')
     search_fields = ('feed__user__username',)
     list_filter = ('feed__created_at',)
-    raw_id_fields = ('feed',)
\ No newline at end of file
+    raw_id_fields = ('feed',)
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'ref_count', 'created_at')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'ref_count', 'created_at')
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('order_id', 'user', 'booking_user', 'status', 'order_date', 'month')
+    search_fields = ('order_id', 'user__username', 'booking_user__username')
+    list_filter = ('status', 'month')
+    raw_id_fields = ('user', 'booking_user')
+    readonly_fields = ('order_id', 'user', 'booking_user', 'status', 'order_date', 'month', 'archived_at', 'payload')
+
+
+@admin.register(UserDevice)
+class UserDeviceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'token_key', 'expiry', 'updated_at')
+    search_fields = ('user__username', 'token_key')
+    raw_id_fields = ('user',)
+    readonly_fields = ('token_key', 'expiry', 'updated_at')
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('user', 'key', 'status_code', 'created_at', 'expires_at')
+    search_fields = ('user__username', 'key')
+    raw_id_fields = ('user',)
+    readonly_fields = ('fingerprint', 'status_code', 'response_body', 'created_at', 'expires_at')
+
+
+@admin.register(ProviderAvailability)
+class ProviderAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'open_hours', 'booked_hours')
+    search_fields = ('user__username',)
+    list_filter = ('date',)
+    raw_id_fields = ('user',)
+    exclude = ('open_slots', 'booked_slots')
+    readonly_fields = ('open_hours', 'booked_hours')
+
+    @admin.display(description='Open')
+    def open_hours(self, obj):
+        return ', '.join(format_ranges(to_mask(obj.open_slots)))
+
+    @admin.display(description='Booked')
+    def booked_hours(self, obj):
+        return ', '.join(format_ranges(to_mask(obj.booked_slots)))
+
+
+@admin.register(BackfillCheckpoint)
+class BackfillCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_pk', 'processed', 'updated', 'started_at', 'updated_at', 'completed_at')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'last_pk', 'processed', 'updated', 'started_at', 'updated_at', 'completed_at')
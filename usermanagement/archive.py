@@ -0,0 +1,174 @@
+"""
+Archival of finished orders.
+
+Completed and cancelled orders older than ``settings.ORDER_ARCHIVE_AFTER_DAYS``
+are copied, together with their status history and payments, into
+ArchivedOrder rows, then deleted from the hot tables in the same transaction.
+The archive is one table with the order's month in an indexed column rather
+than a table or file per month, so it stays queryable with the ORM; a month is
+selected or dropped through that index. ``get_order`` and ``user_orders`` read
+from both places so callers don't need to know where an order lives.
+"""
+import heapq
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedOrder, UserOrderDetails
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+
+
+def serialize_order(order):
+    """Plain JSON representation of an order with history and payments."""
+    data = {
+        'order_id': order.pk,
+        'user': order.user_id,
+        'booking_user': order.booking_user_id,
+        'service': order.service_id,
+        'service_name': order.service.name,
+        'selected_payment': order.selected_payment_id,
+        'selected_payment_name': order.selected_payment.name,
+        'order_details': order.order_details,
+        'order_date': order.order_date,
+        'order_for_date': order.order_for_date,
+        'status': order.status,
+        'history': [
+            {
+                'status': history.status,
+                'changed_at': history.changed_at,
+                'changed_by': history.changed_by_id,
+            }
+            for history in order.orderstatushistory_set.all()
+        ],
+        'payments': [
+            {
+                'payment_method': payment.payment_method,
+                'payment_status': payment.payment_status,
+                'payment_date': payment.payment_date,
+                'transaction_id': payment.transaction_id,
+                'amount': payment.amount,
+                'payment_details': payment.payment_details,
+            }
+            for payment in order.orderpaymentdetails_set.all()
+        ],
+    }
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def _orders_with_relations():
+    return UserOrderDetails.objects.select_related('service', 'selected_payment').prefetch_related(
+        'orderstatushistory_set', 'orderpaymentdetails_set'
+    )
+
+
+def archive_batch(cutoff, batch_size):
+    """Archive up to `batch_size` finished orders placed before `cutoff`."""
+    with transaction.atomic():
+        order_ids = list(
+            UserOrderDetails.objects
+            .filter(status__in=ARCHIVABLE_STATUSES, order_date__lt=cutoff)
+            .order_by('order_date')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+        archived = [
+            ArchivedOrder(
+                order_id=order.pk,
+                user_id=order.user_id,
+                booking_user_id=order.booking_user_id,
+                status=order.status,
+                order_date=order.order_date,
+                month=timezone.localdate(order.order_date).replace(day=1),
+                payload=serialize_order(order),
+            )
+            for order in _orders_with_relations().filter(pk__in=order_ids)
+        ]
+        ArchivedOrder.objects.bulk_create(archived, ignore_conflicts=True)
+        # cascades to the status history and payment rows
+        UserOrderDetails.objects.filter(pk__in=order_ids).delete()
+    return len(order_ids)
+
+
+def archive_orders(older_than_days=None, batch_size=500, pause=0.0):
+    """
+    Archive finished orders in batches, each in its own short transaction.
+    Returns the number of orders archived.
+    """
+    if older_than_days is None:
+        older_than_days = settings.ORDER_ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        count = archive_batch(cutoff, batch_size)
+        total += count
+        if count < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def get_order(order_id):
+    """Return an order as a dict, whether it is live or archived, or None."""
+    order = _orders_with_relations().filter(pk=order_id).first()
+    if order is not None:
+        return {**serialize_order(order), 'archived': False}
+    archived = ArchivedOrder.objects.filter(pk=order_id).values_list('payload', flat=True).first()
+    if archived is not None:
+        return {**archived, 'archived': True}
+    return None
+
+
+def order_keys(model, user_field, user, before=None):
+    """``(order_date, order_id)`` of the `model` rows whose `user_field` is `user`, newest first."""
+    queryset = model.objects.filter(**{user_field: user})
+    if before:
+        queryset = queryset.filter(Q(order_date__lt=before[0]) | Q(order_date=before[0], pk__lt=before[1]))
+    return queryset.order_by('-order_date', '-pk').values_list('order_date', 'pk')
+
+
+def user_orders(user, limit=50, before=None):
+    """
+    Newest orders provided or booked by `user`, live and archived ones merged
+    by ``(order_date, order_id)``, starting after the `before` key of the
+    previous page. Returns the orders and the key of the last one if the page
+    is full, else None.
+    """
+    # each source is read in index order from its own (user, -order_date,
+    # -order_id) index and the four are merged here, an OR of the two user
+    # columns would have to be sorted
+    sources = [
+        [(*key, archived) for key in order_keys(model, field, user, before)[:limit]]
+        for archived, model in ((False, UserOrderDetails), (True, ArchivedOrder))
+        for field in ('user', 'booking_user')
+    ]
+    page, seen = [], set()
+    for order_date, pk, archived in heapq.merge(*sources, reverse=True):
+        # an order booked from the provider's own account is in both user columns
+        if pk not in seen:
+            seen.add(pk)
+            page.append((order_date, pk, archived))
+            if len(page) == limit:
+                break
+
+    live = _orders_with_relations().in_bulk([pk for _, pk, archived in page if not archived])
+    payloads = dict(
+        ArchivedOrder.objects.filter(pk__in=[pk for _, pk, archived in page if archived])
+        .values_list('pk', 'payload')
+    )
+    orders = []
+    for _, pk, archived in page:
+        # left out if it was archived or deleted since its key was read
+        if not archived and pk in live:
+            orders.append({**serialize_order(live[pk]), 'archived': False})
+        elif archived and pk in payloads:
+            orders.append({**payloads[pk], 'archived': True})
+    last = page[-1][:2] if len(page) == limit else None
+    return orders, last
@@ -0,0 +1,290 @@
+"""
+Provider availability calendar.
+
+Each provider has at most one ProviderAvailability row per day holding two
+12 byte bitmaps of the day's 96 fifteen minute slots (local time): the slots
+they work and the slots already booked. A day without a row is open during
+``AVAILABILITY_DEFAULT_OPEN`` and has nothing booked.
+
+A pending order books ``ORDER_DURATION_MINUTES`` from its ``order_for_date``.
+``book`` sets those bits under a row lock, so two bookings cannot take the
+same slots; saving an order whose slots are taken raises SlotsUnavailable
+(see signals.py), and ``set_open_slots`` refuses to close slots pending
+orders hold (SlotsBooked). The bitmap does not say which order holds which
+bit, so when an order is cancelled, completed, deleted or moved ``release``
+rebuilds the day's booked slots from the provider's remaining pending orders
+instead of clearing bits another order may share. ``free_slots`` answers
+"when is anyone free for service X on day D" with a handful of integer
+operations per provider. Providers without a row for that day share one
+precomputed mask.
+"""
+import math
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ProviderAvailability, UserOrderDetails, UserProfile
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BITMAP_BYTES = SLOTS_PER_DAY // 8
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+
+class SlotsUnavailable(Exception):
+    """The provider is closed or booked during the order's slots."""
+
+
+class SlotsBooked(Exception):
+    """Pending orders are booked during slots the provider tried to close."""
+
+    def __init__(self, orders):
+        super().__init__(orders)
+        # ids of the conflicting orders
+        self.orders = orders
+
+
+def to_mask(bitmap):
+    # Postgres returns memoryview, SQLite bytes
+    return int.from_bytes(bytes(bitmap), 'little') if bitmap else 0
+
+
+def to_bitmap(mask):
+    return (mask & FULL_DAY).to_bytes(BITMAP_BYTES, 'little')
+
+
+def slot_time(slot):
+    minutes = slot * SLOT_MINUTES
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def _slot(value):
+    hours, _, minutes = value.strip().partition(':')
+    minutes = int(hours) * 60 + int(minutes or 0)
+    if minutes % SLOT_MINUTES or not 0 <= minutes <= 24 * 60:
+        raise ValueError(f"{value!r} is not a multiple of {SLOT_MINUTES} minutes between 00:00 and 24:00.")
+    return minutes // SLOT_MINUTES
+
+
+def parse_ranges(ranges):
+    """Mask of ``["09:00-12:00", "13:00-18:00"]`` style ranges."""
+    mask = 0
+    for value in ranges:
+        start, sep, end = value.partition('-')
+        if not sep:
+            raise ValueError(f"{value!r} is not a HH:MM-HH:MM range.")
+        first, last = _slot(start), _slot(end)
+        if first >= last:
+            raise ValueError(f"{value!r} ends before it starts.")
+        mask |= ((1 << (last - first)) - 1) << first
+    return mask
+
+
+def format_ranges(mask):
+    """Inverse of parse_ranges."""
+    ranges = []
+    slot = 0
+    while mask >> slot:
+        if mask >> slot & 1:
+            end = slot
+            while mask >> end & 1:
+                end += 1
+            ranges.append(f'{slot_time(slot)}-{slot_time(end)}')
+            slot = end
+        else:
+            slot += 1
+    return ranges
+
+
+def default_open():
+    return parse_ranges(filter(None, settings.AVAILABILITY_DEFAULT_OPEN.split(',')))
+
+
+def booking_slots(order_for_date):
+    """``(date, mask)`` of the slots an order starting at `order_for_date` takes."""
+    local = timezone.localtime(order_for_date)
+    first = (local.hour * 60 + local.minute) // SLOT_MINUTES
+    count = max(math.ceil(settings.ORDER_DURATION_MINUTES / SLOT_MINUTES), 1)
+    # orders are kept within their day
+    return local.date(), (((1 << count) - 1) << first) & FULL_DAY
+
+
+def day_masks(user_ids, date):
+    """``{user_id: (open, booked)}`` of `date` for each of `user_ids`."""
+    user_ids = list(user_ids)
+    rows = ProviderAvailability.objects.filter(date=date, user_id__in=user_ids).values_list(
+        'user_id', 'open_slots', 'booked_slots'
+    )
+    masks = {user_id: (to_mask(open_slots), to_mask(booked)) for user_id, open_slots, booked in rows}
+    default = (default_open(), 0)
+    return {user_id: masks.get(user_id, default) for user_id in user_ids}
+
+
+def is_free(masks, need):
+    open_slots, booked = masks
+    return open_slots & need == need and not booked & need
+
+
+def pending_orders(user_id, date):
+    """The provider's pending orders of `date`."""
+    return UserOrderDetails.objects.filter(
+        user_id=user_id, status='pending',
+        order_for_date__gte=timezone.make_aware(datetime.combine(date, time.min)),
+        order_for_date__lt=timezone.make_aware(datetime.combine(date + timedelta(days=1), time.min)),
+    )
+
+
+def pending_mask(user_id, date, exclude=None):
+    """Booked slots of `date` rebuilt from the provider's pending orders, except order `exclude`."""
+    orders = pending_orders(user_id, date)
+    if exclude is not None:
+        orders = orders.exclude(pk=exclude)
+    mask = 0
+    for order_for_date in orders.values_list('order_for_date', flat=True):
+        mask |= booking_slots(order_for_date)[1]
+    return mask
+
+
+def book(user_id, order_for_date, exclude=None):
+    """
+    Mark the slots of an order with `user_id` at `order_for_date` as booked.
+    Returns False, changing nothing, if they are closed or taken. `exclude`
+    is a pending order being moved, whose current slots don't count.
+    """
+    date, need = booking_slots(order_for_date)
+    rows = ProviderAvailability.objects.select_for_update().filter(user_id=user_id, date=date)
+    with transaction.atomic():
+        row = rows.first()
+        if row is None:
+            open_slots = default_open()
+            if open_slots & need != need:
+                return False
+            try:
+                # first booking of the day, the row is created booked
+                with transaction.atomic():
+                    ProviderAvailability.objects.create(
+                        user_id=user_id, date=date,
+                        open_slots=to_bitmap(open_slots), booked_slots=to_bitmap(need),
+                    )
+                return True
+            except IntegrityError:
+                row = rows.get()
+        booked = to_mask(row.booked_slots) if exclude is None else pending_mask(user_id, date, exclude)
+        if not is_free((to_mask(row.open_slots), booked), need):
+            return False
+        row.booked_slots = to_bitmap(booked | need)
+        row.save(update_fields=['booked_slots'])
+    return True
+
+
+def release(user_id, order_for_date):
+    """
+    Rebuild the booked slots of the day of `order_for_date` from the
+    provider's pending orders. Call it once the order that stopped holding
+    them is saved or deleted.
+    """
+    date, _ = booking_slots(order_for_date)
+    with transaction.atomic():
+        row = ProviderAvailability.objects.select_for_update().filter(user_id=user_id, date=date).first()
+        if row is not None:
+            row.booked_slots = to_bitmap(pending_mask(user_id, date))
+            row.save(update_fields=['booked_slots'])
+
+
+def holds_slots(order):
+    """True if `order`, as last loaded or saved, is pending and so holds booked slots."""
+    return not order._state.adding and order._loaded_status == 'pending'
+
+
+def needs_booking(order):
+    """True if saving `order` takes slots it doesn't hold yet: it becomes pending or moves."""
+    if order.status != 'pending':
+        return False
+    return not holds_slots(order) or (order.user_id, order.order_for_date) != order._loaded_slot
+
+
+def book_order(order):
+    """Book the slots of `order` before it is saved, raising SlotsUnavailable if they are taken."""
+    if not book(order.user_id, order.order_for_date, exclude=order.pk if holds_slots(order) else None):
+        raise SlotsUnavailable
+
+
+def can_book(order):
+    """Like book_order but only checks, for form validation."""
+    date, need = booking_slots(order.order_for_date)
+    open_slots, booked = day_masks([order.user_id], date)[order.user_id]
+    if holds_slots(order):
+        booked = pending_mask(order.user_id, date, exclude=order.pk)
+    return is_free((open_slots, booked), need)
+
+
+def set_open_slots(user, date, mask):
+    """
+    Make `mask` the working slots of `user` on `date`. Raises SlotsBooked,
+    changing nothing, if pending orders are booked during slots it closes.
+    """
+    rows = ProviderAvailability.objects.select_for_update().filter(user=user, date=date)
+    with transaction.atomic():
+        # the lock `book` takes too, no order books the slots while they close
+        row = rows.first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    ProviderAvailability.objects.create(user=user, date=date, open_slots=to_bitmap(mask))
+                return
+            except IntegrityError:
+                # the day's first order was booked meanwhile
+                row = rows.get()
+        closed = to_mask(row.booked_slots) & ~mask
+        if closed:
+            raise SlotsBooked([
+                order_id for order_id, order_for_date in
+                pending_orders(user.pk, date).order_by('order_for_date').values_list('order_id', 'order_for_date')
+                if booking_slots(order_for_date)[1] & closed
+            ])
+        row.open_slots = to_bitmap(mask)
+        row.save(update_fields=['open_slots'])
+
+
+def _starts(free, length):
+    """Slots where `length` consecutive free slots begin."""
+    starts = free
+    for shift in range(1, length):
+        starts &= free >> shift
+    return starts
+
+
+def free_slots(service, date, duration_minutes=None):
+    """
+    ``[(slot start "HH:MM", number of providers)]`` for the slots of `date`
+    where at least one provider of `service` is free for `duration_minutes`
+    (default ORDER_DURATION_MINUTES) in a row. Past slots of today are left out.
+    """
+    length = max(math.ceil((duration_minutes or settings.ORDER_DURATION_MINUTES) / SLOT_MINUTES), 1)
+    providers = UserProfile.objects.filter(services=service).values('user_id')
+    rows = ProviderAvailability.objects.filter(date=date, user_id__in=providers).values_list(
+        'open_slots', 'booked_slots'
+    )
+    counts = [0] * SLOTS_PER_DAY
+    upcoming = FULL_DAY
+    if date == timezone.localdate():
+        now = timezone.localtime()
+        upcoming &= ~((1 << ((now.hour * 60 + now.minute) // SLOT_MINUTES + 1)) - 1)
+
+    def add(starts, times=1):
+        starts &= upcoming
+        while starts:
+            lowest = starts & -starts
+            counts[lowest.bit_length() - 1] += times
+            starts ^= lowest
+
+    with_rows = 0
+    for open_slots, booked in rows:
+        add(_starts(to_mask(open_slots) & ~to_mask(booked) & FULL_DAY, length))
+        with_rows += 1
+    without_rows = providers.count() - with_rows
+    if without_rows:
+        add(_starts(default_open(), length), without_rows)
+    return [(slot_time(slot), count) for slot, count in enumerate(counts) if count]
@@ -0,0 +1,216 @@
+"""
+Online backfills.
+
+Changing how a column of a large table is stored, like the text coordinates
+of UserProfile, can't be a data migration: it would update every row in one
+transaction and hold their locks until the end. The change goes in steps
+instead:
+
+1. expand: a migration adds the new columns as nullable, which does not
+   rewrite the table
+2. dual-write: every save fills the new columns too (signals.py), so rows
+   written from then on are right. Deploy this before backfilling
+3. backfill: ``manage.py run_backfill <name>`` walks the existing rows in
+   primary key order, one short transaction per chunk. A chunk locks only
+   its own rows, so a concurrent save can't be overwritten with a stale
+   value, and the position is stored in BackfillCheckpoint in the same
+   transaction: a run can be stopped at any time and the next one resumes
+   after the last committed chunk. A pause between chunks leaves the
+   database to the live traffic and lets replicas catch up
+4. verify: ``run_backfill <name> --verify`` rechecks every row and reports
+   the ones whose new columns disagree with the old ones
+5. switch the reads to the new columns, then drop the old ones in a later
+   migration
+
+A backfill is a Backfill subclass decorated with ``@register``, naming the
+model, the fields it reads and writes and ``convert``, which computes the
+written values from a row. Keys of any type work, checkpoints store them as
+text.
+"""
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BackfillCheckpoint, UserProfile
+
+# name -> Backfill instance
+BACKFILLS = {}
+
+
+def register(cls):
+    BACKFILLS[cls.name] = cls()
+    return cls
+
+
+class Backfill:
+    name = None
+    model = None
+    # fields convert() reads, and the ones it returns values for
+    source_fields = ()
+    target_fields = ()
+
+    def queryset(self):
+        return self.model._default_manager.all()
+
+    def convert(self, row):
+        """Values of the target fields for `row`."""
+        raise NotImplementedError
+
+    def apply(self, row):
+        """Set the target fields of `row` in memory, True if any changed."""
+        changed = False
+        for field, value in self.convert(row).items():
+            # __dict__ so a deferred target doesn't cost a query
+            if row.__dict__.get(field) != value:
+                setattr(row, field, value)
+                changed = True
+        return changed
+
+    def dual_write(self, instance):
+        """For pre_save: fill the targets of a row about to be saved."""
+        # a deferred source isn't saved either, leave its targets alone
+        if not set(self.source_fields) & instance.get_deferred_fields():
+            self.apply(instance)
+
+    def store_partial(self, instance, update_fields):
+        """For post_save: write the targets a save(update_fields=...) of the sources left out."""
+        if not update_fields or not set(update_fields) & set(self.source_fields):
+            return
+        if set(self.target_fields) <= set(update_fields):
+            return
+        # convert the stored row, the instance may not have every source loaded
+        row = self.rows_after('').filter(pk=instance.pk).first()
+        if row is not None and self.apply(row):
+            self.model._default_manager.filter(pk=row.pk).update(
+                **{field: getattr(row, field) for field in self.target_fields}
+            )
+            for field in self.target_fields:
+                setattr(instance, field, getattr(row, field))
+
+    def rows_after(self, last_pk):
+        """Rows with a greater key than `last_pk` (text, '' for all), in key order."""
+        rows = self.queryset().order_by('pk')
+        if last_pk:
+            rows = rows.filter(pk__gt=self.model._meta.pk.to_python(last_pk))
+        return rows.only(*self.source_fields, *self.target_fields)
+
+
+def get_backfill(name):
+    """The registered backfill called `name`, raising KeyError on unknown names."""
+    return BACKFILLS[name]
+
+
+def get_checkpoint(backfill):
+    """The checkpoint of `backfill`, created on its first run."""
+    # runs started at the same time both insert the row; ignoring the
+    # conflict instead of get_or_create's IntegrityError lets both carry on
+    # with the one that was stored
+    BackfillCheckpoint.objects.bulk_create([BackfillCheckpoint(name=backfill.name)], ignore_conflicts=True)
+    return BackfillCheckpoint.objects.get(name=backfill.name)
+
+
+def reset_checkpoint(backfill):
+    """Forget the progress of `backfill`, its next run starts from the first row."""
+    BackfillCheckpoint.objects.filter(name=backfill.name).delete()
+
+
+def remaining_rows(backfill, checkpoint):
+    """Rows after the checkpoint, including ones created since it completed."""
+    return backfill.rows_after(checkpoint.last_pk).count()
+
+
+def run_chunk(backfill, batch_size):
+    """Process up to `batch_size` rows after the checkpoint. Returns the checkpoint."""
+    with transaction.atomic():
+        # concurrent runs take turns on the checkpoint row instead of repeating chunks
+        checkpoint = BackfillCheckpoint.objects.select_for_update().get(name=backfill.name)
+        if checkpoint.completed_at:
+            return checkpoint
+        rows = list(backfill.rows_after(checkpoint.last_pk).select_for_update()[:batch_size])
+        changed = [row for row in rows if backfill.apply(row)]
+        if changed:
+            backfill.model._default_manager.bulk_update(changed, backfill.target_fields)
+        checkpoint.processed += len(rows)
+        checkpoint.updated += len(changed)
+        if rows:
+            checkpoint.last_pk = str(rows[-1].pk)
+        if len(rows) < batch_size:
+            checkpoint.completed_at = timezone.now()
+        checkpoint.save()
+    return checkpoint
+
+
+def run_backfill(backfill, batch_size=1000, pause=0.0, max_chunks=None, max_seconds=None, progress=None):
+    """
+    Run `backfill` from its checkpoint until every row is done or the
+    `max_chunks`/`max_seconds` budget is spent, sleeping `pause` seconds
+    between chunks. `progress` is called with the checkpoint after each
+    chunk. Returns the checkpoint.
+    """
+    checkpoint = get_checkpoint(backfill)
+    started = time.monotonic()
+    chunks = 0
+    while not checkpoint.completed_at:
+        if chunks == max_chunks or (max_seconds is not None and time.monotonic() - started >= max_seconds):
+            break
+        if chunks and pause:
+            time.sleep(pause)
+        checkpoint = run_chunk(backfill, batch_size)
+        chunks += 1
+        if progress is not None:
+            progress(checkpoint)
+    return checkpoint
+
+
+def verify_backfill(backfill, batch_size=1000, sample=20):
+    """
+    Recheck every row without writing. Returns the number of rows checked,
+    the number whose targets are out of date and the keys of the first
+    `sample` of those.
+    """
+    checked, stale, stale_keys = 0, 0, []
+    last_pk = ''
+    while True:
+        rows = list(backfill.rows_after(last_pk)[:batch_size])
+        if not rows:
+            return checked, stale, stale_keys
+        for row in rows:
+            if backfill.apply(row):
+                stale += 1
+                if len(stale_keys) < sample:
+                    stale_keys.append(row.pk)
+        checked += len(rows)
+        last_pk = str(rows[-1].pk)
+
+
+COORDINATE_STEP = Decimal('0.000001')
+
+
+def parse_coordinate(value, limit):
+    """`value` as a Decimal rounded to 6 places, None unless it is a number within ±`limit`."""
+    if value is None:
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or abs(number) > limit:
+        return None
+    return number.quantize(COORDINATE_STEP)
+
+
+@register
+class CoordinatesBackfill(Backfill):
+    # UserProfile.latitute/longitude (text) into latitude_num/longitude_num
+    name = 'coordinates'
+    model = UserProfile
+    source_fields = ('latitute', 'longitude')
+    target_fields = ('latitude_num', 'longitude_num')
+
+    def convert(self, row):
+        return {
+            'latitude_num': parse_coordinate(row.latitute, 90),
+            'longitude_num': parse_coordinate(row.longitude, 180),
+        }
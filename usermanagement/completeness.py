@@ -0,0 +1,98 @@
+"""
+Profile completeness bitmask.
+
+Each field in PROFILE_FIELDS owns one bit of ``UserProfile.missing_fields_mask``
+which is set while the field is null or blank; ``completeness`` is the share
+of filled fields in percent. Both are kept current by signals.py on profile
+save and on changes to ``services``, so reads never recompute them.
+
+"Profiles missing X" is a bit test, which no index can seek to: it is a scan
+of the partial index ``profile_incomplete_idx``, which holds the incomplete
+profiles only and already in list order. Its cost grows with the number of
+incomplete profiles, not with the table, and the keyset cursor of the view
+stops it after a page of matches.
+"""
+from django.db.models import Exists, F, OuterRef
+
+from .models import UserProfile
+
+PROFILE_FIELDS = (
+    'role', 'full_name', 'phone_number', 'bio', 'profile_picture',
+    'date_of_birth', 'location', 'website', 'latitute', 'longitude', 'services',
+)
+FIELD_BITS = {name: 1 << index for index, name in enumerate(PROFILE_FIELDS)}
+SERVICES_BIT = FIELD_BITS['services']
+ALL_BITS = (1 << len(PROFILE_FIELDS)) - 1
+
+
+def mask_for(names):
+    """Bitmask for the given field names, raising KeyError on unknown ones."""
+    mask = 0
+    for name in names:
+        mask |= FIELD_BITS[name]
+    return mask
+
+
+def missing_fields(mask):
+    return [name for name in PROFILE_FIELDS if mask & FIELD_BITS[name]]
+
+
+def completeness_for(mask):
+    return (len(PROFILE_FIELDS) - bin(mask).count('1')) * 100 // len(PROFILE_FIELDS)
+
+
+def scalar_mask(profile, previous=0):
+    """
+    Bits of the non-M2M fields, read without triggering related queries.
+    Fields not loaded on `profile` (.only()/.defer()) keep their bit from
+    `previous`.
+    """
+    mask = 0
+    for name in PROFILE_FIELDS[:-1]:
+        attname = UserProfile._meta.get_field(name).attname
+        if attname not in profile.__dict__:
+            mask |= previous & FIELD_BITS[name]
+        elif profile.__dict__[attname] in (None, ''):
+            mask |= FIELD_BITS[name]
+    return mask
+
+
+def apply_completeness(profile):
+    """Refresh the mask on an in-memory profile before it is saved."""
+    # the services bit is owned by the m2m_changed handler, new profiles have none
+    previous = profile.missing_fields_mask if profile.pk else SERVICES_BIT
+    profile.missing_fields_mask = scalar_mask(profile, previous) | previous & SERVICES_BIT
+    profile.completeness = completeness_for(profile.missing_fields_mask)
+
+
+def refresh_services_bit(profile_ids):
+    """
+    Recompute the services bit of the given profiles from the M2M table.
+    Returns the new masks by profile id.
+    """
+    has_services = Exists(UserProfile.services.through.objects.filter(userprofile_id=OuterRef('pk')))
+    profiles = list(
+        UserProfile.objects.filter(pk__in=profile_ids)
+        .annotate(has_services=has_services)
+        .only('pk', 'missing_fields_mask', 'completeness')
+    )
+    for profile in profiles:
+        mask = profile.missing_fields_mask & (ALL_BITS ^ SERVICES_BIT)
+        if not profile.has_services:
+            mask |= SERVICES_BIT
+        profile.missing_fields_mask = mask
+        profile.completeness = completeness_for(mask)
+    UserProfile.objects.bulk_update(profiles, ['missing_fields_mask', 'completeness'])
+    return {profile.pk: profile.missing_fields_mask for profile in profiles}
+
+
+def profiles_missing(names):
+    """
+    Incomplete profiles missing every field in `names`, least complete first.
+    Scans profile_incomplete_idx, see the module docstring.
+    """
+    bits = mask_for(names)
+    queryset = UserProfile.objects.filter(missing_fields_mask__gt=0)
+    if bits:
+        queryset = queryset.alias(missing=F('missing_fields_mask').bitand(bits)).filter(missing=bits)
+    return queryset.order_by('completeness', 'pk')
@@ -0,0 +1,319 @@
+"""
+Automatic provider dispatch.
+
+``dispatch_order`` picks the provider for an order from the profiles offering
+the requested service. Candidates come from an in-memory per-service index
+(coordinates, rating and pending orders of every provider), so ranking needs
+no queries: providers farther away than ``DISPATCH_MAX_DISTANCE_KM`` are
+skipped, the rest are scored on distance, rating and pending load, weighted
+by ``DISPATCH_WEIGHTS``. Only the best few are then checked against the
+availability calendar (see availability.py) in one query.
+
+The index of a service is loaded on first use and reloaded after
+``DISPATCH_INDEX_TTL`` seconds, which picks up changes made by other
+processes. Changes made in this process are applied as they commit: order
+saves adjust the load in place, and rating or service changes mark the
+provider for a reload of just its rows.
+
+The order is created in a transaction that books its slots in the
+provider's calendar under a row lock, so two dispatchers can never book the
+same provider twice for one slot. If the slots are gone the next best
+candidate is tried.
+"""
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import availability
+from .models import UserOrderDetails, UserProfile
+
+EARTH_RADIUS_KM = 6371.0
+# providers are bucketed in grid cells of this many degrees (about 5.5 km)
+CELL_DEGREES = 0.05
+CELL_KM = EARTH_RADIUS_KM * math.radians(CELL_DEGREES)
+# cell columns around the globe, columns wrap at the antimeridian
+CELL_COLUMNS = round(360 / CELL_DEGREES)
+# rounds of DISPATCH_ATTEMPTS candidates checked before giving up on an order
+MAX_ROUNDS = 10
+
+
+def _coordinate(value, limit):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return math.radians(value) if -limit <= value <= limit else None
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Haversine distance between two points given in radians."""
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cell_of(lat, lon):
+    """Grid cell of a point given in radians."""
+    return (
+        math.floor(math.degrees(lat) / CELL_DEGREES),
+        math.floor(math.degrees(lon) / CELL_DEGREES) % CELL_COLUMNS,
+    )
+
+
+class Candidate:
+    __slots__ = ('user_id', 'lat', 'lon', 'cell', 'rating', 'pending')
+
+    def __init__(self, user_id, latitute, longitude, rating):
+        self.user_id = user_id
+        self.lat = _coordinate(latitute, 90)
+        self.lon = _coordinate(longitude, 180)
+        self.cell = cell_of(self.lat, self.lon) if self.lat is not None and self.lon is not None else None
+        self.rating = float(rating or 0)
+        self.pending = 0
+
+
+class _ServiceEntry:
+    __slots__ = ('loaded_at', 'candidates', 'cells', 'unlocated', 'best_rating', 'dirty')
+
+    def __init__(self, candidates, loaded_at=None):
+        self.loaded_at = loaded_at or time.monotonic()
+        self.candidates = candidates
+        self.cells = {}
+        self.unlocated = []
+        for candidate in candidates.values():
+            if candidate.cell is None:
+                self.unlocated.append(candidate)
+            else:
+                self.cells.setdefault(candidate.cell, []).append(candidate)
+        self.best_rating = max((c.rating for c in candidates.values()), default=0.0)
+        self.dirty = set()
+
+
+class ProviderIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # service id -> _ServiceEntry
+        self._services = {}
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
+
+    def _load(self, service_id, user_ids=None):
+        profiles = UserProfile.objects.filter(services=service_id)
+        if user_ids is not None:
+            profiles = profiles.filter(user_id__in=user_ids)
+        candidates = {
+            row[0]: Candidate(*row)
+            for row in profiles.values_list('user_id', 'latitute', 'longitude', 'rating')
+        }
+        pending = (
+            UserOrderDetails.objects
+            .filter(user_id__in=profiles.values('user_id'), status='pending', order_for_date__gte=timezone.now())
+            .values('user_id').annotate(n=Count('pk')).values_list('user_id', 'n')
+        )
+        for user_id, n in pending:
+            candidates[user_id].pending = n
+        return candidates
+
+    def entry(self, service_id):
+        """The index of `service_id`, loading or refreshing it as needed."""
+        with self._lock:
+            entry = self._services.get(service_id)
+            dirty = entry.dirty if entry else set()
+            if entry:
+                entry.dirty = set()
+        if entry is None or time.monotonic() - entry.loaded_at > settings.DISPATCH_INDEX_TTL:
+            entry = _ServiceEntry(self._load(service_id))
+            with self._lock:
+                self._services[service_id] = entry
+        elif dirty:
+            # rankings running in other threads keep iterating the old dict
+            candidates = {
+                user_id: candidate for user_id, candidate in entry.candidates.items()
+                if user_id not in dirty
+            }
+            candidates.update(self._load(service_id, dirty))
+            entry = _ServiceEntry(candidates, entry.loaded_at)
+            with self._lock:
+                self._services[service_id] = entry
+        return entry
+
+    def candidates(self, service_id):
+        """The providers of `service_id` by user id."""
+        return self.entry(service_id).candidates
+
+    def mark_dirty(self, user_id):
+        """Reload the rows of provider `user_id` on the next lookup of each service."""
+        with self._lock:
+            for entry in self._services.values():
+                entry.dirty.add(user_id)
+
+    def forget(self, service_id):
+        with self._lock:
+            self._services.pop(service_id, None)
+
+    def apply_order(self, user_id, service_id, previous_status, status):
+        """Update the load of `user_id` after one of their orders was saved or deleted."""
+        delta = (status == 'pending') - (previous_status == 'pending')
+        if not delta:
+            return
+        with self._lock:
+            entry = self._services.get(service_id)
+            candidate = entry.candidates.get(user_id) if entry else None
+            if candidate is None:
+                return
+            candidate.pending = max(candidate.pending + delta, 0)
+
+
+provider_index = ProviderIndex()
+
+
+def rank_providers(service_id, location=None, exclude=(), limit=None):
+    """
+    Providers of `service_id` except the user ids in `exclude`, best first, as
+    ``(score, Candidate)``. `location` is a ``(latitude, longitude)`` pair in
+    degrees; without it distance does not count.
+
+    With a location, a limit and DISPATCH_MAX_DISTANCE_KM set, grid cells are
+    visited ring by ring around the location and the search stops once no
+    farther provider could beat the `limit` best found so far, so only the
+    neighbourhood is scored. The result is the same as scoring everyone.
+    """
+    weights = settings.DISPATCH_WEIGHTS
+    max_distance = settings.DISPATCH_MAX_DISTANCE_KM
+    scale = settings.DISPATCH_DISTANCE_SCALE_KM
+    entry = provider_index.entry(service_id)
+    origin = None
+    if location is not None:
+        lat, lon = _coordinate(location[0], 90), _coordinate(location[1], 180)
+        if lat is not None and lon is not None:
+            origin = (lat, lon)
+
+    def score(candidate):
+        """Score of `candidate`, None if it cannot take the order."""
+        if candidate.user_id in exclude:
+            return None
+        closeness = 0.5
+        # a provider with one of its coordinates missing is not located
+        if origin is not None and candidate.cell is not None:
+            km = distance_km(origin[0], origin[1], candidate.lat, candidate.lon)
+            if max_distance and km > max_distance:
+                return None
+            closeness = 1 / (1 + km / scale)
+        return (
+            weights['distance'] * closeness
+            + weights['rating'] * candidate.rating / 5
+            + weights['load'] / (1 + candidate.pending)
+        )
+
+    if not (origin and limit and max_distance):
+        scored = ((score(c), c) for c in entry.candidates.values())
+        scored = [item for item in scored if item[0] is not None]
+        key = lambda item: (item[0], -item[1].user_id)
+        if limit:
+            return heapq.nlargest(limit, scored, key=key)
+        return sorted(scored, key=key, reverse=True)
+
+    # min-heap of the best `limit` as (score, -user_id, candidate)
+    best = []
+
+    def offer(candidate):
+        value = score(candidate)
+        if value is None:
+            return
+        item = (value, -candidate.user_id, candidate)
+        if len(best) < limit:
+            heapq.heappush(best, item)
+        elif item[:2] > best[0][:2]:
+            heapq.heapreplace(best, item)
+
+    for candidate in entry.unlocated:
+        offer(candidate)
+    # narrowest cell width within reach, cells shrink east-west towards the poles
+    reach = min(abs(math.degrees(origin[0])) + math.degrees(max_distance / EARTH_RADIUS_KM) + CELL_DEGREES, 89.0)
+    cell_km = CELL_KM * math.cos(math.radians(reach))
+    others = weights['rating'] * entry.best_rating / 5 + weights['load']
+    row, col = cell_of(*origin)
+    # wide rings near the poles wrap around onto columns visited before
+    visited = set()
+    ring = 0
+    while True:
+        if ring == 0:
+            cells = [(row, col)]
+        else:
+            cells = [(row + d, col + e) for d in (-ring, ring) for e in range(-ring, ring + 1)]
+            cells += [(row + d, col + e) for d in range(-ring + 1, ring) for e in (-ring, ring)]
+        for cell in cells:
+            cell = (cell[0], cell[1] % CELL_COLUMNS)
+            if cell in visited:
+                continue
+            visited.add(cell)
+            for candidate in entry.cells.get(cell, ()):
+                offer(candidate)
+        # every provider not visited yet is at least this far away
+        nearest = ring * cell_km
+        if nearest > max_distance:
+            break
+        if len(best) == limit and best[0][0] > weights['distance'] / (1 + nearest / scale) + others:
+            break
+        ring += 1
+    return [(value, candidate) for value, _, candidate in sorted(best, reverse=True)]
+
+
+def _book(candidate, order_for_date, **fields):
+    """Create the order with `candidate` unless its slots were taken meanwhile."""
+    with transaction.atomic():
+        # dispatchers racing for the same provider skip it instead of waiting.
+        # no ordering (Meta.ordering joins auth_user) and only the profile row
+        # is locked, so logins updating the user row are not held up
+        locked = (
+            UserProfile.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(user_id=candidate.user_id).order_by().values_list('pk', flat=True).first()
+        )
+        if locked is None:
+            return None
+        order = UserOrderDetails(user_id=candidate.user_id, order_for_date=order_for_date, **fields)
+        try:
+            # books the slots, see signals.py
+            order.save()
+        except availability.SlotsUnavailable:
+            return None
+    return order
+
+
+def dispatch_order(booking_user, service, selected_payment, order_for_date, order_details=None, location=None):
+    """
+    Create a pending order of `service` with the best free provider and
+    return it, or None when no provider can take it.
+    """
+    if location is None:
+        profile = UserProfile.objects.filter(user=booking_user).values_list('latitute', 'longitude').first()
+        location = profile if profile and None not in profile else None
+    date, need = availability.booking_slots(order_for_date)
+    tried = {booking_user.pk}
+    for _ in range(MAX_ROUNDS):
+        ranked = rank_providers(service.pk, location, exclude=tried, limit=settings.DISPATCH_ATTEMPTS)
+        if not ranked:
+            return None
+        masks = availability.day_masks([candidate.user_id for _, candidate in ranked], date)
+        for _, candidate in ranked:
+            tried.add(candidate.user_id)
+            if not availability.is_free(masks[candidate.user_id], need):
+                continue
+            order = _book(
+                candidate, order_for_date,
+                booking_user=booking_user, service=service,
+                selected_payment=selected_payment, order_details=order_details,
+            )
+            if order is not None:
+                return order
+    return None
@@ -0,0 +1,126 @@
+"""
+Idempotency-Key support for write endpoints.
+
+The first request carrying a given key stores a fingerprint of the request
+and, once the view has run, its response. Retries with the same key are
+answered from that row with a single indexed lookup and never reach the
+view again; reusing a key for a different request is rejected.
+
+While the first request runs, its row is a lease that expires after
+``IDEMPOTENCY_LEASE_SECONDS``: retries get 409 until then, and if the worker
+died meanwhile the next retry takes the key over instead of waiting for the
+full ``IDEMPOTENCY_KEY_TTL_HOURS``. A request that outlives its lease only
+stores its response if nobody took the key over, otherwise its writes are
+rolled back.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .utils import delete_in_batches
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method}\n{request.path}\n{body}'.encode()).hexdigest()
+
+
+def _in_progress():
+    return Response(
+        {'error': f'A request with this {HEADER} is still being processed'},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def _replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record.status_code is None:
+        return _in_progress()
+    return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def _claim(user, key, fingerprint):
+    """Insert the in-progress row for `key`, or return the existing one."""
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None and record.expires_at > now:
+        return record, False
+    if record is not None:
+        # an expired response or the lease of a request that never finished
+        record.delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS),
+            ), True
+    except IntegrityError:
+        # a concurrent request with the same key got there first
+        return IdempotencyKey.objects.get(user=user, key=key), False
+
+
+def idempotent(view_method):
+    """
+    Decorate an APIView handler so requests with an Idempotency-Key header
+    run at most once per user and key. Requests without the header are
+    handled as usual.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f'{HEADER} must be at most 255 characters'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, claimed = _claim(request.user, key, fingerprint)
+        if not claimed:
+            return _replay(record, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code >= 500:
+                    raise _NotStored(response)
+                stored = IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).update(
+                    status_code=response.status_code,
+                    response_body=json.loads(json.dumps(response.data, default=str)),
+                    expires_at=timezone.now() + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+                )
+                if not stored:
+                    # the lease ran out and a retry took the key over
+                    raise _NotStored(_in_progress())
+        except _NotStored as e:
+            # the view's writes were rolled back, let the client retry
+            record.delete()
+            return e.response
+        except Exception:
+            record.delete()
+            raise
+        return response
+
+    return wrapper
+
+
+class _NotStored(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def purge_expired_keys(batch_size=1000, pause=0.0):
+    return delete_in_batches(IdempotencyKey.objects.filter(expires_at__lt=timezone.now()), batch_size, pause)
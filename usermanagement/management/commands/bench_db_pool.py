@@ -0,0 +1,103 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def _sizes(value):
+    try:
+        sizes = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) < 0:
+        raise CommandError(f"Expected a comma separated list of non-negative numbers, got {value!r}.")
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark query latency against Postgres for each combination of "
+        "worker count and pool size. Pool size 0 opens a new connection per "
+        "request, which is what an unpooled worker does. Run it against a local "
+        "Postgres with --dsn, or against a configured database alias."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dsn', help="Connection string used instead of the alias, e.g. postgresql://postgres@localhost/bench")
+        parser.add_argument('--workers', default='1,4,16', help="Comma separated numbers of concurrent workers")
+        parser.add_argument('--pool-sizes', default='0,2,4,8,16', help="Comma separated pool sizes, 0 for no pool")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per run, spread over the workers")
+        parser.add_argument('--work-ms', type=float, default=2.0, help="Time each request holds its connection (pg_sleep)")
+
+    def handle(self, *args, **options):
+        try:
+            import psycopg
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise CommandError("The benchmark needs psycopg[pool] (see requirements.txt).")
+
+        if options['dsn']:
+            conninfo, kwargs = options['dsn'], {}
+        else:
+            connection = connections[options['database']]
+            if connection.vendor != 'postgresql':
+                raise CommandError(f"Database '{options['database']}' is not Postgres, pass --dsn.")
+            conninfo, kwargs = '', connection.get_connection_params()
+        kwargs['autocommit'] = True
+        worker_counts = _sizes(options['workers'])
+        if 0 in worker_counts:
+            raise CommandError("Worker counts must be at least 1.")
+        query = f"SELECT pg_sleep({options['work_ms'] / 1000:.4f})" if options['work_ms'] > 0 else 'SELECT 1'
+
+        self.stdout.write(f"{'workers':>7} {'pool':>5} {'p50 ms':>9} {'p95 ms':>9} {'req/s':>9} {'wait ms':>9} {'queued':>7}")
+        for pool_size in _sizes(options['pool_sizes']):
+            for workers in worker_counts:
+                if pool_size:
+                    pool = ConnectionPool(conninfo, kwargs=kwargs, min_size=pool_size, max_size=pool_size, open=True)
+                    try:
+                        # measure a warm pool, not the initial handshakes
+                        pool.wait(timeout=30)
+                        result = self.run(pool.connection, workers, options['requests'], query)
+                        stats = pool.get_stats()
+                    finally:
+                        pool.close()
+                    requests = stats.get('requests_num', 0) or 1
+                    wait_ms = stats.get('requests_wait_ms', 0) / requests
+                    queued = stats.get('requests_queued', 0) / requests
+                else:
+                    result = self.run(lambda: psycopg.connect(conninfo, **kwargs), workers, options['requests'], query)
+                    wait_ms, queued = 0.0, 0.0
+                p50, p95, throughput = result
+                self.stdout.write(
+                    f"{workers:>7} {pool_size or '-':>5} {p50:>9.2f} {p95:>9.2f} {throughput:>9.1f} {wait_ms:>9.2f} {queued:>7.0%}"
+                )
+
+    def run(self, connect, workers, requests, query):
+        """Run `requests` queries over `workers` threads, return (p50 ms, p95 ms, req/s)."""
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(count):
+            timings = []
+            for _ in range(count):
+                start = time.perf_counter()
+                with connect() as conn:
+                    conn.execute(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            with lock:
+                latencies.extend(timings)
+
+        shares = [requests // workers + (1 if i < requests % workers else 0) for i in range(workers)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(worker, share) for share in shares if share]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        if len(latencies) < 2:
+            raise CommandError("Use at least two requests per run.")
+        percentiles = statistics.quantiles(latencies, n=100)
+        return percentiles[49], percentiles[94], len(latencies) / elapsed
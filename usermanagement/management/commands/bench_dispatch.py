@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from usermanagement.dispatch import dispatch_order, provider_index, rank_providers
+from usermanagement.models import PaymentModel, Services, UserProfile
+
+PREFIX = 'bench-dispatch-'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure provider ranking and order dispatch throughput on synthetic "
+        f"providers. Creates users named {PREFIX}* with their profiles and "
+        "orders, and deletes them when done."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--providers', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=1, help="Threads dispatching concurrently")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Users named {PREFIX}* already exist, remove them first.")
+        if options['workers'] < 1 or options['orders'] < 2:
+            raise CommandError("Use at least one worker and two orders.")
+        rng = random.Random(options['seed'])
+        service, created_service = Services.objects.get_or_create(name=f'{PREFIX}service')
+        payment, created_payment = PaymentModel.objects.get_or_create(name=f'{PREFIX}payment')
+        try:
+            bookers = self.seed(service, options['providers'], rng)
+            now = timezone.now().replace(minute=0, second=0, microsecond=0)
+            requests = [
+                (
+                    rng.choice(bookers),
+                    now + timedelta(hours=rng.randrange(1, 24 * 7)),
+                    (23.8 + rng.uniform(-0.2, 0.2), 90.4 + rng.uniform(-0.2, 0.2)),
+                )
+                for _ in range(options['orders'])
+            ]
+            provider_index.clear()
+            started = time.perf_counter()
+            provider_index.candidates(service.pk)
+            self.stdout.write(f"index load: {(time.perf_counter() - started) * 1000:.1f} ms for {options['providers']} providers")
+
+            latencies = []
+            started = time.perf_counter()
+            for booker, when, location in requests:
+                start = time.perf_counter()
+                rank_providers(service.pk, location, exclude={booker.pk}, limit=5)
+                latencies.append((time.perf_counter() - start) * 1000)
+            self.report('ranking', latencies, time.perf_counter() - started)
+
+            latencies, failed = [], []
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                shares = [requests[i::options['workers']] for i in range(options['workers'])]
+                for future in [executor.submit(self.dispatch_all, share, service, payment) for share in shares]:
+                    timings, misses = future.result()
+                    latencies.extend(timings)
+                    failed.append(misses)
+            self.report('dispatch', latencies, time.perf_counter() - started)
+            self.stdout.write(f"unassigned orders: {sum(failed)}")
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+            if created_service:
+                service.delete()
+            if created_payment:
+                payment.delete()
+            provider_index.clear()
+
+    def seed(self, service, count, rng):
+        User.objects.bulk_create([User(username=f'{PREFIX}{i}') for i in range(count + 50)])
+        users = list(User.objects.filter(username__startswith=PREFIX).order_by('pk'))
+        UserProfile.objects.bulk_create([
+            UserProfile(
+                user=user,
+                latitute=f'{23.8 + rng.uniform(-0.3, 0.3):.6f}',
+                longitude=f'{90.4 + rng.uniform(-0.3, 0.3):.6f}',
+                rating=round(rng.uniform(1, 5), 2),
+            )
+            for user in users
+        ])
+        profiles = UserProfile.objects.filter(user__in=users[:count])
+        through = UserProfile.services.through
+        through.objects.bulk_create([
+            through(userprofile_id=pk, services_id=service.pk)
+            for pk in profiles.values_list('pk', flat=True)
+        ])
+        return users[count:]
+
+    def dispatch_all(self, requests, service, payment):
+        timings, misses = [], 0
+        try:
+            for booker, when, location in requests:
+                start = time.perf_counter()
+                order = dispatch_order(booker, service, payment, when, location=location)
+                timings.append((time.perf_counter() - start) * 1000)
+                misses += order is None
+        finally:
+            connection.close()
+        return timings, misses
+
+    def report(self, name, latencies, elapsed):
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"{name}: {len(latencies) / elapsed:.0f}/s, "
+            f"p50 {percentiles[49]:.2f} ms, p95 {percentiles[94]:.2f} ms"
+        )
@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from kajbondhu.middleware import PathScopedMiddleware
+
+SCOPED_MIDDLEWARE = 'kajbondhu.middleware.PathScopedMiddleware'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-request middleware overhead for the given paths with the "
+        "full middleware stack on every path (the old setup) and with the "
+        "path-scoped stack, relative to running no middleware at all."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/usermanagment/api/'])
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--token', help="Knox token sent as the Authorization header")
+        parser.add_argument('--cookie', action='append', default=[], help="name=value cookie sent with each request")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError("Use at least two requests.")
+        outer = [path for path in settings.MIDDLEWARE if path != SCOPED_MIDDLEWARE]
+        stacks = {
+            'none': [],
+            'full': outer + settings.FULL_MIDDLEWARE,
+            'scoped': settings.MIDDLEWARE,
+        }
+        scoped = PathScopedMiddleware(lambda request: None)
+        headers = {'Authorization': f"Token {options['token']}"} if options['token'] else {}
+
+        self.stdout.write(f"{'path':<40} {'stack':<7} {'p50 us':>9} {'p95 us':>9} {'overhead us':>12}")
+        for path in options['paths']:
+            timings = {}
+            for name, stack in stacks.items():
+                # views behind the full stack (admin) need its auth middleware, no bare baseline
+                if name == 'none' and scoped.chain_for(path) is scoped.full_chain:
+                    continue
+                timings[name] = self.measure(stack, path, headers, options)
+            base = timings.get('none', (None,))[0]
+            for name, (p50, p95) in timings.items():
+                overhead = f"{p50 - base:>12.1f}" if name != 'none' and base is not None else f"{'-':>12}"
+                self.stdout.write(f"{path:<40} {name:<7} {p50:>9.1f} {p95:>9.1f} {overhead}")
+
+    def measure(self, stack, path, headers, options):
+        """p50 and p95 of the request time in microseconds with `stack` as MIDDLEWARE."""
+        with override_settings(MIDDLEWARE=stack):
+            client = Client(headers=headers)
+            for cookie in options['cookie']:
+                name, _, value = cookie.partition('=')
+                client.cookies[name] = value
+            # the first request builds the middleware chain
+            client.get(path)
+            latencies = []
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                client.get(path)
+                latencies.append((time.perf_counter() - start) * 1e6)
+        percentiles = statistics.quantiles(latencies, n=100)
+        return percentiles[49], percentiles[94]
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from usermanagement.query_plans import ALLOWED_SCANS, SUPPORTED_VENDORS, explain, hot_queries, plan_problems
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the hot queries and fail if any of them reads a whole table "
+        "or index, other than the scans allowed in ALLOWED_SCANS, or needs an "
+        "extra sort step. The same checks run in the test suite."
+    )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in SUPPORTED_VENDORS:
+            raise CommandError(f"Query plan checks are not supported on {vendor}.")
+
+        failures = 0
+        for name, queryset in hot_queries().items():
+            plan = explain(queryset)
+            problems = plan_problems(plan, vendor, ALLOWED_SCANS.get(name, ()))
+            if problems:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f"{name}: {'; '.join(problems)}"))
+                if options['verbosity'] > 1:
+                    self.stdout.write(plan)
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: ok"))
+
+        if failures:
+            raise CommandError(f"{failures} hot queries need a full scan or a sort.")
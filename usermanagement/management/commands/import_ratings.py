@@ -0,0 +1,79 @@
+import csv
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Upper
+from django.utils.dateparse import parse_datetime
+
+from usermanagement.ratings import bulk_ingest_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Import ratings from a CSV or NDJSON file with columns user_id or email, "
+        "rating (1-5), and optional comment and created_at. Profiles are "
+        "recomputed once per user after the import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.skipped = 0
+        try:
+            source = open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(str(e))
+        with source:
+            if path.endswith(('.ndjson', '.jsonl')):
+                records = (json.loads(line) for line in source if line.strip())
+            else:
+                records = csv.DictReader(source)
+            inserted = bulk_ingest_ratings(self.clean(records, options['batch_size']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Imported {inserted} ratings, skipped {self.skipped} invalid rows."))
+
+    def clean(self, records, batch_size):
+        """Validate rows, resolving users a batch at a time."""
+        pending = []
+        for record in records:
+            pending.append(record)
+            if len(pending) == batch_size:
+                yield from self.resolve(pending)
+                pending = []
+        yield from self.resolve(pending)
+
+    def users_by_email(self, emails):
+        """``{EMAIL: user id}`` of `emails` (upper-cased), matched ignoring case like login does."""
+        users = {}
+        if emails:
+            # UPPER(email) IN (...), which the auth_user_email_upper_idx serves on Postgres
+            rows = (
+                User.objects.alias(email_upper=Upper('email')).filter(email_upper__in=emails)
+                .order_by('pk').values_list('email', 'pk')
+            )
+            for email, pk in rows:
+                users.setdefault(email.upper(), pk)
+        return users
+
+    def resolve(self, records):
+        emails = {r['email'].strip().upper() for r in records if not r.get('user_id') and r.get('email')}
+        ids_by_email = self.users_by_email(emails)
+        ids = {str(r['user_id']) for r in records if r.get('user_id')}
+        known_ids = {str(pk) for pk in User.objects.filter(pk__in=[i for i in ids if i.isdigit()]).values_list('pk', flat=True)}
+        for record in records:
+            if record.get('user_id'):
+                user_id = str(record['user_id'])
+            else:
+                user_id = ids_by_email.get((record.get('email') or '').strip().upper())
+            try:
+                rating = int(record['rating'])
+                created_at = parse_datetime(record['created_at']) if record.get('created_at') else None
+            except (KeyError, TypeError, ValueError):
+                rating = None
+            if user_id is None or (record.get('user_id') and user_id not in known_ids) or rating not in range(1, 6):
+                self.skipped += 1
+                continue
+            yield {'user_id': int(user_id), 'rating': rating, 'comment': record.get('comment') or None, 'created_at': created_at}
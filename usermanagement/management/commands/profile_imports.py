@@ -0,0 +1,86 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORT_LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+# runs in a fresh interpreter, like a cold worker
+STARTUP_SCRIPT = '''
+import io, sys, time
+started = time.perf_counter()
+module, _, name = sys.argv[1].rpartition('.')
+application = getattr(__import__(module, fromlist=[name]), name)
+ready = time.perf_counter()
+path = sys.argv[2]
+if path:
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+    }
+    b''.join(application(environ, lambda status, headers, exc_info=None: None))
+done = time.perf_counter()
+print(f"{(ready - started) * 1000:.1f} {(done - ready) * 1000:.1f} {len(sys.modules)}")
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        "Start WSGI_APPLICATION in fresh interpreters under -X importtime and "
+        "report the startup time and the slowest imports. The first request "
+        "(by default to the API root) counts, since Django loads the URLconf and "
+        "views lazily. Run with LAZY_STARTUP=false to compare with an eager start."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/usermanagment/api/', help="Path requested after setup, '' for none")
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=25)
+        parser.add_argument('--depth', type=int, default=2, help="List imports nested at most this deep")
+        parser.add_argument('--by-package', action='store_true', help="Sum self time by top-level package")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("Use at least one run.")
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        timings, imports = [], None
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, settings.WSGI_APPLICATION, options['path']],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+            )
+            if result.returncode:
+                raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+            setup_ms, request_ms, modules = result.stdout.split()[-3:]
+            timings.append((float(setup_ms), float(request_ms)))
+            # (self us, cumulative us, nesting depth, module)
+            imports = [
+                (int(match[1]), int(match[2]), len(match[3]) // 2 + 1, match[4])
+                for match in map(IMPORT_LINE_RE.match, result.stderr.splitlines()) if match
+            ]
+
+        setup = statistics.median(setup_ms for setup_ms, _ in timings)
+        request = statistics.median(request_ms for _, request_ms in timings)
+        self.stdout.write(
+            f"median of {options['runs']} runs: setup {setup:.0f} ms, first request {request:.0f} ms, "
+            f"total {setup + request:.0f} ms, {modules} modules"
+        )
+        self.stdout.write("(import times below are from the last run and include -X importtime overhead)")
+        if options['by_package']:
+            packages = defaultdict(int)
+            for self_us, _, _, name in imports:
+                packages[name.split('.')[0]] += self_us
+            self.stdout.write(f"{'self ms':>9}  package")
+            for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f"{self_us / 1000:>9.1f}  {name}")
+            return
+        # nested imports are part of their parent's cumulative time, list the outer ones
+        shown = [item for item in imports if item[2] <= options['depth']]
+        self.stdout.write(f"{'cumul ms':>9} {'self ms':>8}  module")
+        for self_us, cumulative_us, depth, name in sorted(shown, key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"{cumulative_us / 1000:>9.1f} {self_us / 1000:>8.1f}  {'  ' * (depth - 1)}{name}")
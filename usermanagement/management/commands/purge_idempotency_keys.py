@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from usermanagement.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys(options['batch_size'], options['pause'])
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys.")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from usermanagement.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-tokenize every feed post into the search index. Needed after posts "
+        "were written without signals (bulk_create, update) or the tokenizer changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(options['batch_size'])
+        self.stdout.write(f"Indexed {indexed} feed posts.")
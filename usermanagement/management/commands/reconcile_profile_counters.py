@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from usermanagement.stats import reconcile_profile_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the order, review and feed counters stored on user profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running as a worker, reconciling every N seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            fixed = reconcile_profile_counters(options['batch_size'])
+            self.stdout.write(f"Corrected counters on {fixed} profiles.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
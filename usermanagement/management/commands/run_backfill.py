@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from usermanagement.backfill import (
+    BACKFILLS, get_backfill, get_checkpoint, remaining_rows, reset_checkpoint,
+    run_backfill, verify_backfill,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a backfill from usermanagement/backfill.py in primary key ordered "
+        "chunks, resuming from its checkpoint. Safe to stop and run again. "
+        "Without a name, lists the backfills and their progress."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help=f"One of: {', '.join(sorted(BACKFILLS))}")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds to sleep between chunks.')
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks.')
+        parser.add_argument('--max-seconds', type=float, help='Stop after this many seconds.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Forget the checkpoint and start again from the first row.')
+        parser.add_argument('--verify', action='store_true',
+                            help='Recheck every row without writing and report the out of date ones.')
+
+    def status(self, backfill, checkpoint):
+        state = 'done' if checkpoint.completed_at else 'in progress' if checkpoint.last_pk else 'not started'
+        return (
+            f"{backfill.name}: {state}, {checkpoint.processed} rows processed, "
+            f"{checkpoint.updated} updated, {remaining_rows(backfill, checkpoint)} after the checkpoint"
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if not options['name']:
+            for name in sorted(BACKFILLS):
+                backfill = get_backfill(name)
+                self.stdout.write(self.status(backfill, get_checkpoint(backfill)))
+            return
+        try:
+            backfill = get_backfill(options['name'])
+        except KeyError:
+            raise CommandError(f"Unknown backfill {options['name']!r}, choose from: {', '.join(sorted(BACKFILLS))}.")
+
+        if options['verify']:
+            checked, stale, stale_keys = verify_backfill(backfill, options['batch_size'])
+            self.stdout.write(f"{backfill.name}: checked {checked} rows, {stale} out of date.")
+            if stale:
+                self.stdout.write(f"First out of date keys: {', '.join(map(str, stale_keys))}")
+                raise CommandError("Verification failed, run the backfill (with --restart if it completed).")
+            self.stdout.write(self.style.SUCCESS("Verified."))
+            return
+
+        if options['restart']:
+            reset_checkpoint(backfill)
+        progress = None
+        if options['verbosity'] > 1:
+            progress = lambda checkpoint: self.stdout.write(
+                f"{backfill.name}: {checkpoint.processed} rows processed, last key {checkpoint.last_pk}"
+            )
+        checkpoint = run_backfill(
+            backfill,
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            max_chunks=options['max_chunks'],
+            max_seconds=options['max_seconds'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(self.status(backfill, checkpoint)))
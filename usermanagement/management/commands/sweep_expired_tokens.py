@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from usermanagement.tokens import sweep_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired Knox tokens and device rows in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches.')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running as a worker, sweeping every N seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            tokens, devices = sweep_expired_tokens(options['batch_size'], options['pause'])
+            self.stdout.write(f"Deleted {tokens} expired tokens and {devices} device entries.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
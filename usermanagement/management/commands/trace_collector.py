@@ -0,0 +1,112 @@
+import json
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _value(value):
+    if 'intValue' in value:
+        # 64 bit integers arrive as strings
+        return int(value['intValue'])
+    return next(iter(value.values()), None)
+
+
+def spans_from_otlp(payload):
+    """The spans of an OTLP/JSON export in the JSON lines exporter's format."""
+    spans = []
+    for resource in payload.get('resourceSpans', []):
+        for scope in resource.get('scopeSpans', []):
+            for item in scope.get('spans', []):
+                start, end = int(item['startTimeUnixNano']), int(item['endTimeUnixNano'])
+                status = item.get('status') or {}
+                spans.append({
+                    'trace_id': item['traceId'],
+                    'span_id': item['spanId'],
+                    'parent_id': item.get('parentSpanId') or None,
+                    'name': item['name'],
+                    'start_ns': start,
+                    'duration_ms': round((end - start) / 1e6, 3),
+                    'attributes': {
+                        attribute['key']: _value(attribute['value'])
+                        for attribute in item.get('attributes', [])
+                    },
+                    'error': status.get('message') if status.get('code') == 2 else None,
+                })
+    return spans
+
+
+def summarize(spans, top):
+    """One line per trace: the root span and the span names that took the most time of their own."""
+    by_trace = defaultdict(list)
+    for item in spans:
+        by_trace[item['trace_id']].append(item)
+    lines = []
+    for trace_id, items in by_trace.items():
+        by_id = {item['span_id']: item for item in items}
+        # time spent in a span minus the time of its children, by span name
+        own = defaultdict(float)
+        calls = defaultdict(int)
+        for item in items:
+            own[item['name']] += item['duration_ms']
+            calls[item['name']] += 1
+            if item['parent_id'] in by_id:
+                own[by_id[item['parent_id']]['name']] -= item['duration_ms']
+        roots = [item for item in items if item['parent_id'] not in by_id]
+        root = max(roots, key=lambda item: item['duration_ms'])
+        hot = sorted(own.items(), key=lambda entry: -entry[1])[:top]
+        breakdown = ', '.join(f"{name} {ms:.1f} ms ({calls[name]})" for name, ms in hot)
+        lines.append(f"{trace_id} {root['name']} {root['duration_ms']:.1f} ms: {breakdown}")
+    return lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for an OTLP/HTTP trace collector. Accepts JSON "
+        "exports (TRACE_EXPORTER=otlp), appends their spans to a JSON lines "
+        "file and prints where each trace spent its time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=4318)
+        parser.add_argument('--output', default=settings.TRACE_FILE, help="JSON lines file the spans are appended to")
+        parser.add_argument('--top', type=int, default=5, help="Span names listed per trace")
+
+    def handle(self, *args, **options):
+        command = self
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != '/v1/traces' or 'json' not in self.headers.get('Content-Type', ''):
+                    self.send_error(415 if self.path == '/v1/traces' else 404)
+                    return
+                try:
+                    spans = spans_from_otlp(json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0)))))
+                except (ValueError, KeyError, TypeError):
+                    self.send_error(400)
+                    return
+                with lock:
+                    with open(options['output'], 'a', encoding='utf-8') as file:
+                        file.write(''.join(json.dumps(item) + '\n' for item in spans))
+                    for line in summarize(spans, options['top']):
+                        command.stdout.write(line)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        self.stdout.write(f"Collecting traces on http://{options['host']}:{options['port']}/v1/traces into {options['output']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
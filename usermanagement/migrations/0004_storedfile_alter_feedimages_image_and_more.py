@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:11
+
+import usermanagement.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0003_paymentmodel_userprofile_rating_userfeed_feedimages_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Stored File',
+                'verbose_name_plural': 'Stored Files',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='feedimages',
+            name='image',
+            field=models.ImageField(storage=usermanagement.uploads.ContentAddressedStorage(), upload_to='feed_images/'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=usermanagement.uploads.ContentAddressedStorage(), upload_to='profile_pictures/'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0004_storedfile_alter_feedimages_image_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('order_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(max_length=20)),
+                ('order_date', models.DateTimeField()),
+                ('month', models.DateField(help_text='First day of the month the order was placed in')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('payload', models.JSONField()),
+                ('booking_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Order',
+                'verbose_name_plural': 'Archived Orders',
+                'ordering': ['-order_date'],
+                'indexes': [models.Index(fields=['month', 'order_date'], name='archived_order_month_idx'), models.Index(fields=['user', '-order_date'], name='archived_order_user_idx'), models.Index(fields=['booking_user', '-order_date'], name='archived_order_booking_idx')],
+            },
+        ),
+    ]
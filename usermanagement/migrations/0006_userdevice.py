@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def index_existing_tokens(apps, schema_editor):
+    # users logged in before the device index existed keep their single-device lock
+    AuthToken = apps.get_model('knox', 'AuthToken')
+    UserDevice = apps.get_model('usermanagement', 'UserDevice')
+    devices = {}
+    for token in AuthToken.objects.order_by('created').iterator():
+        devices[token.user_id] = UserDevice(user_id=token.user_id, token_key=token.token_key, expiry=token.expiry)
+    UserDevice.objects.bulk_create(devices.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('knox', '0009_extend_authtoken_field'),
+        ('usermanagement', '0005_archivedorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDevice',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='active_device', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('token_key', models.CharField(max_length=25)),
+                ('expiry', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Device',
+                'verbose_name_plural': 'User Devices',
+            },
+        ),
+        migrations.RunPython(index_existing_tokens, migrations.RunPython.noop),
+    ]
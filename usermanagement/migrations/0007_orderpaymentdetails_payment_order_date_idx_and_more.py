@@ -0,0 +1,64 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+# auth_user belongs to django.contrib.auth, so its email indexes are created
+# here. Email lookups use `iexact`: Postgres compares UPPER(email), SQLite
+# uses LIKE, which can only use a NOCASE index.
+EMAIL_INDEXES = {
+    'postgresql': 'CREATE INDEX IF NOT EXISTS auth_user_email_upper_idx ON auth_user (UPPER(email))',
+    'sqlite': 'CREATE INDEX IF NOT EXISTS auth_user_email_upper_idx ON auth_user (email COLLATE NOCASE)',
+}
+
+
+def create_email_index(apps, schema_editor):
+    sql = EMAIL_INDEXES.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+def drop_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor in EMAIL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS auth_user_email_upper_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('usermanagement', '0006_userdevice'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderpaymentdetails',
+            index=models.Index(fields=['order', '-payment_date'], name='payment_order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatushistory',
+            index=models.Index(fields=['order', '-changed_at'], name='history_order_changed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfeed',
+            index=models.Index(fields=['user', '-created_at'], name='feed_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userorderdetails',
+            index=models.Index(fields=['user', 'status', '-order_date'], name='order_user_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userorderdetails',
+            index=models.Index(fields=['booking_user', 'status', '-order_date'], name='order_booking_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userorderdetails',
+            index=models.Index(fields=['status', 'order_date'], name='order_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userrating',
+            index=models.Index(fields=['user', '-created_at'], name='rating_user_created_idx'),
+        ),
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
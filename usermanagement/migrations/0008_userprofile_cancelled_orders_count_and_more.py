@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:15
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_existing_activity(apps, schema_editor):
+    UserProfile = apps.get_model('usermanagement', 'UserProfile')
+
+    def count(model_name, status=None):
+        queryset = apps.get_model('usermanagement', model_name).objects.filter(user_id=OuterRef('user_id'))
+        if status:
+            queryset = queryset.filter(status=status)
+        subquery = queryset.order_by().values('user_id').annotate(n=Count('pk')).values('n')
+        return Coalesce(Subquery(subquery, output_field=IntegerField()), Value(0))
+
+    UserProfile.objects.update(
+        orders_count=count('UserOrderDetails') + count('ArchivedOrder'),
+        completed_orders_count=count('UserOrderDetails', 'completed') + count('ArchivedOrder', 'completed'),
+        cancelled_orders_count=count('UserOrderDetails', 'cancelled') + count('ArchivedOrder', 'cancelled'),
+        review_count=count('UserRating'),
+        feed_post_count=count('UserFeed'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0007_orderpaymentdetails_payment_order_date_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='cancelled_orders_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='completed_orders_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='feed_post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='orders_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+# same field order as usermanagement.completeness.PROFILE_FIELDS at the time
+PROFILE_FIELDS = (
+    'role_id', 'full_name', 'phone_number', 'bio', 'profile_picture',
+    'date_of_birth', 'location', 'website', 'latitute', 'longitude', 'services',
+)
+
+
+def compute_existing_masks(apps, schema_editor):
+    UserProfile = apps.get_model('usermanagement', 'UserProfile')
+    with_services = set(
+        UserProfile.services.through.objects.values_list('userprofile_id', flat=True).distinct()
+    )
+    batch = []
+    for profile in UserProfile.objects.order_by('pk').iterator(chunk_size=1000):
+        mask = 0
+        for bit, name in enumerate(PROFILE_FIELDS[:-1]):
+            value = getattr(profile, name)
+            if value is None or value == '' or getattr(value, 'name', True) == '':
+                mask |= 1 << bit
+        if profile.pk not in with_services:
+            mask |= 1 << (len(PROFILE_FIELDS) - 1)
+        profile.missing_fields_mask = mask
+        profile.completeness = (len(PROFILE_FIELDS) - bin(mask).count('1')) * 100 // len(PROFILE_FIELDS)
+        batch.append(profile)
+        if len(batch) == 1000:
+            UserProfile.objects.bulk_update(batch, ['missing_fields_mask', 'completeness'])
+            batch = []
+    UserProfile.objects.bulk_update(batch, ['missing_fields_mask', 'completeness'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0009_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='completeness',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='missing_fields_mask',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('missing_fields_mask__gt', 0)), fields=['completeness', 'id', 'missing_fields_mask'], name='profile_incomplete_idx'),
+        ),
+        migrations.RunPython(compute_existing_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_existing_ratings(apps, schema_editor):
+    UserProfile = apps.get_model('usermanagement', 'UserProfile')
+    UserRating = apps.get_model('usermanagement', 'UserRating')
+
+    def count(star):
+        subquery = (
+            UserRating.objects.filter(user_id=OuterRef('user_id'), rating=star)
+            .order_by().values('user_id').annotate(n=Count('pk')).values('n')
+        )
+        return Coalesce(Subquery(subquery, output_field=IntegerField()), Value(0))
+
+    UserProfile.objects.update(**{f'rating_{star}_count': count(star) for star in range(1, 6)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0010_userprofile_completeness_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userrating',
+            name='rating_user_created_idx',
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='userrating',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='rating_user_created_idx'),
+        ),
+        migrations.RunPython(count_existing_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0011_remove_userrating_rating_user_created_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('open_slots', models.BinaryField(default=b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00', max_length=12)),
+                ('booked_slots', models.BinaryField(default=b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00', max_length=12)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Provider Availability',
+                'verbose_name_plural': 'Provider Availability',
+                'indexes': [models.Index(fields=['date', 'user'], name='availability_date_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='availability_user_date_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:38
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# same rules as usermanagement.search.tokenize at the time
+TOKEN_RE = re.compile(r'[\w\u0980-\u09FF]+')
+
+
+def tokenize(text):
+    words = TOKEN_RE.findall(unicodedata.normalize('NFC', text or '').casefold())
+    return [word[:64] for word in words if len(word) >= 2 and word.strip('_')]
+
+
+def index_existing_posts(apps, schema_editor):
+    UserFeed = apps.get_model('usermanagement', 'UserFeed')
+    FeedToken = apps.get_model('usermanagement', 'FeedToken')
+    batch = []
+    for pk, content in UserFeed.objects.order_by('pk').values_list('pk', 'content').iterator(chunk_size=1000):
+        batch.extend(
+            FeedToken(feed_id=pk, token=token, count=min(count, 10))
+            for token, count in Counter(tokenize(content)).items()
+        )
+        if len(batch) >= 5000:
+            FeedToken.objects.bulk_create(batch)
+            batch = []
+    FeedToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0012_provideravailability'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('count', models.PositiveSmallIntegerField(default=1)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='usermanagement.userfeed')),
+            ],
+            options={
+                'verbose_name': 'Feed Token',
+                'verbose_name_plural': 'Feed Tokens',
+                'constraints': [models.UniqueConstraint(fields=('token', 'feed'), name='feed_token_uniq')],
+            },
+        ),
+        migrations.RunPython(index_existing_posts, migrations.RunPython.noop),
+    ]
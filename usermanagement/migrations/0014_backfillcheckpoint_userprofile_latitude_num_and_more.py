@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0013_feedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_pk', models.CharField(blank=True, default='', max_length=64)),
+                ('processed', models.PositiveBigIntegerField(default=0)),
+                ('updated', models.PositiveBigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Backfill Checkpoint',
+                'verbose_name_plural': 'Backfill Checkpoints',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='latitude_num',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='longitude_num',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+    ]
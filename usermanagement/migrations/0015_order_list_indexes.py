@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0014_backfillcheckpoint_userprofile_latitude_num_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedorder',
+            name='archived_order_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='archivedorder',
+            name='archived_order_booking_idx',
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-order_date', '-order_id'], name='archived_order_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['booking_user', '-order_date', '-order_id'], name='archived_order_booking_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userorderdetails',
+            index=models.Index(fields=['user', '-order_date', '-order_id'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userorderdetails',
+            index=models.Index(fields=['booking_user', '-order_date', '-order_id'], name='order_booking_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermanagement', '0015_order_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='userdevice',
+            old_name='created_at',
+            new_name='updated_at',
+        ),
+    ]
@@ -1,6 +1,8 @@
 import uuid
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from .uploads import ContentAddressedStorage
 
 # Create your models here.
 class UserRole(models.Model):
@@ -24,22 +26,57 @@ class UserProfile(models.Model):
     full_name = models.CharField(max_length=100, blank=True, null=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
-    profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    profile_picture = models.ImageField(upload_to='profile_pictures/', storage=ContentAddressedStorage(), blank=True, null=True)
     date_of_birth = models.DateField(blank=True, null=True)
     location = models.CharField(max_length=100, blank=True, null=True)
     website = models.URLField(blank=True, null=True)
     latitute = models.CharField(max_length=20, blank=True, null=True)
     longitude = models.CharField(max_length=20, blank=True, null=True)
+    # numeric copies of the two above, written on every save and filled in for
+    # existing rows by the `coordinates` backfill (see backfill.py)
+    latitude_num = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    longitude_num = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     services = models.ManyToManyField(Services, blank=True)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
+    # activity counters maintained incrementally by signals.py and
+    # corrected by `manage.py reconcile_profile_counters`
+    orders_count = models.PositiveIntegerField(default=0)
+    completed_orders_count = models.PositiveIntegerField(default=0)
+    cancelled_orders_count = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    feed_post_count = models.PositiveIntegerField(default=0)
+    # star histogram of the user's ratings, maintained like the counters above
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    # one bit per empty field and the filled share in percent, see completeness.py
+    missing_fields_mask = models.PositiveIntegerField(default=0)
+    completeness = models.PositiveSmallIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
+
+    @property
+    def cancellation_rate(self):
+        if not self.orders_count:
+            return 0.0
+        return round(self.cancelled_orders_count / self.orders_count, 4)
     
     class Meta:
         verbose_name = 'User Profile'
         verbose_name_plural = 'User Profiles'
         ordering = ['user__username']
+        indexes = [
+            # scanned in list order by completeness.profiles_missing, the mask
+            # is included so the bit test doesn't read the table
+            models.Index(
+                fields=['completeness', 'id', 'missing_fields_mask'],
+                condition=models.Q(missing_fields_mask__gt=0),
+                name='profile_incomplete_idx',
+            ),
+        ]
 
 class UserRating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -54,6 +91,9 @@ class UserRating(models.Model):
         verbose_name = 'User Rating'
         verbose_name_plural = 'User Ratings'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='rating_user_created_idx'),
+        ]
 
 class PaymentModel(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -79,11 +119,29 @@ class UserOrderDetails(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.service.name} ({self.status})"
+
+    def clean(self):
+        # saving books the slots under a lock and raises if they are taken
+        # (see signals.py), this reports the conflict as a form error first
+        from . import availability
+
+        if self.user_id is None or self.order_for_date is None:
+            return
+        if availability.needs_booking(self) and not availability.can_book(self):
+            raise ValidationError({'order_for_date': 'The provider is not available at that time.'})
     
     class Meta:
         verbose_name = 'User Order Detail'
         verbose_name_plural = 'User Order Details'
         ordering = ['-order_date']
+        indexes = [
+            models.Index(fields=['user', 'status', '-order_date'], name='order_user_status_date_idx'),
+            models.Index(fields=['booking_user', 'status', '-order_date'], name='order_booking_status_date_idx'),
+            models.Index(fields=['status', 'order_date'], name='order_status_date_idx'),
+            # the order list, see archive.user_orders
+            models.Index(fields=['user', '-order_date', '-order_id'], name='order_user_date_idx'),
+            models.Index(fields=['booking_user', '-order_date', '-order_id'], name='order_booking_date_idx'),
+        ]
 
 class OrderStatusHistory(models.Model):
     order = models.ForeignKey(UserOrderDetails, on_delete=models.CASCADE)
@@ -102,6 +160,9 @@ class OrderStatusHistory(models.Model):
         verbose_name = 'Order Status History'
         verbose_name_plural = 'Order Status Histories'
         ordering = ['-changed_at']
+        indexes = [
+            models.Index(fields=['order', '-changed_at'], name='history_order_changed_idx'),
+        ]
 
 class OrderPaymentDetails(models.Model):
     order = models.ForeignKey(UserOrderDetails, on_delete=models.CASCADE)
@@ -123,6 +184,9 @@ class OrderPaymentDetails(models.Model):
         verbose_name = 'Order Payment Detail'
         verbose_name_plural = 'Order Payment Details'
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['order', '-payment_date'], name='payment_order_date_idx'),
+        ]
 
 class UserFeed(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -136,10 +200,30 @@ class UserFeed(models.Model):
         verbose_name = 'User Feed'
         verbose_name_plural = 'User Feeds'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='feed_user_created_idx'),
+        ]
+
+class FeedToken(models.Model):
+    # inverted index of UserFeed.content, one row per distinct word of a post
+    # with its number of occurrences (see search.py)
+    token = models.CharField(max_length=64)
+    feed = models.ForeignKey(UserFeed, related_name='tokens', on_delete=models.CASCADE)
+    count = models.PositiveSmallIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.token} - {self.feed_id}"
+
+    class Meta:
+        verbose_name = 'Feed Token'
+        verbose_name_plural = 'Feed Tokens'
+        constraints = [
+            models.UniqueConstraint(fields=['token', 'feed'], name='feed_token_uniq'),
+        ]
 
 class FeedImages(models.Model):
     feed = models.ForeignKey(UserFeed, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='feed_images/')
+    image = models.ImageField(upload_to='feed_images/', storage=ContentAddressedStorage())
 
     def __str__(self):
         return f"Image for {self.feed.user.username} feed"
@@ -149,3 +233,118 @@ class FeedImages(models.Model):
         verbose_name_plural = 'Feed Images'
         ordering = ['-feed__created_at']
 
+
+class StoredFile(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+    class Meta:
+        verbose_name = 'Stored File'
+        verbose_name_plural = 'Stored Files'
+        ordering = ['name']
+
+class ArchivedOrder(models.Model):
+    # completed/cancelled orders moved out of the hot tables, see archive.py;
+    # `payload` holds the order with its status history and payments
+    order_id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(User, related_name='archived_orders', on_delete=models.CASCADE)
+    booking_user = models.ForeignKey(User, related_name='archived_bookings', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20)
+    order_date = models.DateTimeField()
+    month = models.DateField(help_text='First day of the month the order was placed in')
+    archived_at = models.DateTimeField(auto_now_add=True)
+    payload = models.JSONField()
+
+    def __str__(self):
+        return f"{self.order_id} ({self.status}, {self.month:%Y-%m})"
+
+    class Meta:
+        verbose_name = 'Archived Order'
+        verbose_name_plural = 'Archived Orders'
+        ordering = ['-order_date']
+        indexes = [
+            models.Index(fields=['month', 'order_date'], name='archived_order_month_idx'),
+            # user_orders pages through these by (order_date, order_id)
+            models.Index(fields=['user', '-order_date', '-order_id'], name='archived_order_user_idx'),
+            models.Index(fields=['booking_user', '-order_date', '-order_id'], name='archived_order_booking_idx'),
+        ]
+
+class UserDevice(models.Model):
+    # the device a user is currently logged in on, see tokens.py
+    user = models.OneToOneField(User, primary_key=True, related_name='active_device', on_delete=models.CASCADE)
+    token_key = models.CharField(max_length=25)
+    expiry = models.DateTimeField(blank=True, null=True, db_index=True)
+    # set again on every login, when the row moves to the new token
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.token_key}"
+
+    class Meta:
+        verbose_name = 'User Device'
+        verbose_name_plural = 'User Devices'
+
+class IdempotencyKey(models.Model):
+    # stored responses of write requests sent with an Idempotency-Key header,
+    # see idempotency.py; status_code is null while the request is running
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.key}"
+
+    class Meta:
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+
+class ProviderAvailability(models.Model):
+    # one row per provider and day, each bitmap holds the day's 96 fifteen
+    # minute slots with bit n for slot n (see availability.py)
+    user = models.ForeignKey(User, related_name='availability', on_delete=models.CASCADE)
+    date = models.DateField()
+    open_slots = models.BinaryField(max_length=12, default=bytes(12))
+    booked_slots = models.BinaryField(max_length=12, default=bytes(12))
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date}"
+
+    class Meta:
+        verbose_name = 'Provider Availability'
+        verbose_name_plural = 'Provider Availability'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='availability_user_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'user'], name='availability_date_user_idx'),
+        ]
+
+class BackfillCheckpoint(models.Model):
+    # progress of a chunked backfill, see backfill.py; last_pk is the primary
+    # key of the last processed row as text so any key type fits
+    name = models.CharField(max_length=100, unique=True)
+    last_pk = models.CharField(max_length=64, blank=True, default='')
+    processed = models.PositiveBigIntegerField(default=0)
+    updated = models.PositiveBigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} ({'done' if self.completed_at else self.last_pk or 'not started'})"
+
+    class Meta:
+        verbose_name = 'Backfill Checkpoint'
+        verbose_name_plural = 'Backfill Checkpoints'
+        ordering = ['name']
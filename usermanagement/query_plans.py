@@ -0,0 +1,117 @@
+"""
+Query plan checks.
+
+``hot_queries`` lists the queries the API and the background jobs run most.
+Each must seek an index: ``plan_problems`` reads an EXPLAIN plan and reports
+every step that reads a whole table or index, and extra sort steps. A query
+that can only be served by scanning a small index lists it in
+``ALLOWED_SCANS`` with the reason. The checks run in
+usermanagement/tests.py and with ``manage.py check_query_plans`` against a
+live database.
+"""
+import re
+import uuid
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import archive
+from .completeness import profiles_missing
+from .search import matching_feeds
+from .models import (
+    ArchivedOrder, OrderPaymentDetails, OrderStatusHistory, ProviderAvailability, UserFeed,
+    UserOrderDetails, UserRating,
+)
+
+
+def hot_queries():
+    """The queries the API and the background jobs run most, by name."""
+    now = timezone.now()
+    # a page after the first, the first one only leaves out the cursor condition
+    before = (now, uuid.UUID(int=0))
+    return {
+        'order list, provided': archive.order_keys(UserOrderDetails, 'user', 1, before)[:50],
+        'order list, booked': archive.order_keys(UserOrderDetails, 'booking_user', 1, before)[:50],
+        'order list, archived provided': archive.order_keys(ArchivedOrder, 'user', 1, before)[:50],
+        'order list, archived booked': archive.order_keys(ArchivedOrder, 'booking_user', 1, before)[:50],
+        'provider orders by status': UserOrderDetails.objects.filter(user_id=1, status='pending'),
+        'booked orders by status': UserOrderDetails.objects.filter(booking_user_id=1, status='pending'),
+        'archivable orders': UserOrderDetails.objects.filter(status='completed', order_date__lt=now).order_by('order_date'),
+        'order export by status and dates': UserOrderDetails.objects.filter(
+            status='completed', order_date__gte=now, order_date__lt=now,
+        ).order_by('order_date'),
+        'order status history': OrderStatusHistory.objects.filter(order_id='00000000-0000-0000-0000-000000000000'),
+        'order payments': OrderPaymentDetails.objects.filter(order_id='00000000-0000-0000-0000-000000000000'),
+        'user ratings': UserRating.objects.filter(user_id=1),
+        'user feed': UserFeed.objects.filter(user_id=1),
+        # one word, merging several always groups in a temp b-tree on SQLite
+        'feed search': matching_feeds(['plumber']),
+        'user by email': User.objects.filter(email__iexact='someone@example.com'),
+        'incomplete profiles': profiles_missing(['phone_number', 'services']),
+        'provider calendars of a day': ProviderAvailability.objects.filter(date=now.date(), user_id__in=[1, 2, 3]),
+    }
+
+
+# name of a hot query -> indexes it may read in full
+ALLOWED_SCANS = {
+    # a bit test can't seek, the partial index holds only the incomplete
+    # profiles, see completeness.py
+    'incomplete profiles': ('profile_incomplete_idx',),
+}
+
+
+def _uses_index(step, indexes):
+    return any(re.search(rf'\b{re.escape(index)}\b', step) for index in indexes)
+
+
+def plan_problems(plan, vendor, allowed_scans=()):
+    """
+    Return the steps of an EXPLAIN plan that read a whole table or index,
+    except full scans of the indexes in `allowed_scans`, and the extra sorts.
+    """
+    problems = []
+    # a postgres index scan is a full one unless an Index Cond line follows
+    full_index_scan = None
+    for line in plan.splitlines():
+        # drop SQLite's "id parent notused" columns and the tree drawing
+        step = re.sub(r'^[\s\d|`-]+', '', line).strip()
+        if vendor == 'sqlite':
+            # SCAN, unlike SEARCH, walks the whole table or (covering) index
+            if step.startswith('SCAN ') and not _uses_index(step, allowed_scans):
+                problems.append(step)
+            elif step.startswith('USE TEMP B-TREE'):
+                problems.append(step)
+        elif vendor == 'postgresql':
+            node = step.lstrip('> ')
+            # plan nodes are the unindented first line and the "->" lines,
+            # the other lines describe the node above them
+            if line.lstrip().startswith('->') or not line.startswith(' '):
+                if full_index_scan:
+                    problems.append(full_index_scan)
+                full_index_scan = None
+                if node.startswith(('Index Scan', 'Index Only Scan')):
+                    if not _uses_index(node, allowed_scans):
+                        full_index_scan = node
+                elif node.startswith(('Seq Scan', 'Sort', 'Incremental Sort')):
+                    problems.append(node)
+            elif node.startswith('Index Cond'):
+                full_index_scan = None
+    if full_index_scan:
+        problems.append(full_index_scan)
+    return problems
+
+
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+
+def explain(queryset):
+    """EXPLAIN output of `queryset` on the default database."""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # tiny tables make a seq scan look cheapest, only report
+            # plans that have no index based alternative at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+        return queryset.explain()
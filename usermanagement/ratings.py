@@ -0,0 +1,111 @@
+"""
+Bulk rating ingestion with deferred profile recomputation.
+
+Saving or deleting a single UserRating recomputes its user's average through
+the receivers in signals.py. For imports and batch moderation that would mean
+one aggregate and one UPDATE per rating, so ``bulk_ingest_ratings`` inserts
+with ``bulk_create`` and ``deferred_rating_updates`` makes the receivers only
+note the affected users; each of them is then recomputed once with grouped
+aggregate queries and ``bulk_update``.
+"""
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from .models import UserProfile, UserRating
+from .stats import HISTOGRAM_FIELDS, rating_histograms
+
+_state = threading.local()
+
+
+@contextmanager
+def deferred_rating_updates():
+    """
+    Collect users whose ratings change inside the block and recompute their
+    profiles once when it exits. Nested blocks join the outermost one.
+    """
+    if getattr(_state, 'user_ids', None) is not None:
+        yield
+        return
+    _state.user_ids = set()
+    try:
+        yield
+        user_ids = _state.user_ids
+    finally:
+        _state.user_ids = None
+    recompute_rating_stats(user_ids)
+
+
+def defer_recompute(user_id):
+    """Record `user_id` if updates are deferred, telling the caller to skip."""
+    user_ids = getattr(_state, 'user_ids', None)
+    if user_ids is None:
+        return False
+    user_ids.add(user_id)
+    return True
+
+
+def recompute_rating_stats(user_ids, batch_size=1000):
+    """Recompute rating average, review count and histogram for the given users."""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        aggregates = {
+            row['user_id']: row
+            for row in UserRating.objects.filter(user_id__in=batch)
+            .values('user_id').annotate(avg=Avg('rating'), n=Count('pk'))
+        }
+        histograms = rating_histograms(batch)
+        profiles = list(UserProfile.objects.filter(user_id__in=batch).only('pk', 'user_id'))
+        for profile in profiles:
+            row = aggregates.get(profile.user_id, {})
+            # round to 2 decimals so it fits max_digits=3, decimal_places=2
+            profile.rating = round(Decimal(row.get('avg') or 0), 2)
+            profile.review_count = row.get('n', 0)
+            histogram = histograms.get(profile.user_id, {})
+            for field in HISTOGRAM_FIELDS.values():
+                setattr(profile, field, histogram.get(field, 0))
+        UserProfile.objects.bulk_update(profiles, ['rating', 'review_count', *HISTOGRAM_FIELDS.values()])
+
+
+def _insert_batch(rows):
+    ratings = [
+        UserRating(user_id=row['user_id'], rating=row['rating'], comment=row.get('comment'))
+        for row in rows
+    ]
+    with transaction.atomic():
+        UserRating.objects.bulk_create(ratings)
+        # auto_now_add overwrites created_at on insert, restore imported timestamps
+        dated = []
+        for rating, row in zip(ratings, rows):
+            if row.get('created_at'):
+                rating.created_at = row['created_at']
+                dated.append(rating)
+        if dated:
+            UserRating.objects.bulk_update(dated, ['created_at'])
+    return len(ratings)
+
+
+def bulk_ingest_ratings(rows, batch_size=1000):
+    """
+    Insert ratings from an iterable of dicts with ``user_id``, ``rating`` and
+    optional ``comment`` / ``created_at``, a batch per transaction, then
+    recompute every affected profile once. Returns the number inserted.
+    """
+    inserted = 0
+    user_ids = set()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        user_ids.add(row['user_id'])
+        if len(batch) == batch_size:
+            inserted += _insert_batch(batch)
+            batch = []
+    if batch:
+        inserted += _insert_batch(batch)
+
+    recompute_rating_stats(user_ids)
+    return inserted
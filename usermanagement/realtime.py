@@ -0,0 +1,190 @@
+"""
+Real-time push of order events over WebSocket.
+
+Status changes on UserOrderDetails and new OrderStatusHistory rows are
+published on a per-user channel (both the provider and the booking user of
+the order). Clients connect to ``/ws/orders/?token=<knox token>`` and receive
+one JSON message per event, so they no longer have to poll.
+
+The broker is pluggable through ``settings.REALTIME_BROKER``. The default
+``InProcessBroker`` only fans out inside the current process; deployments
+running several ASGI processes should point the setting at a shared backend
+exposing the same ``subscribe`` / ``unsubscribe`` / ``publish`` methods.
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+WEBSOCKET_PATH = '/ws/orders/'
+
+# close code sent when the token is missing or invalid
+CLOSE_UNAUTHORIZED = 4401
+
+
+class InProcessBroker:
+    """
+    Fan-out pub/sub for subscribers living in this process.
+
+    ``publish`` may be called from any thread (sync views, signals), while
+    subscribers are asyncio queues owned by the event loop serving the socket.
+    Messages for a subscriber whose queue is full are dropped rather than
+    blocking the publisher.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if not subscribers:
+                return
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # event loop already closed, the subscriber is going away
+                pass
+
+
+def _offer(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.REALTIME_BROKER)()
+    return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    # lets tests swap in a stand-in broker with override_settings
+    global _broker
+    if setting == 'REALTIME_BROKER':
+        _broker = None
+
+
+def user_channel(user_id):
+    return f'user.{user_id}'
+
+
+def publish_order_event(order, event_type, **data):
+    """
+    Publish an event about `order` to its provider and booking user once the
+    current transaction commits.
+    """
+    message = {
+        'type': event_type,
+        'order_id': str(order.pk),
+        'at': timezone.now(),
+        **data,
+    }
+    message = json.loads(json.dumps(message, cls=DjangoJSONEncoder))
+    user_ids = {order.user_id, order.booking_user_id}
+
+    def _publish():
+        broker = get_broker()
+        for user_id in user_ids:
+            broker.publish(user_channel(user_id), message)
+
+    transaction.on_commit(_publish)
+
+
+def _token_from_scope(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0].lower() == 'token':
+                return parts[1]
+    return None
+
+
+def _authenticate_token(token):
+    from knox.auth import TokenAuthentication
+    from rest_framework.exceptions import AuthenticationFailed
+
+    close_old_connections()
+    try:
+        user, _ = TokenAuthentication().authenticate_credentials(token.encode())
+    except AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+    return user
+
+
+async def order_status_websocket(scope, receive, send):
+    """ASGI application streaming order events to the authenticated user."""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    token = _token_from_scope(scope)
+    user = await sync_to_async(_authenticate_token)(token) if token else None
+    if user is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+    await send({'type': 'websocket.accept'})
+
+    broker = get_broker()
+    channel = user_channel(user.pk)
+    queue = broker.subscribe(channel)
+    next_message = asyncio.ensure_future(receive())
+    next_event = asyncio.ensure_future(queue.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {next_message, next_event}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_message in done:
+                if next_message.result()['type'] == 'websocket.disconnect':
+                    break
+                # client messages are ignored, the socket is push only
+                next_message = asyncio.ensure_future(receive())
+            if next_event in done:
+                await send({'type': 'websocket.send', 'text': json.dumps(next_event.result())})
+                next_event = asyncio.ensure_future(queue.get())
+    finally:
+        next_message.cancel()
+        next_event.cancel()
+        broker.unsubscribe(channel, queue)
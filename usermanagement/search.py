@@ -0,0 +1,155 @@
+"""
+Full-text search over feed posts.
+
+Every post is split into words by ``tokenize`` and stored in FeedToken as one
+``(token, feed, count)`` row per distinct word, so a search reads the few
+index rows of its words instead of scanning every post. The table works the
+same on Postgres and SQLite. Signals keep it up to date as posts are created,
+edited or deleted. ``rebuild_index`` (``manage.py rebuild_feed_index``)
+re-tokenizes everything, e.g. after rows were written with bulk operations
+or the tokenizer changed.
+
+A post matches when it contains every word of the query. Matches are ranked
+by TF-IDF: each word weighs more the rarer it is among all posts, times how
+often the post uses it (capped at MAX_TERM_COUNT so repeating a word does not
+win). Weights are whole numbers, so the ``(score, id)`` keyset cursor compares
+exactly. They depend on the cached post count and on how many posts use each
+word, both of which move while a client pages, so the first page's weights
+travel in the cursor and later pages score with them: the order stays the
+same from page to page, and only posts written or edited meanwhile can be
+missed or move.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+
+from .models import FeedToken, UserFeed
+
+# letters, digits and Bengali vowel signs, which \w does not cover
+TOKEN_RE = re.compile(r'[\w\u0980-\u09FF]+')
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+MAX_TERM_COUNT = 10
+MAX_QUERY_TERMS = 8
+# number of posts used for the word weights, cached rather than counted per search
+POST_COUNT_CACHE_KEY = 'search:feed_post_count'
+POST_COUNT_CACHE_SECONDS = 300
+
+
+def tokenize(text):
+    """The words of `text`, case-folded, in order."""
+    words = TOKEN_RE.findall(unicodedata.normalize('NFC', text or '').casefold())
+    return [
+        word[:MAX_TOKEN_LENGTH] for word in words
+        if len(word) >= MIN_TOKEN_LENGTH and word.strip('_')
+    ]
+
+
+def query_terms(query):
+    """The distinct words of a search query, at most MAX_QUERY_TERMS."""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+def _rows(feed_id, content):
+    return [
+        FeedToken(feed_id=feed_id, token=token, count=min(count, MAX_TERM_COUNT))
+        for token, count in Counter(tokenize(content)).items()
+    ]
+
+
+def index_feed(feed_id, content, created=False):
+    """Replace the index rows of post `feed_id` with the words of `content`."""
+    with transaction.atomic():
+        if not created:
+            FeedToken.objects.filter(feed_id=feed_id).delete()
+        FeedToken.objects.bulk_create(_rows(feed_id, content))
+
+
+def rebuild_index(batch_size=500):
+    """Re-tokenize every post, `batch_size` posts per transaction. Returns the number of posts."""
+    last_pk, indexed = 0, 0
+    while True:
+        batch = list(
+            UserFeed.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'content')[:batch_size]
+        )
+        if not batch:
+            return indexed
+        with transaction.atomic():
+            FeedToken.objects.filter(feed_id__gt=last_pk, feed_id__lte=batch[-1][0]).delete()
+            FeedToken.objects.bulk_create(
+                [row for pk, content in batch for row in _rows(pk, content)],
+                batch_size=1000,
+            )
+        last_pk = batch[-1][0]
+        indexed += len(batch)
+
+
+def matching_feeds(terms):
+    """Ids of the posts containing every one of `terms`, as a subquery."""
+    return (
+        FeedToken.objects.filter(token__in=terms)
+        .values('feed_id').annotate(matched=Count('token'))
+        .filter(matched=len(terms)).values('feed_id')
+    )
+
+
+def term_weights(terms):
+    """``{term: weight}`` of the `terms` used by at least one post."""
+    posts = cache.get(POST_COUNT_CACHE_KEY)
+    if posts is None:
+        posts = UserFeed.objects.count()
+        cache.set(POST_COUNT_CACHE_KEY, posts, POST_COUNT_CACHE_SECONDS)
+    frequencies = (
+        FeedToken.objects.filter(token__in=terms)
+        .values('token').annotate(posts=Count('feed_id')).values_list('token', 'posts')
+    )
+    return {
+        token: round(1000 * (1 + math.log((max(posts, found) + 1) / (found + 1))))
+        for token, found in frequencies
+    }
+
+
+def search_feeds(query, limit=20, after=None):
+    """
+    Posts matching `query`, best first, as a list of UserFeed with a `score`
+    attribute, and the ``(score, id, weights)`` to pass as `after` for the
+    next page (None on the last page). `weights` are the term weights the
+    page was scored with, in ``query_terms`` order.
+    """
+    terms = query_terms(query)
+    if after:
+        weights = dict(zip(terms, after[2]))
+    else:
+        weights = term_weights(terms) if terms else {}
+    if not terms or len(weights) < len(terms):
+        return [], None
+    weight = Case(
+        *[When(token=token, then=Value(value)) for token, value in weights.items()],
+        output_field=IntegerField(),
+    )
+    ranked = (
+        FeedToken.objects.filter(token__in=terms)
+        .values('feed_id')
+        .annotate(matched=Count('token'), score=Sum(F('count') * weight))
+        .filter(matched=len(terms))
+        .order_by('-score', '-feed_id')
+    )
+    if after:
+        ranked = ranked.filter(Q(score__lt=after[0]) | Q(score=after[0], feed_id__lt=after[1]))
+    page = list(ranked.values_list('feed_id', 'score')[:limit])
+    feeds = UserFeed.objects.select_related('user').in_bulk([feed_id for feed_id, _ in page])
+    results = []
+    for feed_id, score in page:
+        # the post may have been deleted since the index was read
+        if feed_id in feeds:
+            feeds[feed_id].score = score
+            results.append(feeds[feed_id])
+    if len(page) < limit:
+        return results, None
+    return results, (page[-1][1], page[-1][0], tuple(weights[term] for term in terms))
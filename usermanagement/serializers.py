@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import UserProfile, UserRole, Services
+from .availability import parse_ranges
+from .completeness import missing_fields
+from .models import UserProfile, UserRole, Services, PaymentModel, UserOrderDetails, OrderPaymentDetails, UserRating, UserFeed
 
 class SignupSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -8,7 +10,7 @@ class SignupSerializer(serializers.Serializer):
     role = serializers.CharField(max_length=50)
 
     def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
+        if User.objects.filter(email__iexact=value).exists():
             raise serializers.ValidationError("Email already exists.")
         if User.objects.filter(username=value).exists():
             raise serializers.ValidationError("Username (email) already exists.")
@@ -42,24 +44,25 @@ class UserProfileSerializer(serializers.ModelSerializer):
     role = serializers.CharField(source='role.name', allow_null=True)
     services = serializers.SlugRelatedField(many=True, slug_field='name', queryset=Services.objects.all(), required=False)
     null_or_blank_fields = serializers.SerializerMethodField()
+    cancellation_rate = serializers.FloatField(read_only=True)
 
     class Meta:
         model = UserProfile
         fields = (
             'role', 'is_authenticated', 'full_name', 'phone_number', 'bio',
             'profile_picture', 'date_of_birth', 'location', 'website',
-            'latitute', 'longitude', 'services', 'null_or_blank_fields'
+            'latitute', 'longitude', 'services', 'null_or_blank_fields', 'completeness',
+            'rating', 'orders_count', 'completed_orders_count', 'cancelled_orders_count',
+            'cancellation_rate', 'review_count', 'feed_post_count'
+        )
+        read_only_fields = (
+            'completeness', 'rating', 'orders_count', 'completed_orders_count', 'cancelled_orders_count',
+            'review_count', 'feed_post_count'
         )
 
     def get_null_or_blank_fields(self, obj):
-        fields = [
-            'role', 'full_name', 'phone_number', 'bio', 'profile_picture',
-            'date_of_birth', 'location', 'website', 'latitute', 'longitude'
-        ]
-        null_or_blank = [field for field in fields if getattr(obj, field, None) in (None, '')]
-        if not obj.services.exists():
-            null_or_blank.append('services')
-        return null_or_blank
+        # kept up to date on save, see completeness.py
+        return missing_fields(obj.missing_fields_mask)
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(source='userprofile')
@@ -100,6 +103,83 @@ class ForgotPasswordSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
     def validate_email(self, value):
-        if not User.objects.filter(email=value).exists():
+        if not User.objects.filter(email__iexact=value).exists():
             raise serializers.ValidationError("No user with this email exists.")
-        return value
\ No newline at end of file
+        return value
+
+class OrderCreateSerializer(serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), help_text="Provider the order is placed with")
+    service = serializers.SlugRelatedField(slug_field='name', queryset=Services.objects.all())
+    selected_payment = serializers.SlugRelatedField(slug_field='name', queryset=PaymentModel.objects.all())
+
+    class Meta:
+        model = UserOrderDetails
+        fields = ('user', 'service', 'selected_payment', 'order_details', 'order_for_date')
+
+class DispatchOrderSerializer(serializers.Serializer):
+    service = serializers.SlugRelatedField(slug_field='name', queryset=Services.objects.all())
+    selected_payment = serializers.SlugRelatedField(slug_field='name', queryset=PaymentModel.objects.all())
+    order_for_date = serializers.DateTimeField()
+    order_details = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    latitude = serializers.FloatField(required=False, min_value=-90, max_value=90, help_text="Where the service is needed, defaults to the booking user's profile location")
+    longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+
+    def validate(self, data):
+        if ('latitude' in data) != ('longitude' in data):
+            raise serializers.ValidationError("Send both latitude and longitude or neither.")
+        return data
+
+class AvailabilitySerializer(serializers.Serializer):
+    open = serializers.ListField(
+        child=serializers.CharField(),
+        help_text='Working hours of the day in 15 minute steps, e.g. ["09:00-12:00", "13:00-18:00"]',
+    )
+
+    def validate_open(self, value):
+        try:
+            return parse_ranges(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+class OrderPaymentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderPaymentDetails
+        fields = ('payment_method', 'payment_status', 'payment_date', 'transaction_id', 'amount', 'payment_details')
+        read_only_fields = ('payment_status', 'payment_date')
+
+
+class IncompleteProfileSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username')
+    null_or_blank_fields = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UserProfile
+        fields = ('user', 'username', 'full_name', 'completeness', 'null_or_blank_fields')
+
+    def get_null_or_blank_fields(self, obj):
+        return missing_fields(obj.missing_fields_mask)
+
+
+class ReviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserRating
+        fields = ('id', 'rating', 'comment', 'created_at')
+
+class RatingSummarySerializer(serializers.ModelSerializer):
+    histogram = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UserProfile
+        fields = ('user', 'rating', 'review_count', 'histogram')
+
+    def get_histogram(self, obj):
+        return {str(star): getattr(obj, f'rating_{star}_count') for star in range(1, 6)}
+
+
+class FeedSearchResultSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username')
+    score = serializers.IntegerField()
+
+    class Meta:
+        model = UserFeed
+        fields = ('id', 'user', 'username', 'content', 'created_at', 'score')
@@ -1,8 +1,14 @@
 # myapp/signals.py
-from django.db.models import Avg
+from functools import partial
+
+from django.db import transaction
+from django.db.models import DEFERRED, Avg
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete
-from .models import UserRating, UserProfile
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete, pre_delete, pre_save
+from knox.models import AuthToken
+from .models import UserRating, UserProfile, UserOrderDetails, OrderStatusHistory, UserFeed, FeedImages, UserDevice
+from . import availability, backfill, completeness, dispatch, ratings, realtime, search, stats
+from .uploads import acquire_file, release_file
 
 
 def _recalculate_and_store_average(user):
@@ -21,11 +27,249 @@ def _recalculate_and_store_average(user):
     UserProfile.objects.filter(user=user).update(rating=average)
 
 
+def _refresh_dispatch_candidate(user_id):
+    # the provider index reloads the user's row once the change is committed
+    transaction.on_commit(partial(dispatch.provider_index.mark_dirty, user_id))
+
+
+@receiver(post_init, sender=UserRating)
+def remember_loaded_rating(sender, instance, **kwargs):
+    instance._loaded_rating = instance.__dict__.get("rating")
+
+
 @receiver(post_save, sender=UserRating)
-def update_rating_on_save(sender, instance, **kwargs):
+def update_rating_on_save(sender, instance, created, **kwargs):
+    previous = None if created else instance._loaded_rating
+    instance._loaded_rating = instance.rating
+    _refresh_dispatch_candidate(instance.user_id)
+    # inside ratings.deferred_rating_updates() the profile is recomputed once at the end
+    if ratings.defer_recompute(instance.user_id):
+        return
     _recalculate_and_store_average(instance.user)
+    deltas = stats.rating_deltas(previous, instance.rating) if previous != instance.rating else {}
+    if created:
+        deltas["review_count"] = 1
+    stats.bump_counters(instance.user_id, **deltas)
 
 
 @receiver(post_delete, sender=UserRating)
 def update_rating_on_delete(sender, instance, **kwargs):
+    _refresh_dispatch_candidate(instance.user_id)
+    if ratings.defer_recompute(instance.user_id):
+        return
     _recalculate_and_store_average(instance.user)
+    stats.bump_counters(
+        instance.user_id, review_count=-1, **stats.rating_deltas(instance._loaded_rating, None),
+    )
+
+
+@receiver(post_save, sender=UserFeed)
+def count_feed_post(sender, instance, created, **kwargs):
+    if created:
+        stats.bump_counters(instance.user_id, feed_post_count=1)
+
+
+@receiver(post_delete, sender=UserFeed)
+def uncount_feed_post(sender, instance, **kwargs):
+    stats.bump_counters(instance.user_id, feed_post_count=-1)
+
+
+@receiver(post_init, sender=UserFeed)
+def remember_loaded_content(sender, instance, **kwargs):
+    instance._loaded_content = instance.__dict__.get("content")
+
+
+@receiver(post_save, sender=UserFeed)
+def index_feed_content(sender, instance, created, update_fields=None, **kwargs):
+    # the index rows go away with the post through the FeedToken cascade
+    if update_fields is not None and "content" not in update_fields:
+        return
+    if created or instance.content != instance._loaded_content:
+        search.index_feed(instance.pk, instance.content, created)
+    instance._loaded_content = instance.content
+
+
+@receiver(post_init, sender=UserOrderDetails)
+def remember_loaded_status(sender, instance, **kwargs):
+    # read from __dict__ so a deferred status field doesn't trigger a query;
+    # DEFERRED marks it as unknown until load_deferred_status reads it
+    instance._loaded_status = instance.__dict__.get("status", DEFERRED)
+    # the provider and time the order's slots are booked for while pending
+    instance._loaded_slot = (instance.__dict__.get("user_id", DEFERRED), instance.__dict__.get("order_for_date", DEFERRED))
+
+
+@receiver(pre_save, sender=UserOrderDetails)
+@receiver(pre_delete, sender=UserOrderDetails)
+def load_deferred_status(sender, instance, raw=False, **kwargs):
+    # an order loaded with .only()/.defer() doesn't know its stored status or
+    # slot; read them once before it is written, the signals below compare to them
+    if raw or instance._state.adding:
+        return
+    if instance._loaded_status is DEFERRED or DEFERRED in instance._loaded_slot:
+        stored = sender._base_manager.filter(pk=instance.pk).values_list(
+            "status", "user_id", "order_for_date",
+        ).first() or (None, None, None)
+        instance._loaded_status, instance._loaded_slot = stored[0], stored[1:]
+
+
+@receiver(pre_save, sender=UserOrderDetails)
+def book_order_slots(sender, instance, raw=False, update_fields=None, **kwargs):
+    # raises availability.SlotsUnavailable, which aborts the save, if the
+    # provider is closed or booked then
+    if raw or (update_fields is not None and not {"user", "status", "order_for_date"} & set(update_fields)):
+        return
+    if availability.needs_booking(instance):
+        availability.book_order(instance)
+
+
+@receiver(post_save, sender=UserOrderDetails)
+def track_order_status_change(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, "_loaded_status", None)
+    if created or previous != instance.status:
+        realtime.publish_order_event(
+            instance, "order.status",
+            status=instance.status,
+            previous_status=previous,
+        )
+        stats.bump_counters(
+            instance.user_id,
+            **stats.order_status_deltas(previous, instance.status, created),
+        )
+        transaction.on_commit(partial(
+            dispatch.provider_index.apply_order,
+            instance.user_id, instance.service_id, previous, instance.status,
+        ))
+    slot = (instance.user_id, instance.order_for_date)
+    # slots of a pending order are booked before the save (book_order_slots);
+    # when it stops being pending or moves, its old day is rebuilt without it
+    if previous == "pending" and (instance.status != "pending" or slot != instance._loaded_slot):
+        availability.release(*instance._loaded_slot)
+    instance._loaded_status = instance.status
+    instance._loaded_slot = slot
+
+
+@receiver(post_delete, sender=UserOrderDetails)
+def release_order_slots(sender, instance, **kwargs):
+    if instance._loaded_status == "pending":
+        availability.release(*instance._loaded_slot)
+    transaction.on_commit(partial(
+        dispatch.provider_index.apply_order,
+        instance.user_id, instance.service_id, instance._loaded_status, None,
+    ))
+
+
+@receiver(post_save, sender=OrderStatusHistory)
+def publish_order_status_history(sender, instance, created, **kwargs):
+    if created:
+        realtime.publish_order_event(
+            instance.order, "order.history",
+            history_id=instance.pk,
+            status=instance.status,
+            changed_at=instance.changed_at,
+            changed_by=instance.changed_by_id,
+        )
+
+
+# reference counting for content-addressed media, see uploads.py
+MEDIA_FIELDS = {UserProfile: "profile_picture", FeedImages: "image"}
+
+
+def remember_loaded_file(sender, instance, **kwargs):
+    field = MEDIA_FIELDS[sender]
+    loaded = instance.__dict__.get(field)
+    instance._loaded_file_name = getattr(loaded, "name", loaded) or None
+
+
+def count_file_references(sender, instance, **kwargs):
+    field = MEDIA_FIELDS[sender]
+    previous = getattr(instance, "_loaded_file_name", None)
+    current = getattr(instance, field).name or None
+    if current != previous:
+        if current:
+            acquire_file(current)
+        if previous:
+            release_file(previous, getattr(instance, field).storage)
+    instance._loaded_file_name = current
+
+
+def release_deleted_file(sender, instance, **kwargs):
+    file = getattr(instance, MEDIA_FIELDS[sender])
+    if file.name:
+        release_file(file.name, file.storage)
+
+
+for model in MEDIA_FIELDS:
+    post_init.connect(remember_loaded_file, sender=model)
+    post_save.connect(count_file_references, sender=model)
+    post_delete.connect(release_deleted_file, sender=model)
+
+
+@receiver(pre_save, sender=UserProfile)
+def update_profile_completeness(sender, instance, **kwargs):
+    completeness.apply_completeness(instance)
+
+
+@receiver(post_save, sender=UserProfile)
+def store_partial_profile_completeness(sender, instance, update_fields=None, **kwargs):
+    # save(update_fields=...) skips the mask columns unless they are listed
+    if update_fields and not {"missing_fields_mask", "completeness"} <= set(update_fields):
+        if set(update_fields) & set(completeness.PROFILE_FIELDS):
+            UserProfile.objects.filter(pk=instance.pk).update(
+                missing_fields_mask=instance.missing_fields_mask,
+                completeness=instance.completeness,
+            )
+
+
+@receiver(pre_save, sender=UserProfile)
+def write_numeric_coordinates(sender, instance, **kwargs):
+    # dual-write while the coordinates move to numeric columns, see backfill.py
+    backfill.get_backfill("coordinates").dual_write(instance)
+
+
+@receiver(post_save, sender=UserProfile)
+def store_partial_numeric_coordinates(sender, instance, update_fields=None, **kwargs):
+    backfill.get_backfill("coordinates").store_partial(instance, update_fields)
+
+
+@receiver(m2m_changed, sender=UserProfile.services.through)
+def update_services_completeness(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # the cleared profiles are only known before the rows are gone
+        instance._cleared_profile_ids = list(instance.userprofile_set.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        masks = completeness.refresh_services_bit([instance.pk])
+        if instance.pk in masks:
+            instance.missing_fields_mask = masks[instance.pk]
+            instance.completeness = completeness.completeness_for(masks[instance.pk])
+    elif action == "post_clear":
+        completeness.refresh_services_bit(getattr(instance, "_cleared_profile_ids", []))
+    else:
+        completeness.refresh_services_bit(pk_set or [])
+
+
+@receiver(post_save, sender=UserProfile)
+def refresh_dispatch_profile(sender, instance, created, **kwargs):
+    if not created:
+        _refresh_dispatch_candidate(instance.user_id)
+
+
+@receiver(m2m_changed, sender=UserProfile.services.through)
+def refresh_dispatch_services(sender, instance, action, reverse, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # instance is the service, reload its whole index
+        transaction.on_commit(partial(dispatch.provider_index.forget, instance.pk))
+    else:
+        _refresh_dispatch_candidate(instance.user_id)
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_deleted_token_device(sender, instance, **kwargs):
+    # however the token goes (knox's expiry cleanup, logoutall, the admin, the
+    # sweeper), the device row naming it must not keep blocking logins. A row
+    # naming a newer token of the user is kept
+    UserDevice.objects.filter(pk=instance.user_id, token_key=instance.token_key).delete()
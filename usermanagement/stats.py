@@ -0,0 +1,136 @@
+"""
+Activity counters and the rating histogram stored on UserProfile.
+
+The counters are bumped with F() expressions from the signals in signals.py so
+provider lists can show them without aggregate queries. Orders count for the
+provider (`UserOrderDetails.user`) and are kept when orders are archived.
+``reconcile_profile_counters`` recomputes them from the source tables to fix
+any drift (updates through ``QuerySet.update``, raw SQL, crashes).
+"""
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from .models import ArchivedOrder, UserFeed, UserOrderDetails, UserProfile, UserRating
+
+ORDER_STATUS_COUNTERS = {
+    'completed': 'completed_orders_count',
+    'cancelled': 'cancelled_orders_count',
+}
+
+HISTOGRAM_FIELDS = {star: f'rating_{star}_count' for star in range(1, 6)}
+
+COUNTER_FIELDS = (
+    'orders_count', 'completed_orders_count', 'cancelled_orders_count',
+    'review_count', 'feed_post_count', *HISTOGRAM_FIELDS.values(),
+)
+
+
+def bump_counters(user_id, **deltas):
+    """
+    Add `deltas` (counter name -> amount) to the profile of `user_id`.
+
+    Decrements stop at 0: the counters are PositiveIntegerFields, and a
+    counter that already drifted low would otherwise fail the check
+    constraint (or wrap around) and abort the save that triggered it.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if deltas:
+        UserProfile.objects.filter(user_id=user_id).update(**{
+            field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+            for field, delta in deltas.items()
+        })
+
+
+def rating_deltas(previous, current):
+    """Histogram changes for a rating going from `previous` to `current` stars."""
+    deltas = {}
+    if previous in HISTOGRAM_FIELDS:
+        deltas[HISTOGRAM_FIELDS[previous]] = -1
+    if current in HISTOGRAM_FIELDS:
+        field = HISTOGRAM_FIELDS[current]
+        deltas[field] = deltas.get(field, 0) + 1
+    return deltas
+
+
+def rating_histograms(user_ids):
+    """Histogram fields by user id, from one grouped query."""
+    histograms = {}
+    rows = (
+        UserRating.objects.filter(user_id__in=user_ids, rating__in=HISTOGRAM_FIELDS)
+        .values('user_id', 'rating').annotate(n=Count('pk')).values_list('user_id', 'rating', 'n')
+    )
+    for user_id, star, n in rows:
+        histograms.setdefault(user_id, {})[HISTOGRAM_FIELDS[star]] = n
+    return histograms
+
+
+def order_status_deltas(previous, current, created):
+    deltas = {}
+    if created:
+        deltas['orders_count'] = 1
+    if previous in ORDER_STATUS_COUNTERS:
+        deltas[ORDER_STATUS_COUNTERS[previous]] = -1
+    if current in ORDER_STATUS_COUNTERS:
+        field = ORDER_STATUS_COUNTERS[current]
+        deltas[field] = deltas.get(field, 0) + 1
+    return deltas
+
+
+def _order_counts(queryset, user_ids):
+    return {
+        row['user_id']: row
+        for row in queryset.filter(user_id__in=user_ids).values('user_id').annotate(
+            total=Count('pk'),
+            completed=Count('pk', filter=Q(status='completed')),
+            cancelled=Count('pk', filter=Q(status='cancelled')),
+        )
+    }
+
+
+def _counts(queryset, user_ids):
+    return dict(
+        queryset.filter(user_id__in=user_ids).values('user_id')
+        .annotate(n=Count('pk')).values_list('user_id', 'n')
+    )
+
+
+def reconcile_profile_counters(batch_size=500):
+    """
+    Recompute the counters for all profiles, a batch of users at a time with
+    one grouped query per source table. Returns the number of profiles fixed.
+    """
+    fixed = 0
+    last_pk = 0
+    while True:
+        profiles = list(
+            UserProfile.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'user_id', *COUNTER_FIELDS)[:batch_size]
+        )
+        if not profiles:
+            return fixed
+        last_pk = profiles[-1].pk
+        user_ids = [profile.user_id for profile in profiles]
+        live = _order_counts(UserOrderDetails.objects, user_ids)
+        archived = _order_counts(ArchivedOrder.objects, user_ids)
+        reviews = _counts(UserRating.objects, user_ids)
+        posts = _counts(UserFeed.objects, user_ids)
+        histograms = rating_histograms(user_ids)
+
+        changed = []
+        for profile in profiles:
+            orders = [live.get(profile.user_id, {}), archived.get(profile.user_id, {})]
+            expected = {
+                'orders_count': sum(row.get('total', 0) for row in orders),
+                'completed_orders_count': sum(row.get('completed', 0) for row in orders),
+                'cancelled_orders_count': sum(row.get('cancelled', 0) for row in orders),
+                'review_count': reviews.get(profile.user_id, 0),
+                'feed_post_count': posts.get(profile.user_id, 0),
+            }
+            histogram = histograms.get(profile.user_id, {})
+            expected.update({field: histogram.get(field, 0) for field in HISTOGRAM_FIELDS.values()})
+            if any(getattr(profile, field) != value for field, value in expected.items()):
+                for field, value in expected.items():
+                    setattr(profile, field, value)
+                changed.append(profile)
+        UserProfile.objects.bulk_update(changed, COUNTER_FIELDS)
+        fixed += len(changed)
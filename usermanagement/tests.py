@@ -1,3 +1,1561 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import runpy
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from knox.models import AuthToken
+from kajbondhu import shedding, startup, tracing
+from kajbondhu.middleware import middleware_for
+from kajbondhu.pooling import pool_stats
+from kajbondhu.routers import ReadYourWritesMiddleware
+from . import archive, availability, backfill, completeness, dispatch, ratings, realtime, search, stats, tokens
+from .idempotency import idempotent
+from .models import (
+    ArchivedOrder, BackfillCheckpoint, FeedToken, IdempotencyKey, OrderPaymentDetails, PaymentModel, Services,
+    StoredFile, UserDevice, UserFeed, UserOrderDetails, UserProfile, UserRating,
+)
+from .throttling import IPRateThrottle
+from .query_plans import ALLOWED_SCANS, SUPPORTED_VENDORS, explain, hot_queries, plan_problems
+from .uploads import ContentAddressedStorage
+
+REPLICA_ALIAS = 'replica_1'
+
+
+class ReadYourWritesTests(TransactionTestCase):
+    """
+    Reads of safe requests go to the replica unless the same client just wrote.
+    Runs with a real replica alias, a test mirror of the primary; a
+    TransactionTestCase so its connection sees the committed rows.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        replica = {**settings.DATABASES[DEFAULT_DB_ALIAS], 'TEST': {'MIRROR': DEFAULT_DB_ALIAS}}
+        cls.enterClassContext(override_settings(DATABASES={**settings.DATABASES, REPLICA_ALIAS: replica}))
+        # connections reads DATABASES once, add the alias to it as well. The
+        # test runner sets up the databases of the class attribute before
+        # this runs, a mirror needs none of its own
+        connections.settings[REPLICA_ALIAS] = replica
+        connections[REPLICA_ALIAS].creation.set_as_test_mirror(connections[DEFAULT_DB_ALIAS].settings_dict)
+        cls.addClassCleanup(cls.remove_replica)
+        cls.databases = {DEFAULT_DB_ALIAS, REPLICA_ALIAS}
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections[REPLICA_ALIAS].close()
+        del connections[REPLICA_ALIAS]
+        del connections.settings[REPLICA_ALIAS]
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        # the alias the router picks for each request, recorded by the view
+        self.read_from = []
+
+    def view(self, status):
+        def get_response(request):
+            self.read_from.append(UserProfile.objects.all().db)
+            return HttpResponse(status=status)
+        return ReadYourWritesMiddleware(get_response)
+
+    def request(self, method, token=None, ip='10.0.0.1', status=200):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = getattr(self.factory, method)('/usermanagment/api/', REMOTE_ADDR=ip, **headers)
+        self.view(status)(request)
+        return self.read_from[-1]
+
+    def test_safe_request_reads_from_replica(self):
+        self.assertEqual(self.request('get', token='alice'), REPLICA_ALIAS)
+
+    def test_write_reads_from_primary(self):
+        self.assertEqual(self.request('post', token='alice', status=201), DEFAULT_DB_ALIAS)
+
+    def test_write_pins_the_same_client(self):
+        self.request('post', token='alice', status=201)
+        self.assertEqual(self.request('get', token='alice'), DEFAULT_DB_ALIAS)
+
+    def test_write_does_not_pin_other_clients_behind_the_same_address(self):
+        self.request('post', token='alice', status=201)
+        self.assertEqual(self.request('get', token='bob'), REPLICA_ALIAS)
+        self.assertEqual(self.request('get'), REPLICA_ALIAS)
+
+    def test_anonymous_write_pins_its_address(self):
+        self.request('post', status=201)
+        self.assertEqual(self.request('get'), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.request('get', ip='10.0.0.2'), REPLICA_ALIAS)
+        self.assertEqual(self.request('get', token='bob'), REPLICA_ALIAS)
+
+    def test_failed_write_does_not_pin(self):
+        self.request('post', token='alice', status=400)
+        self.assertEqual(self.request('get', token='alice'), REPLICA_ALIAS)
+
+    def test_primary_only_models_read_from_primary(self):
+        def get_response(request):
+            self.read_from.append(UserDevice.objects.all().db)
+            return HttpResponse()
+        ReadYourWritesMiddleware(get_response)(self.factory.get('/usermanagment/api/'))
+        self.assertEqual(self.read_from, [DEFAULT_DB_ALIAS])
+
+    def profile_reads(self, client, method, url, data=None):
+        """Send a request through the whole stack, return the aliases that read usermanagement_userprofile."""
+        aliases = []
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary, \
+                CaptureQueriesContext(connections[REPLICA_ALIAS]) as replica:
+            response = getattr(client, method)(url, data)
+        self.assertLess(response.status_code, 400, response.content)
+        for alias, queries in ((DEFAULT_DB_ALIAS, primary), (REPLICA_ALIAS, replica)):
+            if any(query['sql'].startswith('SELECT') and 'usermanagement_userprofile' in query['sql'] for query in queries):
+                aliases.append(alias)
+        return aliases
+
+    def test_reads_hit_the_replica_until_the_client_writes(self):
+        alice, bob = (User.objects.create_user(name) for name in ('alice', 'bob'))
+        UserProfile.objects.create(user=alice)
+        clients = {}
+        for user in (alice, bob):
+            clients[user] = APIClient()
+            clients[user].credentials(HTTP_AUTHORIZATION=f'Token {AuthToken.objects.create(user)[1]}')
+        summary = reverse('usermanagement:provider_rating_summary', args=[alice.pk])
+        self.assertEqual(self.profile_reads(clients[alice], 'get', summary), [REPLICA_ALIAS])
+        self.profile_reads(clients[alice], 'patch', reverse('usermanagement:update_profile'), {'bio': 'Plumber'})
+        # the write is read back from the primary, other clients keep reading the replica
+        self.assertEqual(self.profile_reads(clients[alice], 'get', summary), [DEFAULT_DB_ALIAS])
+        self.assertEqual(self.profile_reads(clients[bob], 'get', summary), [REPLICA_ALIAS])
+        with self.settings(READ_YOUR_WRITES_SECONDS=0):
+            cache.clear()
+            self.assertEqual(self.profile_reads(clients[alice], 'get', summary), [REPLICA_ALIAS])
+
+    def test_streamed_export_reads_from_the_alias_of_its_request(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        UserProfile.objects.create(user=staff)
+        order = UserOrderDetails.objects.create(
+            user=User.objects.create_user('provider'), booking_user=User.objects.create_user('customer'),
+            service=Services.objects.create(name='Plumbing'),
+            selected_payment=PaymentModel.objects.create(name='Cash'),
+            order_for_date=timezone.make_aware(datetime(2030, 1, 7, 10)),
+        )
+        OrderPaymentDetails.objects.create(order=order, payment_method='cash', transaction_id='tx-1', amount=500)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {AuthToken.objects.create(staff)[1]}')
+
+        def export_reads():
+            response = client.get(reverse('usermanagement:order_export'))
+            aliases = set()
+            # the rows are read while the body streams, after the middleware returned
+            with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary, \
+                    CaptureQueriesContext(connections[REPLICA_ALIAS]) as replica:
+                body = b''.join(response.streaming_content).decode()
+            self.assertIn('tx-1', body)
+            for alias, queries in ((DEFAULT_DB_ALIAS, primary), (REPLICA_ALIAS, replica)):
+                for table in ('usermanagement_userorderdetails', 'usermanagement_orderpaymentdetails'):
+                    if any(table in query['sql'] for query in queries):
+                        aliases.add((alias, table))
+            return aliases
+
+        self.assertEqual(export_reads(), {
+            (REPLICA_ALIAS, 'usermanagement_userorderdetails'), (REPLICA_ALIAS, 'usermanagement_orderpaymentdetails'),
+        })
+        self.assertEqual(client.patch(reverse('usermanagement:update_profile'), {'bio': 'Admin'}).status_code, 200)
+        self.assertEqual(export_reads(), {
+            (DEFAULT_DB_ALIAS, 'usermanagement_userorderdetails'), (DEFAULT_DB_ALIAS, 'usermanagement_orderpaymentdetails'),
+        })
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries seek indexes, without full scans or extra sorts."""
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor not in SUPPORTED_VENDORS:
+            self.skipTest(f"Query plan checks are not supported on {connection.vendor}.")
+        for name, queryset in hot_queries().items():
+            with self.subTest(name):
+                plan = explain(queryset)
+                self.assertEqual(plan_problems(plan, connection.vendor, ALLOWED_SCANS.get(name, ())), [], plan)
+
+    def test_plan_problems_reports_scans_and_sorts(self):
+        self.assertEqual(
+            plan_problems('2 0 0 SCAN usermanagement_userfeed\n9 0 0 USE TEMP B-TREE FOR ORDER BY', 'sqlite'),
+            ['SCAN usermanagement_userfeed', 'USE TEMP B-TREE FOR ORDER BY'],
+        )
+        self.assertEqual(plan_problems('3 0 0 SEARCH usermanagement_userfeed USING INDEX feed_user_created_idx (user_id=?)', 'sqlite'), [])
+        self.assertEqual(
+            plan_problems('Sort  (cost=1.1..1.2)\n  Sort Key: order_date\n  ->  Seq Scan on usermanagement_userorderdetails', 'postgresql'),
+            ['Sort  (cost=1.1..1.2)', 'Seq Scan on usermanagement_userorderdetails'],
+        )
+
+    def test_plan_problems_reports_full_index_scans(self):
+        scan = '4 0 0 SCAN usermanagement_userprofile USING COVERING INDEX profile_incomplete_idx'
+        self.assertEqual(plan_problems(scan, 'sqlite'), [scan[6:]])
+        self.assertEqual(plan_problems(scan, 'sqlite', ['profile_incomplete_idx']), [])
+        self.assertEqual(plan_problems(scan, 'sqlite', ['profile_incomplete']), [scan[6:]])
+        full = 'Limit  (cost=0.1..1.2)\n  ->  Index Scan using order_user_date_idx on usermanagement_userorderdetails\n        Filter: (booking_user_id = 1)'
+        seek = 'Index Only Scan using order_user_date_idx on usermanagement_userorderdetails\n  Index Cond: (user_id = 1)'
+        self.assertEqual(
+            plan_problems(full, 'postgresql'),
+            ['Index Scan using order_user_date_idx on usermanagement_userorderdetails'],
+        )
+        self.assertEqual(plan_problems(full, 'postgresql', ['order_user_date_idx']), [])
+        self.assertEqual(plan_problems(seek, 'postgresql'), [])
+
+
+class ListInputTests(TestCase):
+    """Malformed paging and filter parameters get a 400, not a server error."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def assertRejected(self, url, params):
+        for value in params:
+            with self.subTest(value):
+                self.assertEqual(self.client.get(url, value).status_code, 400)
+
+    def test_incomplete_profiles(self):
+        url = reverse('usermanagement:incomplete_profiles')
+        self.assertRejected(url, [{'limit': 0}, {'limit': -3}, {'limit': 'x'}, {'cursor': '5'}, {'cursor': '5:6:7'}, {'cursor': 'a:b'}])
+        self.assertEqual(self.client.get(url, {'limit': 1, 'cursor': '5:6'}).status_code, 200)
+
+    def test_provider_reviews(self):
+        url = reverse('usermanagement:provider_reviews', args=[self.staff.pk])
+        self.assertRejected(url, [{'limit': 0}, {'limit': -2}, {'cursor': 'bm9wZQ'}])
+        self.assertEqual(self.client.get(url, {'limit': 1}).status_code, 200)
+
+    def test_order_list(self):
+        url = reverse('usermanagement:order_list')
+        self.assertRejected(url, [{'limit': 0}, {'limit': -1}, {'limit': 'x'}, {'cursor': 'bm9wZQ'}, {'cursor': '!'}])
+        self.assertEqual(self.client.get(url, {'limit': 1}).status_code, 200)
+
+    def test_order_export_dates(self):
+        url = reverse('usermanagement:order_export')
+        self.assertRejected(url, [{'from': '2024-02-30'}, {'to': '2024-13-01'}, {'from': 'soon'}, {'to': '9999-12-31'}])
+        self.assertEqual(self.client.get(url, {'from': '2024-02-29', 'to': '2024-03-01'}).status_code, 200)
+
+    def test_order_export_dates_are_local_days(self):
+        service = Services.objects.create(name='Plumbing')
+        payment = PaymentModel.objects.create(name='Cash')
+        placed = ['2024-03-01T00:10', '2024-03-01T23:50', '2024-03-02T00:10']
+        for value in placed:
+            order = UserOrderDetails.objects.create(
+                user=self.staff, booking_user=self.staff, service=service, selected_payment=payment,
+                order_for_date=timezone.now(), status='completed',
+            )
+            order_date = timezone.make_aware(datetime.fromisoformat(value))
+            UserOrderDetails.objects.filter(pk=order.pk).update(order_date=order_date)
+        response = self.client.get(
+            reverse('usermanagement:order_export'), {'file_format': 'ndjson', 'from': '2024-03-01', 'to': '2024-03-01'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+
+class ThrottleIdentTests(SimpleTestCase):
+    """Per-IP throttles key on the connecting address, not a client supplied header."""
+
+    def ident(self, **meta):
+        return IPRateThrottle().get_ident(RequestFactory().post('/', REMOTE_ADDR='10.0.0.1', **meta))
+
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        self.assertEqual(self.ident(HTTP_X_FORWARDED_FOR='1.2.3.4'), '10.0.0.1')
+        self.assertEqual(self.ident(HTTP_X_FORWARDED_FOR='5.6.7.8'), '10.0.0.1')
+
+    def test_forwarded_for_is_read_behind_trusted_proxies(self):
+        rest_framework = {**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}
+        with self.settings(REST_FRAMEWORK=rest_framework):
+            self.assertEqual(self.ident(HTTP_X_FORWARDED_FOR='9.9.9.9, 1.2.3.4'), '1.2.3.4')
+
+
+class OrderSlotTests(TestCase):
+    """Pending orders hold their slots; overlaps are refused and releases keep other orders' slots."""
+    day = date(2030, 1, 7)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = User.objects.create_user('provider')
+        cls.customer = User.objects.create_user('customer')
+        cls.service = Services.objects.create(name='Plumbing')
+        cls.payment = PaymentModel.objects.create(name='Cash')
+
+    def at(self, clock, day=None):
+        return timezone.make_aware(datetime.combine(day or self.day, datetime.strptime(clock, '%H:%M').time()))
+
+    def order(self, clock, day=None, **fields):
+        return UserOrderDetails.objects.create(
+            user=self.provider, booking_user=self.customer, service=self.service,
+            selected_payment=self.payment, order_for_date=self.at(clock, day), **fields,
+        )
+
+    def booked(self, day=None):
+        return availability.format_ranges(availability.day_masks([self.provider.pk], day or self.day)[self.provider.pk][1])
+
+    def test_overlapping_order_is_refused(self):
+        self.order('10:00')
+        with self.assertRaises(availability.SlotsUnavailable):
+            self.order('10:30')
+        self.order('11:00')
+        self.assertEqual(self.booked(), ['10:00-12:00'])
+        self.assertEqual(UserOrderDetails.objects.count(), 2)
+
+    def test_release_keeps_slots_of_other_pending_orders(self):
+        first = self.order('10:00')
+        # an overlapping order saved without signals, e.g. from before the calendars
+        UserOrderDetails.objects.bulk_create([UserOrderDetails(
+            user=self.provider, booking_user=self.customer, service=self.service,
+            selected_payment=self.payment, order_for_date=self.at('10:30'),
+        )])
+        first.status = 'cancelled'
+        first.save()
+        self.assertEqual(self.booked(), ['10:30-11:30'])
+
+    def test_delete_and_complete_release_slots(self):
+        first, second = self.order('09:00'), self.order('14:00')
+        first.delete()
+        self.assertEqual(self.booked(), ['14:00-15:00'])
+        second.status = 'completed'
+        second.save(update_fields=['status'])
+        self.assertEqual(self.booked(), [])
+
+    def test_reopening_books_again(self):
+        order = self.order('10:00', status='cancelled')
+        self.assertEqual(self.booked(), [])
+        order.status = 'pending'
+        order.save()
+        self.assertEqual(self.booked(), ['10:00-11:00'])
+
+    def test_reschedule_moves_slots(self):
+        order = self.order('10:00')
+        # overlapping its own current slots is fine
+        order.order_for_date = self.at('10:15')
+        order.save()
+        self.assertEqual(self.booked(), ['10:15-11:15'])
+        next_day = date(2030, 1, 8)
+        order.order_for_date = self.at('09:00', next_day)
+        order.save()
+        self.assertEqual(self.booked(), [])
+        self.assertEqual(self.booked(next_day), ['09:00-10:00'])
+
+    def test_reschedule_onto_taken_slots_is_refused(self):
+        self.order('10:00')
+        order = UserOrderDetails.objects.get(pk=self.order('12:00').pk)
+        order.order_for_date = self.at('10:30')
+        with self.assertRaises(availability.SlotsUnavailable):
+            order.save()
+        self.assertEqual(UserOrderDetails.objects.get(pk=order.pk).order_for_date, self.at('12:00'))
+        self.assertEqual(self.booked(), ['10:00-11:00', '12:00-13:00'])
+
+    def test_clean_reports_taken_slots(self):
+        self.order('10:00')
+        order = UserOrderDetails(
+            user=self.provider, booking_user=self.customer, service=self.service,
+            selected_payment=self.payment, order_for_date=self.at('10:45'),
+        )
+        with self.assertRaises(ValidationError):
+            order.clean()
+        order.order_for_date = self.at('11:00')
+        order.clean()
+
+    def test_order_api_answers_conflicts_with_409(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        data = {'user': self.provider.pk, 'service': 'Plumbing', 'selected_payment': 'Cash'}
+        url = reverse('usermanagement:order_list')
+        self.assertEqual(client.post(url, {**data, 'order_for_date': self.at('10:00').isoformat()}).status_code, 201)
+        self.assertEqual(client.post(url, {**data, 'order_for_date': self.at('10:30').isoformat()}).status_code, 409)
+        self.assertEqual(self.booked(), ['10:00-11:00'])
+
+    def test_closing_booked_slots_is_refused(self):
+        order = self.order('10:00')
+        self.order('15:00')
+        client = APIClient()
+        client.force_authenticate(self.provider)
+        url = reverse('usermanagement:availability', args=[self.day])
+        response = client.put(url, {'open': ['12:00-18:00']}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['orders'], [str(order.pk)])
+        self.assertEqual(client.get(url).json()['open'], ['00:00-24:00'])
+        response = client.put(url, {'open': ['09:00-12:00', '14:00-18:00']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['booked'], ['10:00-11:00', '15:00-16:00'])
+        # once the order is cancelled its time can close
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(client.put(url, {'open': ['14:00-18:00']}, format='json').status_code, 200)
+
+    @override_settings(AVAILABILITY_DEFAULT_OPEN='09:00-12:00')
+    def test_free_slots_count_free_providers(self):
+        UserProfile.objects.create(user=self.provider).services.add(self.service)
+        UserProfile.objects.create(user=User.objects.create_user('other')).services.add(self.service)
+        UserProfile.objects.create(user=User.objects.create_user('electrician'))
+        self.order('10:00')
+        quarters = [f'{hour}:{minute}' for hour in ('09', '10') for minute in ('00', '15', '30', '45')]
+        # the provider is booked 10:00-11:00, the other one has no row and keeps the default hours
+        self.assertEqual(
+            availability.free_slots(self.service, self.day),
+            [('09:00', 2)] + [(start, 1) for start in quarters[1:]] + [('11:00', 2)],
+        )
+        self.assertEqual(availability.free_slots(self.service, self.day, duration_minutes=180), [('09:00', 1)])
+        with mock.patch('django.utils.timezone.now', return_value=self.at('10:05')):
+            self.assertEqual(
+                availability.free_slots(self.service, self.day),
+                [('10:15', 1), ('10:30', 1), ('10:45', 1), ('11:00', 2)],
+            )
+
+    def test_free_slots_view(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        url = reverse('usermanagement:free_slots')
+        UserProfile.objects.create(user=self.provider).services.add(self.service)
+        response = client.get(url, {'service': 'Plumbing', 'date': str(self.day), 'duration': 1440})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['slots'], [{'start': '00:00', 'providers': 1}])
+        self.assertEqual(client.get(url, {'service': 'Gardening', 'date': str(self.day)}).status_code, 404)
+        self.assertEqual(client.get(url, {'service': 'Plumbing', 'date': '2030-02-30'}).status_code, 400)
+        self.assertEqual(client.get(url, {'service': 'Plumbing', 'date': str(self.day), 'duration': 0}).status_code, 400)
+
+
+class TraceParentTests(SimpleTestCase):
+    """An incoming traceparent keeps its trace id but decides sampling only from trusted callers."""
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    traceparent = f'00-{trace_id}-00f067aa0ba902b7-01'
+
+    def root(self):
+        with mock.patch.object(tracing.export_queue, 'put'), tracing.trace('GET /', self.traceparent) as root:
+            return root
+
+    def test_sampled_flag_is_ignored_by_default(self):
+        with self.settings(TRACE_SAMPLE_RATE=0, TRACE_TRUST_PARENT=False):
+            root = self.root()
+        self.assertEqual(root.trace.trace_id, self.trace_id)
+        self.assertFalse(root.trace.sampled)
+
+    def test_sampled_flag_is_followed_from_trusted_callers(self):
+        with self.settings(TRACE_SAMPLE_RATE=0, TRACE_TRUST_PARENT=True):
+            root = self.root()
+        self.assertEqual(root.trace.trace_id, self.trace_id)
+        self.assertTrue(root.trace.sampled)
+
+
+class TracingTests(SimpleTestCase):
+    """Spans nest under the root span, which is always exported, and every response gets its trace id."""
+
+    def setUp(self):
+        self.exported = []
+        patcher = mock.patch.object(tracing.export_queue, 'put', side_effect=self.exported.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_spans_nest_under_the_current_span(self):
+        with self.settings(TRACE_SAMPLE_RATE=1), tracing.trace('GET /') as root:
+            with tracing.span('outer') as outer, tracing.span('inner', key='value') as inner:
+                pass
+            with tracing.span('sibling') as sibling:
+                pass
+        self.assertEqual([item.name for item in self.exported[0]], ['inner', 'outer', 'sibling', 'GET /'])
+        self.assertEqual((inner.parent_id, outer.parent_id, sibling.parent_id), (outer.span_id, root.span_id, root.span_id))
+        self.assertEqual(inner.attributes, {'key': 'value'})
+        self.assertIsNone(tracing.current_span())
+
+    def test_root_span_is_kept_when_spans_are_dropped(self):
+        with self.settings(TRACE_SAMPLE_RATE=1, TRACE_MAX_SPANS=3), tracing.trace('GET /'):
+            for number in range(5):
+                with tracing.span(f's{number}'):
+                    pass
+        spans = self.exported[0]
+        self.assertEqual([item.name for item in spans], ['s0', 's1', 'GET /'])
+        self.assertEqual(spans[-1].attributes['trace.dropped_spans'], 3)
+        kinds = {item['name']: item['kind'] for item in tracing.otlp_payload(spans, 'test')['resourceSpans'][0]['scopeSpans'][0]['spans']}
+        self.assertEqual(kinds, {'s0': 1, 's1': 1, 'GET /': 2})
+
+    def test_sampling_follows_the_rate(self):
+        with self.settings(TRACE_SAMPLE_RATE=0.5):
+            self.assertTrue(tracing.should_sample('0' * 24 + '7fffffff'))
+            self.assertFalse(tracing.should_sample('0' * 24 + '80000000'))
+        with self.settings(TRACE_SAMPLE_RATE=0):
+            self.assertFalse(tracing.should_sample('0' * 24 + '00000000'))
+            with tracing.trace('GET /') as root, tracing.span('query') as child:
+                self.assertIs(child, tracing.NOOP_SPAN)
+        self.assertFalse(root.trace.sampled)
+        self.assertEqual(self.exported, [])
+        with self.settings(TRACE_SAMPLE_RATE=1):
+            self.assertTrue(tracing.should_sample('f' * 32))
+
+    def test_every_response_carries_the_trace_id(self):
+        middleware = tracing.TracingMiddleware(lambda request: HttpResponse())
+        for rate in (0, 1):
+            with self.subTest(rate=rate), self.settings(TRACE_SAMPLE_RATE=rate):
+                response = middleware(RequestFactory().get('/'))
+                self.assertRegex(response['X-Trace-Id'], r'^[0-9a-f]{32}$')
+        self.assertEqual(len(self.exported), 1)
+        self.assertEqual(self.exported[0][-1].trace.trace_id, response['X-Trace-Id'])
+        self.assertEqual(self.exported[0][-1].attributes['http.status_code'], 200)
+        traceparent = f'00-{TraceParentTests.trace_id}-00f067aa0ba902b7-00'
+        response = middleware(RequestFactory().get('/', HTTP_TRACEPARENT=traceparent))
+        self.assertEqual(response['X-Trace-Id'], TraceParentTests.trace_id)
+
+    def test_json_lines_exporter_appends_one_line_per_span(self):
+        with self.settings(TRACE_SAMPLE_RATE=1), tracing.trace('GET /') as root:
+            with tracing.span('query', rows=2):
+                pass
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            tracing.JsonLinesExporter(path).export(self.exported[0])
+            tracing.JsonLinesExporter(path).export(self.exported[0])
+            with open(path, encoding='utf-8') as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual([line['name'] for line in lines], ['query', 'GET /'] * 2)
+        self.assertEqual(lines[0]['parent_id'], root.span_id)
+        self.assertEqual(lines[0]['trace_id'], root.trace.trace_id)
+        self.assertEqual(lines[0]['attributes'], {'rows': 2})
+        self.assertGreaterEqual(lines[1]['duration_ms'], 0)
+
+
+class IdempotencyLeaseTests(TestCase):
+    """A key whose request never finished can be taken over once its lease has run out."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+
+    def setUp(self):
+        self.calls = 0
+        # run while the view handles the request, like a concurrent retry
+        self.during_view = None
+        test = self
+
+        class CreateService(APIView):
+            @idempotent
+            def post(self, request):
+                test.calls += 1
+                Services.objects.create(name=f'Service {test.calls}')
+                if test.during_view:
+                    test.during_view()
+                return Response({'call': test.calls}, status=201)
+
+        self.view = CreateService.as_view()
+
+    def post(self, key='key-1'):
+        request = APIRequestFactory().post('/', {'a': 1}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, self.user)
+        return self.view(request)
+
+    def test_retry_replays_the_stored_response(self):
+        def leased():
+            lease_end = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+            self.assertLessEqual(IdempotencyKey.objects.get().expires_at, lease_end)
+        self.during_view = leased
+        self.assertEqual(self.post().status_code, 201)
+        self.during_view = None
+        retry = self.post()
+        self.assertEqual((retry.status_code, retry.data, retry['Idempotent-Replayed']), (201, {'call': 1}, 'true'))
+        record = IdempotencyKey.objects.get()
+        self.assertGreater(record.expires_at, timezone.now() + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS - 1))
+
+    def test_abandoned_key_is_taken_over_after_the_lease(self):
+        self.post()
+        # as if the worker died before storing its response
+        IdempotencyKey.objects.update(status_code=None, response_body=None, expires_at=timezone.now() + timedelta(seconds=30))
+        self.assertEqual(self.post().status_code, 409)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.post()
+        self.assertEqual((response.status_code, response.data), (201, {'call': 2}))
+
+    def test_request_outliving_its_lease_does_not_overwrite_the_new_owner(self):
+        def taken_over():
+            record = IdempotencyKey.objects.get()
+            record.delete()
+            IdempotencyKey.objects.create(
+                user=self.user, key=record.key, fingerprint=record.fingerprint,
+                expires_at=timezone.now() + timedelta(seconds=60),
+            )
+        self.during_view = taken_over
+        self.assertEqual(self.post().status_code, 409)
+        self.assertFalse(Services.objects.exists())
+
+
+@override_settings(REALTIME_BROKER='usermanagement.realtime.InProcessBroker')
+class OrderEventTests(TestCase):
+    """Status changes reach both users of an order once committed, once per change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = User.objects.create_user('provider')
+        cls.customer = User.objects.create_user('customer')
+        cls.profile = UserProfile.objects.create(user=cls.provider)
+        cls.order = UserOrderDetails.objects.create(
+            user=cls.provider, booking_user=cls.customer,
+            service=Services.objects.create(name='Plumbing'),
+            selected_payment=PaymentModel.objects.create(name='Cash'),
+            order_for_date=timezone.make_aware(datetime(2030, 1, 7, 10)),
+        )
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        broker = realtime.get_broker()
+
+        async def subscribe(user):
+            return broker.subscribe(realtime.user_channel(user.pk))
+        self.queues = [self.loop.run_until_complete(subscribe(user)) for user in (self.provider, self.customer)]
+
+    def received(self):
+        """Events delivered to the provider and the customer since the last call."""
+        # run the deliveries publish() scheduled on the loop
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        for queue in self.queues:
+            events.append([])
+            while not queue.empty():
+                events[-1].append(queue.get_nowait())
+        return events
+
+    def complete(self, order):
+        order.status = 'completed'
+        order.save()
+
+    def test_event_is_published_on_commit(self):
+        order = UserOrderDetails.objects.get(pk=self.order.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.complete(order)
+            self.assertEqual(self.received(), [[], []])
+        provider_events, customer_events = self.received()
+        self.assertEqual(provider_events, customer_events)
+        self.assertEqual(len(provider_events), 1)
+        self.assertEqual(
+            {key: provider_events[0][key] for key in ('type', 'order_id', 'status', 'previous_status')},
+            {'type': 'order.status', 'order_id': str(order.pk), 'status': 'completed', 'previous_status': 'pending'},
+        )
+
+    def test_rolled_back_change_is_not_published(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.complete(UserOrderDetails.objects.get(pk=self.order.pk))
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.received(), [[], []])
+
+    def test_order_loaded_without_its_status(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = UserOrderDetails.objects.defer('status').get(pk=self.order.pk)
+            order.order_details = 'Ring twice'
+            order.save()
+        self.assertEqual(self.received(), [[], []])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.complete(UserOrderDetails.objects.only('pk').get(pk=self.order.pk))
+        self.assertEqual([event['previous_status'] for event in self.received()[0]], ['pending'])
+        self.profile.refresh_from_db()
+        self.assertEqual((self.profile.orders_count, self.profile.completed_orders_count), (1, 1))
+
+
+class OrderListTests(TestCase):
+    """The order list merges live and archived orders newest first and pages through them by cursor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = User.objects.create_user('provider')
+        cls.customer = User.objects.create_user('customer')
+        service = Services.objects.create(name='Plumbing')
+        payment = PaymentModel.objects.create(name='Cash')
+        # placed on days 1 to 6; the finished ones, on odd days, are archived.
+        # The one on day 3 was booked by the provider themselves
+        cls.placed = {}
+        for day in range(1, 7):
+            order = UserOrderDetails.objects.create(
+                user=cls.provider, booking_user=cls.provider if day == 3 else cls.customer,
+                service=service, selected_payment=payment, status='completed' if day % 2 else 'pending',
+                order_for_date=timezone.make_aware(datetime(2030, 1, day, 10)),
+            )
+            UserOrderDetails.objects.filter(pk=order.pk).update(order_date=timezone.make_aware(datetime(2024, 1, day)))
+            cls.placed[str(order.pk)] = day
+        archive.archive_batch(timezone.now(), 100)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def pages(self, user, limit):
+        self.client.force_authenticate(user)
+        pages, params = [], {'limit': limit}
+        while True:
+            response = self.client.get(reverse('usermanagement:order_list'), params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([(self.placed[order['order_id']], order['archived']) for order in response.data['results']])
+            if not response.data['next_cursor']:
+                return pages
+            params['cursor'] = response.data['next_cursor']
+
+    def test_live_and_archived_orders_are_merged_by_date(self):
+        self.assertEqual(self.pages(self.provider, 4), [
+            [(6, False), (5, True), (4, False), (3, True)],
+            [(2, False), (1, True)],
+        ])
+
+    def test_pages_follow_the_cursor(self):
+        self.assertEqual(self.pages(self.customer, 2), [
+            [(6, False), (5, True)],
+            [(4, False), (2, False)],
+            [(1, True)],
+        ])
+
+
+class CompletenessTests(TestCase):
+    """The missing fields mask follows saves, including ones of partly loaded profiles."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('provider')
+
+    def missing(self, profile):
+        profile.refresh_from_db()
+        return completeness.missing_fields(profile.missing_fields_mask)
+
+    def test_partly_loaded_profile_keeps_the_bits_of_unloaded_fields(self):
+        profile = UserProfile.objects.create(user=self.user, full_name='Rahim', bio='Plumber')
+        self.assertNotIn('full_name', self.missing(profile))
+        partial = UserProfile.objects.only('pk', 'user', 'phone_number').get(pk=profile.pk)
+        partial.phone_number = '01700000000'
+        partial.save()
+        missing = self.missing(profile)
+        self.assertNotIn('phone_number', missing)
+        self.assertNotIn('full_name', missing)
+        self.assertNotIn('bio', missing)
+        self.assertIn('website', missing)
+        self.assertEqual(profile.completeness, completeness.completeness_for(profile.missing_fields_mask))
+
+    def test_profiles_missing_every_given_field(self):
+        other = User.objects.create_user('other')
+        with_phone = UserProfile.objects.create(user=self.user, phone_number='01700000000')
+        without_phone = UserProfile.objects.create(user=other, bio='Electrician')
+        self.assertEqual(list(completeness.profiles_missing(['phone_number'])), [without_phone])
+        self.assertEqual(
+            set(completeness.profiles_missing(['website', 'services'])), {with_phone, without_phone},
+        )
+
+
+class RankProvidersTests(SimpleTestCase):
+    """The ring search around a location returns what scoring every provider returns."""
+    service_id = 'ranking-test'
+
+    def setUp(self):
+        dispatch.provider_index.clear()
+        self.addCleanup(dispatch.provider_index.clear)
+
+    def index(self, rng, size, center):
+        candidates = {}
+        for user_id in range(1, size + 1):
+            latitude = center[0] + rng.uniform(-1.5, 1.5)
+            # wrapped at the antimeridian
+            longitude = (center[1] + rng.uniform(-1.5, 1.5) + 180) % 360 - 180
+            if user_id % 17 == 0:
+                latitude, longitude = None, None
+            elif user_id % 23 == 0:
+                # one coordinate out of range, not located
+                longitude = 200
+            candidate = dispatch.Candidate(user_id, latitude, longitude, rng.choice([0, 2.5, 3.75, 4.2, 5]))
+            candidate.pending = rng.randrange(4)
+            candidates[user_id] = candidate
+        dispatch.provider_index._services[self.service_id] = dispatch._ServiceEntry(candidates)
+
+    def ranking(self, location, limit=None, exclude=()):
+        return [
+            (round(score, 9), candidate.user_id)
+            for score, candidate in dispatch.rank_providers(self.service_id, location, exclude, limit)
+        ]
+
+    def test_ring_search_matches_the_full_scan(self):
+        rng = random.Random(41)
+        for center in [(23.81, 90.41), (-33.9, 151.2), (64.1, -21.9), (0.01, 179.99)]:
+            self.index(rng, 400, center)
+            for _ in range(10):
+                location = (center[0] + rng.uniform(-1, 1), (center[1] + rng.uniform(-1, 1) + 180) % 360 - 180)
+                limit = rng.choice([1, 3, 5, 20])
+                exclude = set(rng.sample(range(1, 401), 5))
+                for max_distance in (10, 50, 300):
+                    with self.subTest(center=center, location=location, limit=limit, max_distance=max_distance), \
+                            self.settings(DISPATCH_MAX_DISTANCE_KM=max_distance, DISPATCH_INDEX_TTL=3600):
+                        full = self.ranking(location, exclude=exclude)
+                        self.assertEqual(self.ranking(location, limit, exclude), full[:limit])
+
+
+class DispatchTests(TestCase):
+    """Dispatch picks the best free provider and falls back when its slots are taken."""
+    when = datetime(2030, 1, 7, 10)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer')
+        UserProfile.objects.create(user=cls.customer, latitute='23.8100', longitude='90.4100')
+        cls.service = Services.objects.create(name='Plumbing')
+        cls.payment = PaymentModel.objects.create(name='Cash')
+        # the near one ranks first
+        cls.near, cls.far = (User.objects.create_user(name) for name in ('near', 'far'))
+        for user, longitude in ((cls.near, '90.4110'), (cls.far, '90.4500')):
+            profile = UserProfile.objects.create(user=user, latitute='23.8100', longitude=longitude, rating=4)
+            profile.services.add(cls.service)
+
+    def setUp(self):
+        dispatch.provider_index.clear()
+        self.addCleanup(dispatch.provider_index.clear)
+
+    def order_for(self, provider, **fields):
+        return UserOrderDetails.objects.create(
+            user=provider, booking_user=self.customer, service=self.service, selected_payment=self.payment,
+            order_for_date=timezone.make_aware(self.when), **fields,
+        )
+
+    def dispatch(self):
+        return dispatch.dispatch_order(self.customer, self.service, self.payment, timezone.make_aware(self.when))
+
+    def test_best_provider_gets_the_order(self):
+        self.assertEqual(self.dispatch().user, self.near)
+
+    def test_falls_back_when_the_best_provider_is_booked(self):
+        self.order_for(self.near)
+        self.assertEqual(self.dispatch().user, self.far)
+        self.assertIsNone(self.dispatch())
+
+    def test_falls_back_when_slots_are_taken_after_the_check(self):
+        # the calendar still looked free when the candidates were checked
+        free = {user.pk: (availability.FULL_DAY, 0) for user in (self.near, self.far)}
+        self.order_for(self.near)
+        with mock.patch.object(availability, 'day_masks', return_value=free):
+            order = self.dispatch()
+        self.assertEqual(order.user, self.far)
+        self.assertEqual(UserOrderDetails.objects.filter(user=self.near).count(), 1)
+
+    def test_index_reloads_marked_providers(self):
+        candidates = dispatch.provider_index.candidates(self.service.pk)
+        self.assertEqual(candidates[self.far.pk].rating, 4)
+        UserProfile.objects.filter(user=self.far).update(rating=5)
+        self.assertEqual(dispatch.provider_index.candidates(self.service.pk)[self.far.pk].rating, 4)
+        dispatch.provider_index.mark_dirty(self.far.pk)
+        reloaded = dispatch.provider_index.candidates(self.service.pk)
+        self.assertEqual(reloaded[self.far.pk].rating, 5)
+        # the other rows and the entry a ranking may still iterate are kept
+        self.assertIs(reloaded[self.near.pk], candidates[self.near.pk])
+        self.assertEqual(candidates[self.far.pk].rating, 4)
+
+    def test_profile_saves_mark_the_provider_on_commit(self):
+        dispatch.provider_index.candidates(self.service.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = UserProfile.objects.get(user=self.far)
+            profile.rating = 2
+            profile.save()
+        self.assertEqual(dispatch.provider_index.candidates(self.service.pk)[self.far.pk].rating, 2)
+
+    def test_order_changes_adjust_the_load(self):
+        def pending():
+            return dispatch.provider_index.candidates(self.service.pk)[self.near.pk].pending
+        self.assertEqual(pending(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = self.order_for(self.near)
+        self.assertEqual(pending(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'completed'
+            order.save()
+        self.assertEqual(pending(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual(pending(), 0)
+
+
+class DeviceTokenTests(TestCase):
+    """The device row follows the token it names, so expired or deleted logins don't block new ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # signup stores the email as the username
+        cls.user = User.objects.create_user('rahim@example.com', 'rahim@example.com', 'secret-pass')
+
+    def expire(self):
+        past = timezone.now() - timedelta(minutes=1)
+        AuthToken.objects.filter(user=self.user).update(expiry=past)
+        UserDevice.objects.filter(pk=self.user.pk).update(expiry=past)
+
+    def login(self):
+        return self.client.post(
+            reverse('usermanagement:login'), {'email': 'rahim@example.com', 'password': 'secret-pass'},
+        )
+
+    def test_tokens_expire_after_the_ttl(self):
+        before = timezone.now()
+        tokens.issue_token(self.user)
+        device = UserDevice.objects.get(pk=self.user.pk)
+        ttl = timedelta(hours=settings.KNOX_TOKEN_TTL_HOURS)
+        self.assertTrue(before + ttl <= device.expiry <= timezone.now() + ttl)
+        self.assertTrue(tokens.has_active_device(self.user))
+        self.expire()
+        self.assertFalse(tokens.has_active_device(self.user))
+
+    def test_expired_login_does_not_block_a_new_one(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 401)
+        self.expire()
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_device_goes_with_its_token(self):
+        token = tokens.issue_token(self.user)
+        self.expire()
+        # knox deletes the expired token it is shown
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(client.get(reverse('usermanagement:profile')).status_code, 401)
+        self.assertFalse(AuthToken.objects.exists())
+        self.assertFalse(UserDevice.objects.exists())
+        # logoutall and the admin delete through querysets
+        tokens.issue_token(self.user)
+        self.user.auth_token_set.all().delete()
+        self.assertFalse(UserDevice.objects.exists())
+
+    def test_deleting_an_older_token_keeps_the_device(self):
+        tokens.issue_token(self.user)
+        old = AuthToken.objects.get()
+        tokens.issue_token(self.user)
+        old.delete()
+        device = UserDevice.objects.get(pk=self.user.pk)
+        self.assertEqual(device.token_key, AuthToken.objects.get().token_key)
+
+    def test_sweep_deletes_expired_tokens_and_devices(self):
+        other = User.objects.create_user('karim')
+        tokens.issue_token(self.user)
+        tokens.issue_token(other)
+        self.expire()
+        # a device row left behind by a token deleted without signals
+        stale = User.objects.create_user('stale')
+        UserDevice.objects.create(user=stale, token_key='gone', expiry=timezone.now() - timedelta(days=1))
+        self.assertEqual(tokens.sweep_expired_tokens(batch_size=1), (1, 1))
+        self.assertEqual(list(AuthToken.objects.values_list('user', flat=True)), [other.pk])
+        self.assertEqual(list(UserDevice.objects.values_list('pk', flat=True)), [other.pk])
+
+
+def png(color):
+    """A small PNG image upload of one `color`."""
+    from PIL import Image
+
+    data = io.BytesIO()
+    Image.new('RGB', (4, 4), color).save(data, 'PNG')
+    return SimpleUploadedFile('picture.png', data.getvalue(), content_type='image/png')
+
+
+class ContentAddressedStorageTests(TestCase):
+    """Identical uploads share one file, counted by StoredFile and deleted with its last reference."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        override = self.settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def stored(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media)
+            for directory, _, names in os.walk(self.media) for name in names
+        )
+
+    def test_identical_content_is_stored_once(self):
+        storage = ContentAddressedStorage()
+        first = storage.save('pictures/a.PNG', ContentFile(b'same bytes'))
+        second = storage.save('pictures/b.png', ContentFile(b'same bytes'))
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first, f'pictures/{digest[:2]}/{digest}.png')
+        self.assertEqual(second, first)
+        self.assertEqual(self.stored(), [first])
+
+    def test_concurrent_upload_of_the_same_content_keeps_the_name(self):
+        storage = ContentAddressedStorage()
+        name = storage.save('pictures/a.png', ContentFile(b'same bytes'))
+        # the other upload finished after this one checked for the file
+        with mock.patch.object(storage, 'exists', return_value=False):
+            self.assertEqual(storage.save('pictures/a.png', ContentFile(b'same bytes')), name)
+        self.assertEqual(self.stored(), [name])
+        with storage.open(name) as file:
+            self.assertEqual(file.read(), b'same bytes')
+
+    def test_references_are_counted_and_the_last_one_deletes_the_file(self):
+        profiles = [
+            UserProfile.objects.create(user=User.objects.create_user(name), profile_picture=png('red'))
+            for name in ('rahim', 'karim')
+        ]
+        name = profiles[0].profile_picture.name
+        self.assertEqual(profiles[1].profile_picture.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).ref_count, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            profiles[0].profile_picture = png('blue')
+            profiles[0].save()
+        self.assertEqual(StoredFile.objects.get(name=name).ref_count, 1)
+        self.assertEqual(len(self.stored()), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            profiles[1].delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertEqual(self.stored(), [profiles[0].profile_picture.name])
+
+
+class ProfileCounterTests(TestCase):
+    """The signals keep the profile counters in step and reconcile fixes any drift."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = User.objects.create_user('provider')
+        cls.customer = User.objects.create_user('customer')
+        cls.profile = UserProfile.objects.create(user=cls.provider)
+        cls.service = Services.objects.create(name='Plumbing')
+        cls.payment = PaymentModel.objects.create(name='Cash')
+
+    def counters(self, *fields):
+        return UserProfile.objects.values_list(*fields).get(pk=self.profile.pk)
+
+    def order(self, hour=10):
+        return UserOrderDetails.objects.create(
+            user=self.provider, booking_user=self.customer, service=self.service,
+            selected_payment=self.payment, order_for_date=timezone.make_aware(datetime(2030, 1, 7, hour)),
+        )
+
+    def test_rating_changes_move_the_histogram(self):
+        rating = UserRating.objects.create(user=self.provider, rating=4)
+        UserRating.objects.create(user=self.provider, rating=5)
+        self.assertEqual(self.counters('review_count', 'rating_4_count', 'rating_5_count'), (2, 1, 1))
+        rating.rating = 5
+        rating.save()
+        self.assertEqual(self.counters('review_count', 'rating_4_count', 'rating_5_count'), (2, 0, 2))
+        rating.delete()
+        self.assertEqual(self.counters('review_count', 'rating_4_count', 'rating_5_count'), (1, 0, 1))
+
+    def test_feed_posts_are_counted(self):
+        post = UserFeed.objects.create(user=self.provider, content='Open on Friday')
+        UserFeed.objects.create(user=self.provider, content='Closed on Saturday')
+        self.assertEqual(self.counters('feed_post_count'), (2,))
+        post.delete()
+        self.assertEqual(self.counters('feed_post_count'), (1,))
+
+    def test_order_status_changes_move_the_order_counters(self):
+        order = self.order()
+        self.order(hour=14)
+        fields = ('orders_count', 'completed_orders_count', 'cancelled_orders_count')
+        self.assertEqual(self.counters(*fields), (2, 0, 0))
+        order.status = 'completed'
+        order.save()
+        self.assertEqual(self.counters(*fields), (2, 1, 0))
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.counters(*fields), (2, 0, 1))
+
+    def test_decrement_of_a_drifted_counter_stops_at_zero(self):
+        rating = UserRating.objects.create(user=self.provider, rating=3)
+        UserFeed.objects.create(user=self.provider, content='Open on Friday')
+        UserProfile.objects.filter(pk=self.profile.pk).update(review_count=0, rating_3_count=0, feed_post_count=0)
+        rating.delete()
+        UserFeed.objects.filter(user=self.provider).delete()
+        self.assertEqual(self.counters('review_count', 'rating_3_count', 'feed_post_count'), (0, 0, 0))
+
+    def test_reconcile_recomputes_drifted_counters(self):
+        other = UserProfile.objects.create(user=User.objects.create_user('other'))
+        UserRating.objects.create(user=self.provider, rating=2)
+        UserFeed.objects.create(user=self.provider, content='Open on Friday')
+        self.order().delete()
+        order = self.order()
+        order.status = 'completed'
+        order.save()
+        ArchivedOrder.objects.create(
+            order_id=uuid.uuid4(), user=self.provider, booking_user=self.customer, status='cancelled',
+            order_date=timezone.now(), month=date(2029, 12, 1), payload={},
+        )
+        UserProfile.objects.filter(pk=self.profile.pk).update(
+            orders_count=9, completed_orders_count=0, review_count=0, rating_2_count=3, feed_post_count=0,
+        )
+        self.assertEqual(stats.reconcile_profile_counters(batch_size=1), 1)
+        self.assertEqual(
+            self.counters(*stats.COUNTER_FIELDS),
+            (2, 1, 1, 1, 1, 0, 1, 0, 0, 0),
+        )
+        other.refresh_from_db()
+        self.assertEqual([getattr(other, field) for field in stats.COUNTER_FIELDS], [0] * 10)
+        self.assertEqual(stats.reconcile_profile_counters(), 0)
+
+
+@override_settings(LOAD_SHED_MAX_QUEUE_MS=5000, CONCURRENCY_WAIT_MS=1000, CONCURRENCY_LIMITS={'/slow/': 1})
+class LoadSheddingTests(SimpleTestCase):
+    """Requests queued past the deadline or over their path's limit get a 503."""
+
+    def setUp(self):
+        stats = shedding.LoadStats()
+        patcher = mock.patch.object(shedding, 'load_stats', stats)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stats = stats
+        self.middleware = shedding.LoadSheddingMiddleware(lambda request: HttpResponse('ok'))
+        behind_proxy = self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1})
+        behind_proxy.enable()
+        self.addCleanup(behind_proxy.disable)
+
+    def get(self, path='/', queued_ms=None):
+        meta = {}
+        if queued_ms is not None:
+            meta['HTTP_X_REQUEST_START'] = f't={time.time() - queued_ms / 1000:.3f}'
+        return self.middleware(RequestFactory().get(path, **meta))
+
+    def test_request_start_units(self):
+        self.assertEqual(shedding.request_start('t=1700000000.5'), 1700000000.5)
+        self.assertEqual(shedding.request_start('1700000000500'), 1700000000.5)
+        self.assertEqual(shedding.request_start('1700000000500000'), 1700000000.5)
+        self.assertIsNone(shedding.request_start('t=soon'))
+
+    def test_queue_headers_are_ignored_without_trusted_proxies(self):
+        stale = RequestFactory().get('/', HTTP_X_REQUEST_START=f't={time.time() - 60:.3f}')
+        self.assertGreater(shedding.queue_time_ms(stale), 59000)
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 0}):
+            self.assertIsNone(shedding.queue_time_ms(stale))
+            self.assertEqual(self.middleware(stale).status_code, 200)
+
+    def test_request_past_the_deadline_is_shed(self):
+        self.assertEqual(self.get(queued_ms=150).status_code, 200)
+        response = self.get(queued_ms=6000)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.LOAD_SHED_RETRY_AFTER))
+        snapshot = self.stats.snapshot()
+        self.assertEqual((snapshot['in_flight'], snapshot['shed_late']), (0, 1))
+        self.assertEqual((snapshot['queue_ms']['<=250'], snapshot['queue_ms']['>5000']), (1, 1))
+
+    def test_request_over_the_limit_is_shed(self):
+        endpoint = self.middleware.limit_for('/slow/login/')
+        self.assertTrue(endpoint.acquire(0))
+        self.assertEqual(self.get('/fast/').status_code, 200)
+        with self.settings(CONCURRENCY_WAIT_MS=0):
+            self.assertEqual(self.get('/slow/login/').status_code, 503)
+        endpoint.release()
+        self.assertEqual(self.get('/slow/login/').status_code, 200)
+        self.assertEqual(
+            self.stats.snapshot()['endpoints']['/slow/'],
+            {'limit': 1, 'in_flight': 0, 'peak': 1, 'admitted': 2, 'waited': 1, 'shed': 1},
+        )
+        self.assertEqual(self.stats.snapshot()['shed_concurrency'], 1)
+
+    def test_request_waits_for_a_slot_but_not_past_its_deadline(self):
+        endpoint = self.middleware.limit_for('/slow/')
+        endpoint.acquire(0)
+        with mock.patch.object(endpoint, 'acquire', return_value=False) as acquire:
+            self.get('/slow/', queued_ms=4800)
+        self.assertLess(acquire.call_args.args[0], 0.25)
+        # a slot freed while waiting admits the request
+        threading.Timer(0.05, endpoint.release).start()
+        self.assertEqual(self.get('/slow/').status_code, 200)
+        self.assertEqual(endpoint.stats()['waited'], 1)
+
+
+class FeedSearchTests(TestCase):
+    """Posts are indexed as they change and ranked pages follow one order."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('rahim')
+
+    def setUp(self):
+        cache.delete(search.POST_COUNT_CACHE_KEY)
+        self.addCleanup(cache.delete, search.POST_COUNT_CACHE_KEY)
+
+    def post(self, content):
+        return UserFeed.objects.create(user=self.user, content=content)
+
+    def tokens(self, post):
+        return dict(FeedToken.objects.filter(feed=post).values_list('token', 'count'))
+
+    def ids(self, query, **kwargs):
+        results, last = search.search_feeds(query, **kwargs)
+        return [feed.pk for feed in results], last
+
+    def test_bengali_words_keep_their_vowel_signs(self):
+        self.assertEqual(search.tokenize('আমি ঢাকায় থাকি'), ['আমি', 'ঢাকায়', 'থাকি'])
+        # precomposed য় (U+09DF) and য + nukta are the same word
+        self.assertEqual(search.tokenize('\u09a2\u09be\u0995\u09be\u09df'), search.tokenize('ঢাকায়'))
+        self.assertEqual(search.tokenize('Plumber in DHAKA, ৫ বছর ও a'), ['plumber', 'in', 'dhaka', 'বছর'])
+        self.assertEqual(search.query_terms('dhaka Dhaka ঢাকা'), ['dhaka', 'ঢাকা'])
+
+    def test_edits_and_deletes_update_the_index(self):
+        post = self.post('plumber plumber ঢাকা')
+        self.assertEqual(self.tokens(post), {'plumber': 2, 'ঢাকা': 1})
+        post.content = 'electrician ঢাকা'
+        post.save()
+        self.assertEqual(self.tokens(post), {'electrician': 1, 'ঢাকা': 1})
+        self.assertEqual(self.ids('plumber'), ([], None))
+        self.assertEqual(self.ids('ঢাকা electrician')[0], [post.pk])
+        with self.assertNumQueries(1):
+            post.save(update_fields=['created_at'])
+        post.delete()
+        self.assertFalse(FeedToken.objects.exists())
+        self.assertEqual(self.ids('electrician'), ([], None))
+
+    def test_rebuild_matches_the_incremental_index(self):
+        posts = [self.post('plumber in dhaka'), self.post('ঢাকা plumber plumber')]
+        FeedToken.objects.filter(feed=posts[0]).delete()
+        self.assertEqual(search.rebuild_index(batch_size=1), 2)
+        self.assertEqual(self.tokens(posts[0]), {'plumber': 1, 'in': 1, 'dhaka': 1})
+        self.assertEqual(self.tokens(posts[1]), {'ঢাকা': 1, 'plumber': 2})
+
+    def test_pages_keep_the_first_page_order_when_weights_change(self):
+        posts = [
+            self.post('plumber plumber plumber dhaka'),
+            self.post('plumber plumber dhaka dhaka'),
+            self.post('plumber dhaka dhaka dhaka'),
+        ]
+        for _ in range(5):
+            self.post('dhaka')
+        ranked, last = self.ids('plumber dhaka')
+        self.assertEqual(ranked, [post.pk for post in posts])
+        self.assertIsNone(last)
+
+        paged, last = self.ids('plumber dhaka', limit=1)
+        # plumber becomes the common word, which would reverse the order
+        cache.delete(search.POST_COUNT_CACHE_KEY)
+        for _ in range(20):
+            self.post('plumber')
+        self.assertEqual(self.ids('plumber dhaka')[0], ranked[::-1])
+        while last:
+            page, last = self.ids('plumber dhaka', limit=1, after=last)
+            paged += page
+        self.assertEqual(paged, ranked)
+
+    def test_search_view_pages_with_the_cursor(self):
+        posts = [self.post('plumber dhaka dhaka'), self.post('plumber dhaka')]
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('usermanagement:feed_search')
+        first = client.get(url, {'q': 'Plumber Dhaka', 'limit': 1}).json()
+        self.assertEqual([result['id'] for result in first['results']], [posts[0].pk])
+        score, feed_id, weights = first['next_cursor'].split(':')
+        self.assertEqual((feed_id, len(weights.split(','))), (str(posts[0].pk), 2))
+        second = client.get(url, {'q': 'Plumber Dhaka', 'limit': 1, 'cursor': first['next_cursor']}).json()
+        self.assertEqual([result['id'] for result in second['results']], [posts[1].pk])
+        for cursor in (f'{score}:{feed_id}', f'{score}:{feed_id}:{weights.split(",")[0]}', 'a:b:c'):
+            response = client.get(url, {'q': 'plumber dhaka', 'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+class CoordinatesBackfillTests(TestCase):
+    """Saves dual-write the numeric coordinates and the backfill resumes from its checkpoint."""
+
+    def setUp(self):
+        self.backfill = backfill.get_backfill('coordinates')
+        self.profiles = [
+            UserProfile.objects.create(user=User.objects.create_user(f'user{i}'), latitute=f'23.{i}', longitude='90.4')
+            for i in range(5)
+        ]
+        # rows written before the dual-write was deployed
+        UserProfile.objects.update(latitude_num=None, longitude_num=None)
+
+    def coordinates(self):
+        return list(UserProfile.objects.order_by('pk').values_list('latitude_num', 'longitude_num'))
+
+    def expected(self):
+        return [(Decimal(f'23.{i}00000'), Decimal('90.400000')) for i in range(5)]
+
+    def test_run_resumes_after_an_interrupted_chunk(self):
+        checkpoint = backfill.run_backfill(self.backfill, batch_size=2, max_chunks=1)
+        self.assertEqual((checkpoint.processed, checkpoint.last_pk), (2, str(self.profiles[1].pk)))
+        convert = self.backfill.convert
+        calls = []
+
+        def fail_on_the_second_row(row):
+            calls.append(row.pk)
+            if len(calls) == 2:
+                raise RuntimeError('worker killed')
+            return convert(row)
+        with mock.patch.object(self.backfill, 'convert', fail_on_the_second_row), self.assertRaises(RuntimeError):
+            backfill.run_chunk(self.backfill, batch_size=2)
+        self.assertEqual(self.coordinates()[2:], [(None, None)] * 3)
+        checkpoint.refresh_from_db()
+        self.assertEqual((checkpoint.processed, checkpoint.last_pk), (2, str(self.profiles[1].pk)))
+
+        checkpoint = backfill.run_backfill(self.backfill, batch_size=2)
+        self.assertIsNotNone(checkpoint.completed_at)
+        self.assertEqual((checkpoint.processed, checkpoint.updated), (5, 5))
+        self.assertEqual(self.coordinates(), self.expected())
+        self.assertEqual(backfill.remaining_rows(self.backfill, checkpoint), 0)
+
+    def test_verify_reports_stale_rows(self):
+        backfill.run_backfill(self.backfill, batch_size=2)
+        self.assertEqual(backfill.verify_backfill(self.backfill), (5, 0, []))
+        # written around the signals, e.g. by a bulk update
+        UserProfile.objects.filter(pk__in=[self.profiles[1].pk, self.profiles[3].pk]).update(latitute='oops')
+        self.assertEqual(
+            backfill.verify_backfill(self.backfill, batch_size=2, sample=1),
+            (5, 2, [self.profiles[1].pk]),
+        )
+
+    def test_saves_write_the_numeric_columns(self):
+        profile = self.profiles[0]
+        profile.latitute, profile.longitude = ' 24.5 ', '200'
+        profile.save()
+        self.assertEqual(self.coordinates()[0], (Decimal('24.500000'), None))
+
+        profile = UserProfile.objects.only('pk', 'latitute').get(pk=self.profiles[1].pk)
+        profile.latitute = '25.25'
+        profile.save(update_fields=['latitute'])
+        self.assertEqual(self.coordinates()[1], (Decimal('25.250000'), Decimal('90.400000')))
+        self.assertEqual(profile.latitude_num, Decimal('25.250000'))
+
+    def test_concurrent_starts_share_the_checkpoint(self):
+        bulk_create = BackfillCheckpoint.objects.bulk_create
+
+        def started_elsewhere(*args, **kwargs):
+            # the other run stores the row just before this one inserts it
+            BackfillCheckpoint.objects.create(name='coordinates', last_pk=str(self.profiles[1].pk), processed=2)
+            return bulk_create(*args, **kwargs)
+        with mock.patch.object(BackfillCheckpoint.objects, 'bulk_create', started_elsewhere):
+            checkpoint = backfill.get_checkpoint(self.backfill)
+        self.assertEqual((checkpoint.processed, checkpoint.last_pk), (2, str(self.profiles[1].pk)))
+        self.assertEqual(BackfillCheckpoint.objects.filter(name='coordinates').count(), 1)
+        self.assertEqual(backfill.run_backfill(self.backfill, batch_size=2).processed, 5)
+
+
+class PathScopedMiddlewareTests(TestCase):
+    """The admin runs the full middleware stack, the token API only what it needs."""
+    outer = settings.MIDDLEWARE[:-1]
+
+    def test_chains_by_path(self):
+        self.assertEqual(middleware_for('/admin/login/'), self.outer + settings.FULL_MIDDLEWARE)
+        self.assertEqual(middleware_for('/usermanagment/api/swagger/'), self.outer + settings.FULL_MIDDLEWARE)
+        self.assertEqual(
+            middleware_for('/usermanagment/api/login/'),
+            self.outer + ['django.middleware.common.CommonMiddleware'],
+        )
+
+    def test_requests_run_their_chain(self):
+        admin = self.client.get('/admin/login/')
+        self.assertEqual(admin.status_code, 200)
+        self.assertEqual(admin['X-Frame-Options'], 'DENY')
+        self.assertIn(settings.CSRF_COOKIE_NAME, admin.cookies)
+        api = self.client.get(reverse('usermanagement:root'))
+        self.assertEqual(api.status_code, 200)
+        self.assertNotIn('X-Frame-Options', api)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, api.cookies)
+
+    def test_admin_checks_look_at_the_admin_chain(self):
+        self.assertEqual(checks.run_checks(tags=[checks.Tags.admin]), [])
+        minimal = {**settings.PATH_MIDDLEWARE, '/admin/': ['django.middleware.common.CommonMiddleware']}
+        with self.settings(PATH_MIDDLEWARE=minimal):
+            errors = checks.run_checks(tags=[checks.Tags.admin])
+        self.assertEqual([error.id for error in errors], ['admin.E408', 'admin.E409', 'admin.E410'])
+        # the admin falls back to FULL_MIDDLEWARE, so that is checked as well
+        with self.settings(FULL_MIDDLEWARE=[path for path in settings.FULL_MIDDLEWARE if 'messages' not in path]):
+            self.assertEqual([error.id for error in checks.run_checks(tags=[checks.Tags.admin])], ['admin.E409'])
+
+
+class RatingImportTests(TestCase):
+    """Imports insert in bulk and recompute each affected profile once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rahim = User.objects.create_user('rahim@example.com', email='Rahim@Example.com')
+        cls.karim = User.objects.create_user('karim@example.com', email='karim@example.com')
+        for user in (cls.rahim, cls.karim):
+            UserProfile.objects.create(user=user)
+
+    def profile(self, user):
+        return UserProfile.objects.values_list('rating', 'review_count', 'rating_4_count', 'rating_5_count').get(user=user)
+
+    def test_command_matches_emails_ignoring_case(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write(
+                'user_id,email,rating,comment,created_at\n'
+                ',rahim@example.com,5,Great,2024-03-01T10:00:00+06:00\n'
+                ', RAHIM@EXAMPLE.COM ,4,,\n'
+                f'{self.karim.pk},,5,,\n'
+                ',nobody@example.com,5,,\n'
+                ',karim@example.com,6,,\n'
+                '999999,,3,,\n'
+            )
+        self.addCleanup(os.remove, source.name)
+        out = io.StringIO()
+        call_command('import_ratings', source.name, '--batch-size', '2', stdout=out)
+        self.assertIn('Imported 3 ratings, skipped 3 invalid rows.', out.getvalue())
+        self.assertEqual(self.profile(self.rahim), (Decimal('4.50'), 2, 1, 1))
+        self.assertEqual(self.profile(self.karim), (Decimal('5.00'), 1, 0, 1))
+        self.assertEqual(
+            UserRating.objects.get(comment='Great').created_at,
+            datetime.fromisoformat('2024-03-01T10:00:00+06:00'),
+        )
+
+    def test_bulk_ingest_recomputes_once(self):
+        rows = [{'user_id': user.pk, 'rating': rating} for user in (self.rahim, self.karim) for rating in (4, 5, 5)]
+        with mock.patch.object(ratings, 'recompute_rating_stats', wraps=ratings.recompute_rating_stats) as recompute:
+            self.assertEqual(ratings.bulk_ingest_ratings(iter(rows), batch_size=4), 6)
+        recompute.assert_called_once_with({self.rahim.pk, self.karim.pk})
+        self.assertEqual(self.profile(self.rahim), (Decimal('4.67'), 3, 1, 2))
+
+    def test_deferred_updates_recompute_each_profile_once(self):
+        existing = UserRating.objects.create(user=self.karim, rating=4)
+        with mock.patch.object(ratings, 'recompute_rating_stats', wraps=ratings.recompute_rating_stats) as recompute, \
+                mock.patch('usermanagement.signals._recalculate_and_store_average') as per_rating:
+            with ratings.deferred_rating_updates():
+                for rating in (5, 4, 4):
+                    UserRating.objects.create(user=self.rahim, rating=rating)
+                with ratings.deferred_rating_updates():
+                    existing.rating = 5
+                    existing.save()
+                UserRating.objects.filter(user=self.rahim, rating=4).first().delete()
+                recompute.assert_not_called()
+        recompute.assert_called_once_with({self.rahim.pk, self.karim.pk})
+        per_rating.assert_not_called()
+        self.assertEqual(self.profile(self.rahim), (Decimal('4.50'), 2, 1, 1))
+        self.assertEqual(self.profile(self.karim), (Decimal('5.00'), 1, 0, 1))
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    """Replica aliases are independent copies of the primary's settings."""
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'kajbondhu', 'settings.py'))
+
+    def test_replicas_do_not_share_options(self):
+        databases = self.load_settings(
+            DB_REPLICA_HOSTS='replica-1.example.com, replica-2.example.com',
+            REDIS_URL='redis://cache:6379/0',
+            DB_POOL='true',
+        )['DATABASES']
+        self.assertEqual(sorted(databases), ['default', 'replica_1', 'replica_2'])
+        self.assertEqual(databases['replica_2']['HOST'], 'replica-2.example.com')
+        self.assertEqual(databases['replica_1']['OPTIONS'], databases['default']['OPTIONS'])
+        options = [databases[alias]['OPTIONS'] for alias in databases]
+        self.assertEqual(len({id(option) for option in options}), 3)
+        self.assertEqual(len({id(option['pool']) for option in options}), 3)
+        databases['replica_1']['OPTIONS']['pool']['max_size'] = 50
+        self.assertNotEqual(databases['default']['OPTIONS']['pool']['max_size'], 50)
+
+    def test_replicas_need_a_shared_cache(self):
+        with mock.patch.dict(os.environ, {'DB_REPLICA_HOSTS': 'replica-1.example.com'}):
+            os.environ.pop('REDIS_URL', None)
+            with self.assertRaises(ImproperlyConfigured):
+                runpy.run_path(os.path.join(settings.BASE_DIR, 'kajbondhu', 'settings.py'))
+
+
+class PoolMetricsTests(TestCase):
+    """Pool counters of every open pool are served to staff by the metrics endpoint."""
+    raw = {
+        'pool_min': 2, 'pool_max': 10, 'pool_size': 4, 'pool_available': 1, 'requests_waiting': 2,
+        'requests_num': 8, 'requests_queued': 2, 'requests_wait_ms': 40, 'connections_num': 4, 'connections_ms': 30,
+    }
+
+    def pools(self):
+        pool = mock.Mock(closed=False, **{'get_stats.return_value': self.raw})
+        return {
+            'default': mock.Mock(pool=pool),
+            'replica_1': mock.Mock(pool=mock.Mock(closed=True)),
+            'unpooled': mock.Mock(pool=None),
+        }
+
+    def test_pool_stats(self):
+        with mock.patch('kajbondhu.pooling.connections', self.pools()):
+            stats = pool_stats()
+        self.assertEqual(list(stats), ['default'])
+        self.assertEqual(stats['default'], {
+            **self.raw, 'in_use': 3, 'utilization': 0.3, 'waiting': 2,
+            'avg_wait_ms': 5.0, 'queued_ratio': 0.25, 'avg_connect_ms': 7.5,
+        })
+        self.assertEqual(pool_stats(), {})
+
+    def test_metrics_endpoint_is_staff_only(self):
+        client = APIClient()
+        url = reverse('usermanagement:metrics')
+        client.force_authenticate(User.objects.create_user('rahim'))
+        self.assertEqual(client.get(url).status_code, 403)
+        client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        with mock.patch('kajbondhu.pooling.connections', self.pools()):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(sorted(body), ['db_pools', 'load', 'tracing'])
+        self.assertEqual(body['db_pools']['default']['in_use'], 3)
+        self.assertIn('queue_ms', body['load'])
+
+
+class LazyStartupTests(SimpleTestCase):
+    """With LAZY_STARTUP the admin and the API docs load on first use, or all at once with warm_up()."""
+
+    def run_lazy(self, script):
+        """Run `script` in a new process started in lazy mode, return what it prints as JSON."""
+        setup = (
+            'import json, django\n'
+            'django.setup()\n'
+            'from django.contrib import admin\n'
+            'from usermanagement.models import UserProfile\n'
+            'from usermanagement.urls import get_api_schema_view\n'
+            'def loaded():\n'
+            '    return [admin.site.is_registered(UserProfile), get_api_schema_view.cache_info().currsize]\n'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', setup + textwrap.dedent(script)],
+            env={**os.environ, 'LAZY_STARTUP': 'true'}, cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_admin_and_docs_load_on_first_request(self):
+        result = self.run_lazy("""
+            from django.test import Client
+            client = Client()
+            before = loaded()
+            admin_status = client.get('/admin/login/').status_code
+            docs_status = client.get('/usermanagment/api/swagger/', {'format': 'openapi'}).status_code
+            print(json.dumps([before, admin_status, docs_status, loaded()]))
+        """)
+        self.assertEqual(result, [[False, 0], 200, 200, [True, 1]])
+
+    def test_warm_up_loads_everything(self):
+        result = self.run_lazy("""
+            from django.urls import reverse
+            from kajbondhu.startup import warm_up
+            before = loaded()
+            warm_up()
+            print(json.dumps([before, loaded(), reverse('admin:index')]))
+        """)
+        self.assertEqual(result, [[False, 0], [True, 1], '/admin/'])
+
+    def test_lazy_view_builds_the_view_once(self):
+        view = mock.Mock(return_value=HttpResponse('docs'))
+        factory = mock.Mock(side_effect=lambda: time.sleep(0.05) or view)
+        lazy = startup.lazy_view(factory)
+        request = RequestFactory().get('/')
+        threads = [threading.Thread(target=lazy, args=(request,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        factory.assert_called_once_with()
+        self.assertEqual(view.call_count, 4)
+        self.assertIs(lazy.load(), view)
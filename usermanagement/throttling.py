@@ -0,0 +1,88 @@
+"""
+Throttles for the unauthenticated endpoints that do expensive work.
+
+Login and signup hash passwords and password reset sends mail, so a burst of
+attempts can tie up every worker. Each of these views is throttled per client
+IP and per submitted email with a sliding window counter: one cache counter
+per fixed window, incremented atomically (INCR on Redis), with the previous
+window's count weighted by how much of it still overlaps the sliding window.
+That is two small cache keys per client, and no read-modify-write race like
+DRF's default timestamp-list throttles. The checks run before the view, so a
+rejected request does no hashing or database work.
+
+Rates live in ``REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']`` under
+``<view.throttle_scope>_ip`` and ``<view.throttle_scope>_email``.
+"""
+import hashlib
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    suffix = None
+
+    def __init__(self):
+        # the scope depends on the view, rates are resolved in allow_request
+        pass
+
+    def allow_request(self, request, view):
+        self.scope = f"{getattr(view, 'throttle_scope', None)}_{self.suffix}"
+        if self.scope not in self.THROTTLE_RATES:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        window, offset = divmod(now, self.duration)
+        current_key = f'{self.key}:{int(window)}'
+        previous_key = f'{self.key}:{int(window) - 1}'
+        # keep each window for two durations, it is read as the previous one
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # expired between add and incr
+            self.cache.set(current_key, 1, self.duration * 2)
+            current = 1
+        previous = self.cache.get(previous_key, 0)
+
+        remaining = 1 - offset / self.duration
+        if previous * remaining + current <= self.num_requests:
+            return True
+        if current >= self.num_requests or not previous:
+            self.wait_seconds = remaining * self.duration
+        else:
+            # until enough of the previous window has slid out
+            needed = 1 - (self.num_requests - current) / previous
+            self.wait_seconds = max(needed - offset / self.duration, 0) * self.duration
+        return False
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    suffix = 'ip'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
+
+
+class EmailRateThrottle(SlidingWindowThrottle):
+    """Throttles by the ``email`` in the request body, whatever the client IP."""
+    suffix = 'email'
+
+    def get_cache_key(self, request, view):
+        try:
+            email = request.data.get('email')
+        except AttributeError:
+            return None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        digest = hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+        return f'throttle:{self.scope}:{digest}'
@@ -0,0 +1,50 @@
+"""
+Knox token issuing, the single-device index and the expired token sweeper.
+
+Each user has at most one ``UserDevice`` row (keyed by user id) describing the
+token of the device they are logged in on, so ``LoginView`` can check for an
+active login with a single primary key lookup instead of scanning
+``AuthToken`` rows. The row goes away with the token it names, however the
+token is deleted (see signals.py), and with its expiry.
+"""
+from django.db.models import Q
+from django.utils import timezone
+from knox.models import AuthToken
+
+from kajbondhu.tracing import span
+from .models import UserDevice
+from .utils import delete_in_batches
+
+
+def issue_token(user):
+    """Create a Knox token for `user` and record it as their active device."""
+    with span('token.issue'):
+        with span('token.create'):
+            instance, token = AuthToken.objects.create(user)
+        UserDevice.objects.update_or_create(
+            user=user,
+            defaults={'token_key': instance.token_key, 'expiry': instance.expiry},
+        )
+    return token
+
+
+def has_active_device(user):
+    return UserDevice.objects.filter(
+        Q(expiry__isnull=True) | Q(expiry__gt=timezone.now()), pk=user.pk
+    ).exists()
+
+
+def revoke_tokens(user):
+    AuthToken.objects.filter(user=user).delete()
+    UserDevice.objects.filter(pk=user.pk).delete()
+
+
+def sweep_expired_tokens(batch_size=1000, pause=0.0):
+    """
+    Delete expired tokens and device rows in small batches.
+    Returns ``(tokens_deleted, devices_deleted)``.
+    """
+    now = timezone.now()
+    tokens = delete_in_batches(AuthToken.objects.filter(expiry__lt=now), batch_size, pause)
+    devices = delete_in_batches(UserDevice.objects.filter(expiry__lt=now), batch_size, pause)
+    return tokens, devices
@@ -0,0 +1,161 @@
+"""
+Streaming, content-addressed media uploads.
+
+``ContentHashUploadHandler`` hashes uploads chunk by chunk while they are
+spooled to a temporary file and rejects files that are too large, or images
+whose header declares too many pixels, before the rest of the body is
+buffered. ``ContentAddressedStorage`` then names every file after its
+SHA-256 digest so identical uploads share a single file on disk, and
+``StoredFile`` rows count how many model fields point at each file.
+"""
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.db import transaction
+from django.db.models import F
+
+# how much of an image we feed to the header parser before giving up on
+# the early dimension check (the ImageField validation still runs later)
+HEADER_PROBE_BYTES = 256 * 1024
+
+
+class ContentHashUploadHandler(FileUploadHandler):
+    """
+    Stream each uploaded file to disk while computing its SHA-256 digest.
+
+    Rejected files are skipped without buffering the remaining chunks, and
+    the reason is recorded on ``request.upload_rejections`` keyed by field
+    name so views can report it.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = TemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+        self.hasher = hashlib.sha256()
+        self.received = 0
+        self.parser = None
+        if (self.content_type or '').startswith('image/'):
+            # Pillow is only needed here, keep it out of worker startup
+            from PIL import ImageFile
+            self.parser = ImageFile.Parser()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.UPLOAD_MAX_FILE_SIZE:
+            self._reject(f'File exceeds the {settings.UPLOAD_MAX_FILE_SIZE} byte limit.')
+        if self.parser is not None:
+            self._check_dimensions(raw_data)
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.content_hash = self.hasher.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+    def _check_dimensions(self, raw_data):
+        from PIL import Image
+
+        try:
+            self.parser.feed(raw_data)
+        except Image.DecompressionBombError:
+            self._reject('Image has too many pixels.')
+        except Exception:
+            # not decodable as an image, leave it to the model field validation
+            self.parser = None
+            return
+        image = self.parser.image
+        if image is None:
+            if self.received > HEADER_PROBE_BYTES:
+                self.parser = None
+            return
+        self.parser = None
+        max_width, max_height = settings.UPLOAD_MAX_IMAGE_DIMENSIONS
+        width, height = image.size
+        if width > max_width or height > max_height:
+            self._reject(f'Image must be at most {max_width}x{max_height} pixels.')
+
+    def _reject(self, reason):
+        if not hasattr(self.request, 'upload_rejections'):
+            self.request.upload_rejections = {}
+        self.request.upload_rejections[self.field_name] = reason
+        self.file.close()
+        raise SkipFile(reason)
+
+
+def _hash_file(content):
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming files ``<upload_to>/<aa>/<sha256><ext>``.
+
+    Saving content that is already stored returns the existing name without
+    writing anything. New content is written under a temporary name and then
+    linked to its final name, which fails if the name exists: a concurrent
+    upload of the same content got there first and nothing is lost. Django's
+    own handling of an existing name would store a ``<sha256>_<random>`` copy
+    instead.
+    """
+
+    def _save(self, name, content):
+        digest = getattr(content, 'content_hash', None) or _hash_file(content)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(posixpath.dirname(name), digest[:2], digest + extension)
+        if self.exists(name):
+            return name
+        partial = super()._save(
+            posixpath.join(posixpath.dirname(name), f'.{digest}.{uuid.uuid4().hex}.part'), content
+        )
+        try:
+            # readers never see a partly written file under the final name
+            os.link(self.path(partial), self.path(name))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(self.path(partial))
+        return name
+
+
+def acquire_file(name):
+    """Count one more reference to the stored file `name`."""
+    from .models import StoredFile
+
+    if StoredFile.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        return
+    _, created = StoredFile.objects.get_or_create(name=name, defaults={'ref_count': 1})
+    if not created:
+        StoredFile.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release_file(name, storage):
+    """
+    Drop one reference to `name` and delete the file once nothing points at
+    it. Files stored before reference counting are never deleted.
+    """
+    from .models import StoredFile
+
+    if not StoredFile.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1):
+        return
+    deleted, _ = StoredFile.objects.filter(name=name, ref_count=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: storage.delete(name))
@@ -1,25 +1,48 @@
-from django.urls import path
-from django.urls import path
-from .views import SignupView, LoginView, LogoutView, ProfileView, UpdateProfileView, ForgotPasswordView, root
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+import datetime
+from functools import lru_cache
+
+from django.urls import path, register_converter
+from .views import SignupView, LoginView, LogoutView, ProfileView, UpdateProfileView, ForgotPasswordView, OrderListView, OrderDispatchView, OrderDetailView, OrderExportView, OrderPaymentView, IncompleteProfilesView, ProviderRatingSummaryView, ProviderReviewListView, FeedSearchView, MetricsView, AvailabilityView, FreeSlotsView, root
 from rest_framework.permissions import AllowAny
+from kajbondhu.startup import lazy_view
 
 app_name = 'usermanagement'
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="User Management API",
-        default_version='v1',
-        description="API for user signup, login, logout, profile management, and password reset with Knox token authentication",
-        terms_of_service="https://www.example.com/terms/",
-        contact=openapi.Contact(email="contact@example.com"),
-        license=openapi.License(name="MIT License"),
-    ),
-    public=True,
-    permission_classes=(AllowAny,),
-    authentication_classes=(),
-)
+
+class DateConverter:
+    regex = r'\d{4}-\d{2}-\d{2}'
+
+    def to_python(self, value):
+        # an impossible date (2024-02-30) raises ValueError, which Django treats as no match
+        return datetime.date.fromisoformat(value)
+
+    def to_url(self, value):
+        return str(value)
+
+
+register_converter(DateConverter, 'date')
+
+
+@lru_cache(maxsize=None)
+def get_api_schema_view():
+    # drf_yasg's generators and renderers load with the first docs request
+    from drf_yasg.views import get_schema_view
+    from drf_yasg import openapi
+
+    return get_schema_view(
+        openapi.Info(
+            title="User Management API",
+            default_version='v1',
+            description="API for user signup, login, logout, profile management, and password reset with Knox token authentication",
+            terms_of_service="https://www.example.com/terms/",
+            contact=openapi.Contact(email="contact@example.com"),
+            license=openapi.License(name="MIT License"),
+        ),
+        public=True,
+        permission_classes=(AllowAny,),
+        authentication_classes=(),
+    )
+
 
 urlpatterns = [
     path('', root, name='root'),  # Root endpoint
@@ -28,7 +51,19 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout'),
     path('profile/', ProfileView.as_view(), name='profile'),
     path('profile/update/', UpdateProfileView.as_view(), name='update_profile'),
+    path('profiles/incomplete/', IncompleteProfilesView.as_view(), name='incomplete_profiles'),
     path('forgot-password/', ForgotPasswordView.as_view(), name='forgot_password'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('providers/<int:user_id>/rating-summary/', ProviderRatingSummaryView.as_view(), name='provider_rating_summary'),
+    path('providers/<int:user_id>/reviews/', ProviderReviewListView.as_view(), name='provider_reviews'),
+    path('availability/free-slots/', FreeSlotsView.as_view(), name='free_slots'),
+    path('availability/<date:date>/', AvailabilityView.as_view(), name='availability'),
+    path('feeds/search/', FeedSearchView.as_view(), name='feed_search'),
+    path('orders/', OrderListView.as_view(), name='order_list'),
+    path('orders/dispatch/', OrderDispatchView.as_view(), name='order_dispatch'),
+    path('orders/export/', OrderExportView.as_view(), name='order_export'),
+    path('orders/<uuid:order_id>/', OrderDetailView.as_view(), name='order_detail'),
+    path('orders/<uuid:order_id>/payments/', OrderPaymentView.as_view(), name='order_payment'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('swagger/', lazy_view(lambda: get_api_schema_view().with_ui('swagger', cache_timeout=0)), name='schema-swagger-ui'),
+    path('redoc/', lazy_view(lambda: get_api_schema_view().with_ui('redoc', cache_timeout=0)), name='schema-redoc'),
 ]
\ No newline at end of file
@@ -0,0 +1,20 @@
+import time
+
+
+def delete_in_batches(queryset, batch_size, pause=0.0):
+    """
+    Delete the rows matched by `queryset` a small batch at a time so no
+    statement holds locks on many rows. Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        # select a small batch of keys first so each DELETE only locks those rows
+        keys = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        queryset.model.objects.filter(pk__in=keys).delete()
+        deleted += len(keys)
+        if len(keys) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
@@ -1,19 +1,34 @@
+import uuid
+from datetime import datetime, time, timedelta
+
 from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.utils import timezone
 from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.core.mail import send_mail
 from django.conf import settings
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from knox.models import AuthToken
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from knox.auth import TokenAuthentication
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from .serializers import SignupSerializer, LoginSerializer, LogoutSerializer, UserSerializer, UpdateProfileSerializer, ForgotPasswordSerializer
+from .serializers import SignupSerializer, LoginSerializer, LogoutSerializer, UserSerializer, UpdateProfileSerializer, ForgotPasswordSerializer, OrderCreateSerializer, DispatchOrderSerializer, AvailabilitySerializer, OrderPaymentSerializer, IncompleteProfileSerializer, ReviewSerializer, RatingSummarySerializer, FeedSearchResultSerializer
+from django.db import transaction
+from django.db.models import Q
 from django.http import HttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from kajbondhu.pooling import pool_stats
+from kajbondhu.shedding import load_stats
+from kajbondhu.tracing import export_queue, span
+from . import archive, availability, completeness, dispatch, exports, search, tokens
+from .idempotency import idempotent
+from .throttling import EmailRateThrottle, IPRateThrottle
+from .models import Services, UserOrderDetails, UserProfile, UserRating
+from .stats import HISTOGRAM_FIELDS
 
 
 def root(request):
@@ -24,6 +39,10 @@ def root(request):
 
 class SignupView(APIView):
     permission_classes = [AllowAny]
+    # no token lookup for anonymous endpoints, throttles run before any work
+    authentication_classes = []
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = 'signup'
 
     @swagger_auto_schema(
         operation_description="Sign up a new user with email, password, and role (username is set to email).",
@@ -39,14 +58,18 @@ class SignupView(APIView):
                     }
                 )
             ),
-            400: 'Invalid input'
+            400: 'Invalid input',
+            429: 'Too many attempts'
         }
     )
     def post(self, request):
         serializer = SignupSerializer(data=request.data)
-        if serializer.is_valid():
-            user = serializer.save()
-            _, token = AuthToken.objects.create(user)
+        with span('serializer.validate', serializer='SignupSerializer'):
+            valid = serializer.is_valid()
+        if valid:
+            with span('signup.create_user'):
+                user = serializer.save()
+            token = tokens.issue_token(user)
             return Response({
                 'message': 'account created successfully',
                 'token': token,
@@ -55,6 +78,9 @@ class SignupView(APIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = []
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = 'login'
 
     @swagger_auto_schema(
         operation_description="Log in a user with email and password. Blocks login if user is already logged in on another device.",
@@ -71,23 +97,26 @@ class LoginView(APIView):
                 )
             ),
             401: 'Invalid credentials or already logged in',
-            400: 'Invalid input'
+            400: 'Invalid input',
+            429: 'Too many attempts'
         }
     )
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
-        if serializer.is_valid():
-            user = authenticate(
-                username=serializer.validated_data['email'],
-                password=serializer.validated_data['password']
-            )
+        with span('serializer.validate', serializer='LoginSerializer'):
+            valid = serializer.is_valid()
+        if valid:
+            with span('login.authenticate'):
+                user = authenticate(
+                    username=serializer.validated_data['email'],
+                    password=serializer.validated_data['password']
+                )
             if user:
-                existing_tokens = AuthToken.objects.filter(user=user)
-                if existing_tokens.exists():
+                if tokens.has_active_device(user):
                     return Response({
                         'error': 'Not you already log in another device, please logout from this and after that try again'
                     }, status=status.HTTP_401_UNAUTHORIZED)
-                _, token = AuthToken.objects.create(user)
+                token = tokens.issue_token(user)
                 return Response({
                     'message': 'login successfully',
                     'token': token,
@@ -116,7 +145,7 @@ class LogoutView(APIView):
         }
     )
     def post(self, request):
-        AuthToken.objects.filter(user=request.user).delete()
+        tokens.revoke_tokens(request.user)
         return Response({
             'message': 'logout successfully'
         }, status=status.HTTP_200_OK)
@@ -164,6 +193,10 @@ class UpdateProfileView(APIView):
     def patch(self, request):
         profile = request.user.userprofile
         serializer = UpdateProfileSerializer(profile, data=request.data, partial=True)
+        # files refused by the upload handler while streaming (size/dimensions)
+        rejections = getattr(request, 'upload_rejections', None)
+        if rejections:
+            return Response({field: [reason] for field, reason in rejections.items()}, status=status.HTTP_400_BAD_REQUEST)
         if serializer.is_valid():
             serializer.save()
             return Response({'message': 'profile updated successfully'}, status=status.HTTP_200_OK)
@@ -171,6 +204,9 @@ class UpdateProfileView(APIView):
 
 class ForgotPasswordView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = []
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = 'password_reset'
 
     @swagger_auto_schema(
         operation_description="Send a password reset link to the user's email.",
@@ -185,16 +221,20 @@ class ForgotPasswordView(APIView):
                     }
                 )
             ),
-            400: 'Invalid input'
+            400: 'Invalid input',
+            429: 'Too many attempts'
         }
     )
     def post(self, request):
         serializer = ForgotPasswordSerializer(data=request.data)
-        if serializer.is_valid():
+        with span('serializer.validate', serializer='ForgotPasswordSerializer'):
+            valid = serializer.is_valid()
+        if valid:
             email = serializer.validated_data['email']
-            user = User.objects.get(email=email)
+            user = User.objects.filter(email__iexact=email).first()
             token_generator = PasswordResetTokenGenerator()
-            token = token_generator.make_token(user)
+            with span('password_reset.make_token'):
+                token = token_generator.make_token(user)
             uid = urlsafe_base64_encode(force_bytes(user.pk))
             reset_url = f"{request.build_absolute_uri('/')}reset-password/{uid}/{token}/"
             subject = "Password Reset Request"
@@ -207,4 +247,380 @@ class ForgotPasswordView(APIView):
                 fail_silently=False,
             )
             return Response({'message': 'password reset link sent to your email'}, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class OrderListView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="List the orders provided or booked by the authenticated user, newest first, including archived ones, paginated by cursor.",
+        manual_parameters=[
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Page size (default 50, max 200)"),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="next_cursor of the previous page"),
+        ],
+        responses={200: 'Page of orders', 400: 'Invalid input', 401: 'Unauthorized'}
+    )
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 200)
+        except ValueError:
+            return Response({'limit': ['Must be an integer.']}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'limit': ['Must be at least 1.']}, status=status.HTTP_400_BAD_REQUEST)
+        before = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                order_date, order_id = urlsafe_base64_decode(cursor).decode().rsplit('|', 1)
+                before = (parse_datetime(order_date), uuid.UUID(order_id))
+                if before[0] is None:
+                    raise ValueError
+            except ValueError:
+                return Response({'cursor': ['Invalid cursor.']}, status=status.HTTP_400_BAD_REQUEST)
+        orders, last = archive.user_orders(request.user, limit=limit, before=before)
+        next_cursor = None
+        if last:
+            next_cursor = urlsafe_base64_encode(force_bytes(f"{last[0].isoformat()}|{last[1]}"))
+        return Response({'results': orders, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Place an order with a provider. Send an Idempotency-Key header to make retries safe.",
+        request_body=OrderCreateSerializer,
+        manual_parameters=[
+            openapi.Parameter('Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING, description="Unique key per order attempt"),
+        ],
+        responses={201: 'Order created', 400: 'Invalid input', 401: 'Unauthorized', 409: 'Provider not available or same key still in progress', 422: 'Key reused for another request'}
+    )
+    @idempotent
+    def post(self, request):
+        serializer = OrderCreateSerializer(data=request.data)
+        if serializer.is_valid():
+            try:
+                # the slots are booked as the order is saved, see signals.py
+                with transaction.atomic():
+                    order = serializer.save(booking_user=request.user)
+            except availability.SlotsUnavailable:
+                return Response({'error': 'The provider is not available at that time.'}, status=status.HTTP_409_CONFLICT)
+            return Response(archive.serialize_order(order), status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class OrderDispatchView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Place an order and let the server pick the provider: the best rated, least busy provider of the service near the given location who is free at that time.",
+        request_body=DispatchOrderSerializer,
+        manual_parameters=[
+            openapi.Parameter('Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING, description="Unique key per order attempt"),
+        ],
+        responses={201: 'Order created', 400: 'Invalid input', 401: 'Unauthorized', 409: 'No provider available', 422: 'Key reused for another request'}
+    )
+    @idempotent
+    def post(self, request):
+        serializer = DispatchOrderSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        location = (data['latitude'], data['longitude']) if 'latitude' in data else None
+        order = dispatch.dispatch_order(
+            request.user, data['service'], data['selected_payment'], data['order_for_date'],
+            order_details=data.get('order_details'), location=location,
+        )
+        if order is None:
+            return Response({'error': 'No provider is available for this service at that time.'}, status=status.HTTP_409_CONFLICT)
+        return Response(archive.serialize_order(order), status=status.HTTP_201_CREATED)
+
+class OrderDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Retrieve an order with its status history and payments, whether it is live or archived.",
+        responses={200: 'Order details', 401: 'Unauthorized', 404: 'Not found'}
+    )
+    def get(self, request, order_id):
+        order = archive.get_order(order_id)
+        if order is None or request.user.pk not in (order['user'], order['booking_user']):
+            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(order, status=status.HTTP_200_OK)
+
+
+class OrderExportView(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Stream orders with their payments as CSV or NDJSON, optionally gzipped. Staff only.",
+        manual_parameters=[
+            openapi.Parameter('file_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(exports.FORMATS), description="Export format (default csv)"),
+            openapi.Parameter('from', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE, description="First order date to include"),
+            openapi.Parameter('to', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE, description="Last order date to include"),
+            openapi.Parameter('status', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="Only orders with this status"),
+            openapi.Parameter('gzip', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description="Compress the export"),
+        ],
+        responses={200: 'Export file', 400: 'Invalid input', 401: 'Unauthorized', 403: 'Forbidden'}
+    )
+    def get(self, request):
+        params = request.query_params
+        # `format` is reserved by DRF for content negotiation
+        export_format = params.get('file_format', 'csv')
+        if export_format not in exports.FORMATS:
+            return Response({'file_format': [f"Must be one of {', '.join(exports.FORMATS)}."]}, status=status.HTTP_400_BAD_REQUEST)
+        orders = UserOrderDetails.objects.order_by('order_date')
+        # bounds are the start of local days, not a date cast of every row, so
+        # order_status_date_idx serves the range
+        for param, lookup, days_after in (('from', 'order_date__gte', 0), ('to', 'order_date__lt', 1)):
+            if params.get(param):
+                try:
+                    # well formed but impossible dates (2024-02-30) raise ValueError
+                    day = parse_date(params[param]) + timedelta(days=days_after)
+                except (TypeError, ValueError, OverflowError):
+                    return Response({param: ['Must be a date (YYYY-MM-DD).']}, status=status.HTTP_400_BAD_REQUEST)
+                orders = orders.filter(**{lookup: timezone.make_aware(datetime.combine(day, time.min))})
+        if params.get('status'):
+            orders = orders.filter(status=params['status'])
+        compress = params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        return exports.export_response(orders, export_format, compress)
+
+
+class OrderPaymentView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Record a payment for an order booked by the authenticated user. Send an Idempotency-Key header to make retries safe.",
+        request_body=OrderPaymentSerializer,
+        manual_parameters=[
+            openapi.Parameter('Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING, description="Unique key per payment attempt"),
+        ],
+        responses={201: OrderPaymentSerializer, 400: 'Invalid input', 401: 'Unauthorized', 404: 'Not found', 409: 'Same key still in progress', 422: 'Key reused for another request'}
+    )
+    @idempotent
+    def post(self, request, order_id):
+        order = UserOrderDetails.objects.filter(pk=order_id, booking_user=request.user).first()
+        if order is None:
+            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = OrderPaymentSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(order=order)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class IncompleteProfilesView(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="List profiles missing all of the given fields, least complete first. Staff only.",
+        manual_parameters=[
+            openapi.Parameter('missing', openapi.IN_QUERY, type=openapi.TYPE_STRING, description=f"Comma separated fields out of: {', '.join(completeness.PROFILE_FIELDS)}"),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Page size (default 50, max 500)"),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="next_cursor of the previous page"),
+        ],
+        responses={200: IncompleteProfileSerializer(many=True), 400: 'Invalid input', 401: 'Unauthorized', 403: 'Forbidden'}
+    )
+    def get(self, request):
+        names = [name.strip() for name in request.query_params.get('missing', '').split(',') if name.strip()]
+        unknown = [name for name in names if name not in completeness.FIELD_BITS]
+        if unknown:
+            return Response({'missing': [f"Unknown fields: {', '.join(unknown)}."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+            cursor = request.query_params.get('cursor')
+            after = tuple(int(part) for part in cursor.split(':')) if cursor else None
+            if limit < 1 or (after and len(after) != 2):
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'Invalid limit or cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+        profiles = completeness.profiles_missing(names).select_related('user')
+        if after:
+            profiles = profiles.filter(
+                Q(completeness__gt=after[0]) | Q(completeness=after[0], pk__gt=after[1])
+            )
+        page = list(profiles[:limit])
+        next_cursor = f"{page[-1].completeness}:{page[-1].pk}" if len(page) == limit else None
+        return Response({
+            'results': IncompleteProfileSerializer(page, many=True).data,
+            'next_cursor': next_cursor,
+        }, status=status.HTTP_200_OK)
+
+
+class ProviderRatingSummaryView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Average rating, review count and star histogram of a provider.",
+        responses={200: RatingSummarySerializer, 401: 'Unauthorized', 404: 'Not found'}
+    )
+    def get(self, request, user_id):
+        profile = UserProfile.objects.filter(user_id=user_id).only(
+            'user', 'rating', 'review_count', *HISTOGRAM_FIELDS.values()
+        ).first()
+        if profile is None:
+            return Response({'error': 'Provider not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(RatingSummarySerializer(profile).data, status=status.HTTP_200_OK)
+
+class ProviderReviewListView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Reviews of a provider, newest first, paginated by cursor.",
+        manual_parameters=[
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Page size (default 20, max 100)"),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="next_cursor of the previous page"),
+        ],
+        responses={200: ReviewSerializer(many=True), 400: 'Invalid input', 401: 'Unauthorized'}
+    )
+    def get(self, request, user_id):
+        reviews = UserRating.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+            if limit < 1:
+                raise ValueError
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                created_at, pk = urlsafe_base64_decode(cursor).decode().rsplit('|', 1)
+                created_at, pk = parse_datetime(created_at), int(pk)
+                if created_at is None:
+                    raise ValueError
+                # keyset pagination on (created_at, id), served by rating_user_created_idx
+                reviews = reviews.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        except ValueError:
+            return Response({'error': 'Invalid limit or cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+        page = list(reviews[:limit])
+        next_cursor = None
+        if len(page) == limit:
+            last = page[-1]
+            next_cursor = urlsafe_base64_encode(force_bytes(f"{last.created_at.isoformat()}|{last.pk}"))
+        return Response({
+            'results': ReviewSerializer(page, many=True).data,
+            'next_cursor': next_cursor,
+        }, status=status.HTTP_200_OK)
+
+
+class FeedSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Feed posts containing every word of the query, best match first, paginated by cursor.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True, description="Words to search for"),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Page size (default 20, max 100)"),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="next_cursor of the previous page"),
+        ],
+        responses={200: FeedSearchResultSerializer(many=True), 400: 'Invalid input', 401: 'Unauthorized'}
+    )
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        if not search.query_terms(query):
+            return Response({'q': ['Send at least one word to search for.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+            cursor = request.query_params.get('cursor')
+            after = None
+            if cursor:
+                # score:id:weights, the weights the first page was scored with
+                score, feed_id, weights = cursor.split(':')
+                after = (int(score), int(feed_id), tuple(int(weight) for weight in weights.split(',')))
+                if len(after[2]) != len(search.query_terms(query)):
+                    raise ValueError
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'Invalid limit or cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+        results, last = search.search_feeds(query, limit, after)
+        return Response({
+            'results': FeedSearchResultSerializer(results, many=True).data,
+            'next_cursor': f"{last[0]}:{last[1]}:{','.join(map(str, last[2]))}" if last else None,
+        }, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Runtime metrics of the worker serving the request: database pool size, utilization and wait times, request queue times and shed counts, trace export counters. Staff only.",
+        responses={200: 'Metrics', 401: 'Unauthorized', 403: 'Forbidden'}
+    )
+    def get(self, request):
+        return Response({
+            'db_pools': pool_stats(),
+            'load': load_stats.snapshot(),
+            'tracing': export_queue.stats(),
+        }, status=status.HTTP_200_OK)
+
+
+
+class AvailabilityView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Working hours and booked time of the authenticated provider on a day.",
+        responses={200: 'Open and booked ranges', 401: 'Unauthorized'}
+    )
+    def get(self, request, date):
+        masks = availability.day_masks([request.user.pk], date)[request.user.pk]
+        return Response({
+            'date': date,
+            'open': availability.format_ranges(masks[0]),
+            'booked': availability.format_ranges(masks[1]),
+        }, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Set the working hours of the authenticated provider on a day. Time booked by pending orders can't be closed, the conflicting orders are listed instead.",
+        request_body=AvailabilitySerializer,
+        responses={200: 'Open and booked ranges', 400: 'Invalid input', 401: 'Unauthorized', 409: 'Pending orders booked during closed time'}
+    )
+    def put(self, request, date):
+        serializer = AvailabilitySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            availability.set_open_slots(request.user, date, serializer.validated_data['open'])
+        except availability.SlotsBooked as e:
+            return Response({
+                'error': 'Pending orders are booked during the time being closed.',
+                'orders': [str(order_id) for order_id in e.orders],
+            }, status=status.HTTP_409_CONFLICT)
+        return self.get(request, date)
+
+
+class FreeSlotsView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    @swagger_auto_schema(
+        operation_description="Start times on a day at which at least one provider of the service is free, with the number of free providers.",
+        manual_parameters=[
+            openapi.Parameter('service', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True, description="Service name"),
+            openapi.Parameter('date', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True, description="YYYY-MM-DD"),
+            openapi.Parameter('duration', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description=f"Minutes needed (default {settings.ORDER_DURATION_MINUTES})"),
+        ],
+        responses={200: 'Free slots', 400: 'Invalid input', 401: 'Unauthorized', 404: 'Unknown service'}
+    )
+    def get(self, request):
+        try:
+            date = parse_date(request.query_params.get('date', ''))
+            duration = int(request.query_params.get('duration', settings.ORDER_DURATION_MINUTES))
+        except ValueError:
+            date = None
+        if date is None or not 0 < duration <= 24 * 60:
+            return Response({'error': 'Send a valid date and a duration of up to a day.'}, status=status.HTTP_400_BAD_REQUEST)
+        service = Services.objects.filter(name=request.query_params.get('service')).first()
+        if service is None:
+            return Response({'error': 'Unknown service.'}, status=status.HTTP_404_NOT_FOUND)
+        slots = availability.free_slots(service, date, duration)
+        return Response({
+            'service': service.name,
+            'date': date,
+            'duration': duration,
+            'slots': [{'start': start, 'providers': count} for start, count in slots],
+        }, status=status.HTTP_200_OK)